@@ -2,14 +2,14 @@
 Module holding brem bias corrector class
 '''
 from typing                 import Union
-from importlib.resources    import files
 
-import yaml
 import numpy
 from vector                 import MomentumObject4D as v4d
 
 from dmu.logging.log_store   import LogStore
-from rx_data.calo_translator import from_id_to_xy
+from rx_data                 import calo_translator as ctran
+from rx_data.brem_bin_finder import BremBinFinder
+from rx_data                 import brem_maps
 
 log=LogStore.add_logger('rx_data:brem_bias_corrector')
 # --------------------------
@@ -18,47 +18,113 @@ class BremBiasCorrector:
     Class meant to correct bias of brem energy
     '''
     # --------------------------
-    def __init__(self):
-        self._d_corr  = self._load_yaml(pattern='mu_data_24c4MU_bybin_P_ELECTRONENERGY_regionREGION.yaml')
-        self._d_bound = self._load_yaml(pattern='regionREGION_bins.yaml')
+    def __init__(self, maps_path : str = None):
+        '''
+        maps_path: Path to file with compiled correction maps, by default the one shipped with the project
+        '''
+        self._d_map   = brem_maps.load_maps(path=maps_path)
+        self._d_bound = self._get_bounds()
+        self._bfinder = BremBinFinder(d_bound=self._d_bound)
+
+        self._arr_cell_ibin, self._arr_cell_region = self._get_cell_table()
+        self._arr_shifted_p = self._get_shifted_edges()
     # --------------------------
-    def _load_yaml(self, pattern : str) -> dict:
-        path_pattern = files('rx_data_data').joinpath(f'brem_correction/{pattern}')
-        path_pattern = str(path_pattern)
+    def _get_bounds(self) -> dict[int,numpy.ndarray]:
+        arr_bound  = self._d_map['bounds']
+        arr_region = self._d_map['bound_region']
+
+        return { int(region) : arr_bound[arr_region == region] for region in numpy.unique(arr_region) }
+    # --------------------------
+    def _get_shifted_edges(self) -> numpy.ndarray:
+        '''
+        Energy edges of all the maps are concatenated. In order to search all of them with a single call to searchsorted
+        the edges of the i-th map are shifted by i * span, where span is larger than the range of all the edges.
+        This makes the concatenated array sorted.
+        '''
+        arr_p = self._d_map['corr_p']
+        nkey  = len(self._d_map['corr_key'])
+        arr_n = numpy.diff(self._d_map['corr_offset'])
 
-        d_bound = {}
-        for region in [0,1,2]:
-            path = path_pattern.replace('REGION', str(region))
-            with open(path, encoding='utf-8') as ifile:
-                d_bound[region] = yaml.safe_load(ifile)
+        self._pmin = arr_p.min()
+        self._pmax = arr_p.max()
+        self._span = self._pmax - self._pmin + 1
 
-        return d_bound
+        arr_shift = numpy.repeat(numpy.arange(nkey) * self._span, arr_n)
+
+        return arr_shift + (arr_p - self._pmin)
     # --------------------------
-    def _find_among_bounds(self, x : float, y : float, l_l_bound : list) -> Union[None, int]:
-        for ibound, [xmin, xmax, ymin, ymax] in enumerate(l_l_bound):
-            if (xmin < x < xmax) and (ymin < y < ymax):
-                return ibound
+    def _get_cell_table(self) -> tuple[numpy.ndarray,numpy.ndarray]:
+        '''
+        The bin only depends on the ECAL cell where the photon is, this method returns
+        arrays indexed by (area, row, col) with the bin and region of each cell, -1 for cells outside any bin
+        '''
+        geo          = ctran.get_geometry()
+        ibin, region = self._bfinder.find_array(geo.x, geo.y)
 
-        return None
+        nmiss = numpy.count_nonzero((ibin == -1) & ~numpy.isnan(geo.x))
+        if nmiss > 0:
+            log.debug(f'Found {nmiss} cells outside of any bin')
+
+        return ibin, region
     # --------------------------
-    def _find_bin(self, x : float, y : float) -> Union[None, tuple]:
-        for region, l_l_bound in self._d_bound.items():
-            ibin = self._find_among_bounds(x, y, l_l_bound)
-            if ibin is None:
-                continue
+    def get_cell_bins(self, row : numpy.ndarray, col : numpy.ndarray, area : numpy.ndarray) -> tuple[numpy.ndarray,numpy.ndarray]:
+        '''
+        Takes arrays with ECAL row, column and area of photons
+        Returns arrays with bin and region of the corrections, -1 for photons outside any bin or in cells not in ECAL
+        '''
+        geo             = ctran.get_geometry()
+        index, is_valid = geo.get_indices(area=area, row=row, col=col)
+
+        arr_ibin   = numpy.where(is_valid, self._arr_cell_ibin  [index], -1)
+        arr_region = numpy.where(is_valid, self._arr_cell_region[index], -1)
+
+        return arr_ibin, arr_region
+    # --------------------------
+    def get_cell_maps(self) -> dict[str,numpy.ndarray]:
+        '''
+        Returns dictionary with arrays needed to correct photons without bin searches:
+
+        cell_map : Indexed by (area, row, col), holds the index of the correction map of each cell, -1 if there is none
+        offset   : Corrections of the i-th map are in [offset[i], offset[i + 1])
+        p, mu    : Concatenated energy edges and corrections
+        '''
+        arr_imap = self._get_map_index(self._arr_cell_ibin, self._arr_cell_region)
+
+        d_map    = {
+                'cell_map' : arr_imap.astype(numpy.int32),
+                'offset'   : self._d_map['corr_offset'].astype(numpy.int64),
+                'p'        : self._d_map['corr_p' ].astype(float),
+                'mu'       : self._d_map['corr_mu'].astype(float)}
+
+        return d_map
+    # --------------------------
+    def _find_bin(self, row : int, col : int, area : int) -> Union[None, tuple]:
+        index = ctran.get_geometry().get_index(area=area, row=row, col=col)
+        if index is None:
+            raise ValueError(f'Cannot find cell with row/column/area {row}/{col}/{area} in ECAL')
 
-            return ibin, region
+        ibin = self._arr_cell_ibin[index]
+        if ibin == -1:
+            log.warning(f'Cannot find cell with row/column/area {row}/{col}/{area} among bounds')
+            return None
 
-        log.warning(f'Cannot find ({x:.3f}, {y:.3f}) among bounds')
+        region = self._arr_cell_region[index]
 
-        return None
+        return int(ibin), int(region)
     # --------------------------
     def _find_corrections(self, ibin : int, region : int) -> dict:
-        d_corr_reg = self._d_corr[region]
-        key        = region * 10_000 + ibin
-        key        = str(key)
+        arr_key = self._d_map['corr_key']
+        key     = region * 10_000 + ibin
+        index   = numpy.searchsorted(arr_key, key)
+        if index == len(arr_key) or arr_key[index] != key:
+            raise KeyError(f'Cannot find correction for bin {ibin} in region {region}')
+
+        start   = self._d_map['corr_offset'][index]
+        stop    = self._d_map['corr_offset'][index + 1]
 
-        correction = d_corr_reg[key]
+        correction = {
+                'p'  : self._d_map['corr_p' ][start:stop],
+                'mu' : self._d_map['corr_mu'][start:stop]}
 
         return correction
     # --------------------------
@@ -89,13 +155,110 @@ class BremBiasCorrector:
 
         return brem_corr
     # --------------------------
+    def _get_map_index(self, arr_ibin : numpy.ndarray, arr_region : numpy.ndarray) -> numpy.ndarray:
+        '''
+        Takes arrays of bins and regions, returns array of indices of maps, -1 if the map does not exist
+        '''
+        arr_key   = self._d_map['corr_key']
+        arr_val   = arr_region * 10_000 + arr_ibin
+        arr_ind   = numpy.searchsorted(arr_key, arr_val)
+        arr_ind   = numpy.minimum(arr_ind, len(arr_key) - 1)
+        is_found  = (arr_ibin >= 0) & (arr_key[arr_ind] == arr_val)
+
+        return numpy.where(is_found, arr_ind, -1)
+    # --------------------------
+    def _get_mu(self, arr_imap : numpy.ndarray, arr_energy : numpy.ndarray) -> tuple[numpy.ndarray, dict[str,int]]:
+        '''
+        Takes array with map indices, all of them valid, and photon energies
+        Returns corrections with the same binning convention as _apply_correction, and counts of photons with
+        energies below the first edge and with maps that are empty
+        '''
+        arr_start = self._d_map['corr_offset'][arr_imap]
+        arr_stop  = self._d_map['corr_offset'][arr_imap + 1]
+        is_empty  = arr_start == arr_stop
+
+        # numpy.digitize places NaNs above the last edge and values outside the range of all the maps
+        # fall in the first or last bin of any map, thus clipping does not change the bin
+        arr_val   = numpy.where(numpy.isnan(arr_energy), self._pmax, arr_energy)
+        arr_val   = numpy.clip(arr_val, self._pmin, self._pmax)
+        arr_val   = arr_imap * self._span + (arr_val - self._pmin)
+
+        arr_pos   = numpy.searchsorted(self._arr_shifted_p, arr_val, side='right') - 1
+        arr_pos   = numpy.maximum(arr_pos, arr_start)
+        arr_pos   = numpy.where(is_empty, 0, arr_pos)
+
+        arr_mu    = numpy.where(is_empty, 1.0, self._d_map['corr_mu'][arr_pos])
+        is_below  = ~is_empty & ~(arr_energy >= self._d_map['corr_p'][arr_pos])
+
+        d_count   = {
+                'empty_map'    : numpy.count_nonzero(is_empty),
+                'out_of_range' : numpy.count_nonzero(is_below)}
+
+        return arr_mu, d_count
+    # --------------------------
+    def correct_batch(self,
+                      px   : numpy.ndarray,
+                      py   : numpy.ndarray,
+                      pz   : numpy.ndarray,
+                      e    : numpy.ndarray,
+                      row  : numpy.ndarray,
+                      col  : numpy.ndarray,
+                      area : numpy.ndarray) -> tuple[numpy.ndarray,numpy.ndarray,numpy.ndarray,numpy.ndarray]:
+        '''
+        Vectorized version of `correct`
+
+        Parameters
+        ---------------
+        px, py, pz, e  : Arrays with components of the brem photons momenta
+        row, col, area : Arrays with location of the photons in ECAL
+
+        Returns
+        ---------------
+        Tuple with arrays of px, py, pz and energy after the correction.
+        Photons outside the bins or in bins without corrections are not changed.
+        '''
+        arr_e                = numpy.asarray(e, dtype=float)
+        arr_ibin, arr_region = self.get_cell_bins(row=row, col=col, area=area)
+        arr_imap             = self._get_map_index(arr_ibin, arr_region)
+        has_map              = arr_imap >= 0
+
+        arr_mu               = numpy.ones_like(arr_e)
+        arr_val, d_count     = self._get_mu(arr_imap[has_map], arr_e[has_map])
+        arr_mu[has_map]      = arr_val
+
+        d_count['no_bin']     = numpy.count_nonzero(arr_ibin == -1)
+        d_count['no_map']     = numpy.count_nonzero((arr_ibin != -1) & ~has_map)
+        d_count['extreme_mu'] = numpy.count_nonzero((arr_mu < 0.5) | (arr_mu > 3.0))
+        self._log_counts(d_count, ntotal=len(arr_e))
+
+        arr_px = numpy.asarray(px) / arr_mu
+        arr_py = numpy.asarray(py) / arr_mu
+        arr_pz = numpy.asarray(pz) / arr_mu
+        arr_e  = arr_e             / arr_mu
+
+        return arr_px, arr_py, arr_pz, arr_e
+    # --------------------------
+    def _log_counts(self, d_count : dict[str,int], ntotal : int) -> None:
+        d_message = {
+                'no_bin'      : 'outside of the bins or in cells not in ECAL, not corrected',
+                'no_map'      : 'in bins without correction map, not corrected',
+                'empty_map'   : 'in bins with empty correction map, not corrected',
+                'out_of_range': 'with energy below the first edge of the map or NaN, first or last bin used',
+                'extreme_mu'  : 'with correction outside [0.5, 3.0]'}
+
+        for name, message in d_message.items():
+            count = d_count[name]
+            if count == 0:
+                continue
+
+            log.warning(f'Found {count}/{ntotal} photons {message}')
+    # --------------------------
     def correct(self, brem : v4d, row : int, col : int, area : float) -> v4d:
         '''
         Takes 4 vector with brem, the row and column locations in ECAL
         Returns corrected photon
         '''
-        x, y         = from_id_to_xy(row=row, col=col, area=area)
-        val          = self._find_bin(x, y)
+        val          = self._find_bin(row=row, col=col, area=area)
         if val is None:
             return brem
 
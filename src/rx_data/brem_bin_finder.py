@@ -0,0 +1,87 @@
+'''
+Module holding BremBinFinder class
+'''
+from typing import Union
+
+import numpy
+from dmu.logging.log_store import LogStore
+
+log=LogStore.add_logger('rx_data:brem_bin_finder')
+# --------------------------
+class BremBinFinder:
+    '''
+    Class meant to find the region and bin of the brem correction maps in which a point of the calorimeter face is
+
+    The rectangles of all the regions are projected into a grid whose cells are the open intervals between
+    the rectangle edges and the edges themselves. Each cell of the grid holds the first (region, bin) whose
+    rectangle contains it, such that a lookup is two binary searches and an array access.
+    '''
+    # --------------------------
+    def __init__(self, d_bound : dict[int,list[list[float]]]):
+        '''
+        d_bound: Dictionary mapping region index to list of [xmin, xmax, ymin, ymax] rectangles, i.e. the content of regionX_bins.yaml
+        '''
+        l_bound = [ bound for l_bound in d_bound.values() for bound in l_bound ]
+        arr_bnd = numpy.array(l_bound, dtype=float).reshape(-1, 4)
+
+        self._arr_xedge = numpy.unique(arr_bnd[:, :2])
+        self._arr_yedge = numpy.unique(arr_bnd[:, 2:])
+
+        self._arr_region, self._arr_ibin = self._build_grid(d_bound)
+    # --------------------------
+    def _get_slots(self, arr_val : numpy.ndarray, arr_edge : numpy.ndarray) -> numpy.ndarray:
+        '''
+        Takes array of coordinates and the edges along that coordinate, returns index of grid cell where:
+
+        2 * i    : Open interval between edge i - 1 and edge i
+        2 * i + 1: Edge i
+        '''
+        arr_ind = numpy.searchsorted(arr_edge, arr_val, side='left')
+        on_edge = numpy.take(arr_edge, arr_ind, mode='clip') == arr_val
+
+        return 2 * arr_ind + on_edge
+    # --------------------------
+    def _build_grid(self, d_bound : dict[int,list[list[float]]]) -> tuple[numpy.ndarray,numpy.ndarray]:
+        shape      = 2 * len(self._arr_xedge) + 1, 2 * len(self._arr_yedge) + 1
+        arr_region = numpy.full(shape, -1, dtype=int)
+        arr_ibin   = numpy.full(shape, -1, dtype=int)
+
+        for region, l_l_bound in d_bound.items():
+            for ibin, [xmin, xmax, ymin, ymax] in enumerate(l_l_bound):
+                # Bounds are exclusive, the edges themselves are not part of the bin
+                xslc = slice(self._get_slots(xmin, self._arr_xedge) + 1, self._get_slots(xmax, self._arr_xedge))
+                yslc = slice(self._get_slots(ymin, self._arr_yedge) + 1, self._get_slots(ymax, self._arr_yedge))
+
+                # If bins overlap, the first one found is used
+                is_free = arr_region[xslc, yslc] == -1
+                arr_region[xslc, yslc][is_free] = region
+                arr_ibin  [xslc, yslc][is_free] = ibin
+
+        nfree = numpy.count_nonzero(arr_region == -1)
+        log.debug(f'Built grid of shape {shape} with {nfree} cells outside of any bin')
+
+        return arr_region, arr_ibin
+    # --------------------------
+    def find_array(self, x : numpy.ndarray, y : numpy.ndarray) -> tuple[numpy.ndarray,numpy.ndarray]:
+        '''
+        Takes arrays of x and y coordinates, returns arrays with bin and region indices
+        For points outside of all the bins, or NaN coordinates, both indices are -1
+        '''
+        arr_xslot = self._get_slots(numpy.asarray(x, dtype=float), self._arr_xedge)
+        arr_yslot = self._get_slots(numpy.asarray(y, dtype=float), self._arr_yedge)
+
+        arr_ibin   = self._arr_ibin  [arr_xslot, arr_yslot]
+        arr_region = self._arr_region[arr_xslot, arr_yslot]
+
+        return arr_ibin, arr_region
+    # --------------------------
+    def find(self, x : float, y : float) -> Union[None, tuple[int,int]]:
+        '''
+        Takes x and y coordinates, returns tuple with bin and region indices or None if the point is not in any bin
+        '''
+        ibin, region = self.find_array(x, y)
+        if ibin == -1:
+            return None
+
+        return int(ibin), int(region)
+# --------------------------
@@ -0,0 +1,136 @@
+'''
+Module with functions needed to compile the brem correction maps into a binary file and load them
+
+The maps are stored in YAML files, which take seconds to parse. The compiled file holds:
+
+bounds       : Array of [xmin, xmax, ymin, ymax] rectangles of all the regions, as in regionX_bins.yaml
+bound_region : Region of each rectangle
+corr_key     : Sorted array with keys of the correction maps, region * 10_000 + bin
+corr_offset  : Array such that the energy edges and corrections of the i-th key are in [corr_offset[i], corr_offset[i + 1])
+corr_p       : Concatenated energy edges
+corr_mu      : Concatenated corrections
+source_hash  : SHA256 of the YAML files, used to check that the compiled file is not stale
+'''
+import hashlib
+from typing              import Union
+from importlib.resources import files
+
+import yaml
+import numpy
+from dmu.logging.log_store import LogStore
+
+log=LogStore.add_logger('rx_data:brem_maps')
+# --------------------------
+class Data:
+    '''
+    Class used to hold shared data
+    '''
+    l_region     = [0, 1, 2]
+    corr_pattern = 'mu_data_24c4MU_bybin_P_ELECTRONENERGY_regionREGION.yaml'
+    bnd_pattern  = 'regionREGION_bins.yaml'
+    compiled     = 'brem_maps.npz'
+# --------------------------
+def _get_path(name : str) -> str:
+    path = files('rx_data_data').joinpath(f'brem_correction/{name}')
+
+    return str(path)
+# --------------------------
+def _get_yaml_paths(pattern : str) -> list[str]:
+    return [ _get_path(pattern.replace('REGION', str(region))) for region in Data.l_region ]
+# --------------------------
+def _get_source_hash() -> str:
+    hsh = hashlib.sha256()
+    for path in _get_yaml_paths(Data.corr_pattern) + _get_yaml_paths(Data.bnd_pattern):
+        with open(path, 'rb') as ifile:
+            hsh.update(ifile.read())
+
+    return hsh.hexdigest()
+# --------------------------
+def _load_yaml(pattern : str) -> dict[int,object]:
+    d_data = {}
+    for region, path in zip(Data.l_region, _get_yaml_paths(pattern)):
+        with open(path, encoding='utf-8') as ifile:
+            d_data[region] = yaml.safe_load(ifile)
+
+    return d_data
+# --------------------------
+def _maps_from_yaml() -> dict[str,numpy.ndarray]:
+    log.info('Loading brem correction maps from YAML files')
+
+    d_bound = _load_yaml(pattern=Data.bnd_pattern)
+    l_bound = [ bound  for region in Data.l_region for bound in d_bound[region] ]
+    l_bnreg = [ region for region in Data.l_region for _     in d_bound[region] ]
+
+    d_corr  = _load_yaml(pattern=Data.corr_pattern)
+    d_corr  = { int(key) : val for d_corr_reg in d_corr.values() for key, val in d_corr_reg.items() }
+    l_key   = sorted(d_corr)
+    l_size  = [ len(d_corr[key]['p']) for key in l_key ]
+
+    for key in l_key:
+        if len(d_corr[key]['p']) != len(d_corr[key]['mu']):
+            raise ValueError(f'Energy edges and corrections differ in size for key: {key}')
+
+    empty   = numpy.array([], dtype=float)
+    d_map   = {
+            'bounds'       : numpy.array(l_bound, dtype=float).reshape(-1, 4),
+            'bound_region' : numpy.array(l_bnreg, dtype=int),
+            'corr_key'     : numpy.array(l_key  , dtype=int),
+            'corr_offset'  : numpy.concatenate([[0], numpy.cumsum(l_size)]).astype(int),
+            'corr_p'       : numpy.concatenate([empty] + [ numpy.array(d_corr[key]['p' ], dtype=float) for key in l_key ]),
+            'corr_mu'      : numpy.concatenate([empty] + [ numpy.array(d_corr[key]['mu'], dtype=float) for key in l_key ]),
+            }
+
+    return d_map
+# --------------------------
+def compile_maps(out_path : str = None) -> str:
+    '''
+    Reads YAML files with brem correction maps and bins, writes them to a binary file
+
+    out_path: Path to output file, by default the file that load_maps will look for
+    Returns path to compiled file
+    '''
+    out_path = _get_path(Data.compiled) if out_path is None else out_path
+    d_map    = _maps_from_yaml()
+
+    d_map['source_hash'] = numpy.array(_get_source_hash())
+
+    with open(out_path, 'wb') as ofile:
+        numpy.savez(ofile, **d_map)
+
+    log.info(f'Compiled brem correction maps to: {out_path}')
+
+    return out_path
+# --------------------------
+def _maps_from_compiled(path : str, source_hash : str) -> Union[None, dict[str,numpy.ndarray]]:
+    try:
+        with numpy.load(path) as ifile:
+            d_map = { name : ifile[name] for name in ifile.files }
+    except (OSError, ValueError) as exc:
+        log.warning(f'Cannot read compiled brem correction maps {path}: {exc}')
+        return None
+
+    if str(d_map.pop('source_hash', '')) != source_hash:
+        log.warning(f'Compiled brem correction maps are stale: {path}')
+        return None
+
+    log.debug(f'Loaded compiled brem correction maps from: {path}')
+
+    return d_map
+# --------------------------
+def load_maps(path : str = None) -> dict[str,numpy.ndarray]:
+    '''
+    Returns dictionary with arrays describing brem correction maps, see module docstring.
+    Will load them from compiled file if it exists and is up to date, otherwise from YAML files.
+
+    path: Path to compiled file, by default the one shipped with the project
+    '''
+    path        = _get_path(Data.compiled) if path is None else path
+    source_hash = _get_source_hash()
+    d_map       = _maps_from_compiled(path, source_hash)
+    if d_map is not None:
+        return d_map
+
+    log.warning('Falling back to YAML brem correction maps, to speed this up run compile_brem_maps')
+
+    return _maps_from_yaml()
+# --------------------------
@@ -2,12 +2,77 @@
 Module with code needed to retrieve X, Y position from ECAL cell ID
 '''
 
+from typing              import Union
+from dataclasses         import dataclass
+from functools           import cache
 from importlib.resources import files
+
+import numpy
 import pandas as pnd
 from dmu.logging.log_store import LogStore
 
 log=LogStore.add_logger('rx_data:calo_translator')
 # --------------------------------
+class Data:
+    '''
+    Class used to hold shared data
+    '''
+    d_area = {'Outer' : 0, 'Middle' : 1, 'Inner' : 2}
+# --------------------------------
+@dataclass(frozen=True)
+class CaloGeometry:
+    '''
+    Class holding the x, y, z coordinates of the ECAL cells in arrays indexed by (area, row, col)
+    Cells that do not exist in the detector have NaN coordinates
+    '''
+    x : numpy.ndarray
+    y : numpy.ndarray
+    z : numpy.ndarray
+    # --------------------------------
+    def get_index(self, area : int, row : int, col : int) -> Union[None, tuple[int,int,int]]:
+        '''
+        Takes area, row and column of a cell, returns tuple that can be used to index the coordinate arrays
+        or None, if the cell does not exist
+        '''
+        l_index = []
+        for value, size in zip([area, row, col], self.x.shape):
+            # This also rejects NaNs and non integer floats
+            if value is None or not float(value).is_integer():
+                return None
+
+            value = int(value)
+            if not 0 <= value < size:
+                return None
+
+            l_index.append(value)
+
+        index = tuple(l_index)
+        if numpy.isnan(self.x[index]):
+            return None
+
+        return index
+    # --------------------------------
+    def get_indices(self, area : numpy.ndarray, row : numpy.ndarray, col : numpy.ndarray) -> tuple[tuple, numpy.ndarray]:
+        '''
+        Array version of get_index, returns:
+
+        - Tuple of integer arrays that can be used to index the coordinate arrays
+        - Boolean array, false for cells that do not exist, these are given index zero
+        '''
+        l_index  = []
+        is_valid = True
+        for value, size in zip([area, row, col], self.x.shape):
+            value     = numpy.asarray(value, dtype=float)
+            # NaNs and non integer floats fail this
+            is_valid  = is_valid & (numpy.floor(value) == value) & (value >= 0) & (value < size)
+            l_index.append(value)
+
+        l_index  = [ numpy.where(is_valid, value, 0).astype(int) for value in l_index ]
+        index    = tuple(l_index)
+        is_valid = is_valid & ~numpy.isnan(self.x[index])
+
+        return index, is_valid
+# --------------------------------
 def _cast_column(column, ctype) -> pnd.Series:
     column = pnd.to_numeric(column, errors='coerce')
     column = column.fillna(-100_000)
@@ -29,6 +94,47 @@ def get_data() -> pnd.DataFrame:
     df['c'] = _cast_column(df.c, int)
 
     return df
+# --------------------------------
+@cache
+def get_geometry() -> CaloGeometry:
+    '''
+    Returns CaloGeometry instance, the CSV file is read only the first time this function is called
+    '''
+    df = get_data()
+    df = df[(df.a >= 0) & (df.r >= 0) & (df.c >= 0)]
+
+    shape = df.a.max() + 1, df.r.max() + 1, df.c.max() + 1
+    index = df.a.to_numpy(), df.r.to_numpy(), df.c.to_numpy()
+
+    d_arr = {}
+    for name in ['x', 'y', 'z']:
+        arr_val        = numpy.full(shape, numpy.nan)
+        arr_val[index] = df[name].to_numpy()
+        arr_val.flags.writeable = False
+
+        d_arr[name] = arr_val
+
+    log.debug(f'Loaded geometry of {len(df)} cells into arrays of shape {shape}')
+
+    return CaloGeometry(**d_arr)
+# ------------------------------------------------------
+def _xy_from_geometry(row : int, col : int, det : str, area : int) -> tuple[float,float]:
+    if det is not None and area is not None and Data.d_area[det] != area:
+        raise ValueError(f'Subdetector {det} does not correspond to area {area}')
+
+    if area is None:
+        area = Data.d_area[det]
+
+    geo   = get_geometry()
+    index = geo.get_index(area=area, row=row, col=col)
+    if index is None:
+        log.info(f'{"Row":<10}{row}')
+        log.info(f'{"Col":<10}{col}')
+        log.info(f'{"Det":<10}{det}')
+        log.info(f'{"Reg":<10}{area}')
+        raise ValueError('Cannot find cell in ECAL geometry')
+
+    return geo.x[index], geo.y[index]
 # ------------------------------------------------------
 def from_id_to_xy(row : int = None, col : int = None, det : str = None, area : int = None) -> tuple[float,float]:
     '''
@@ -38,7 +144,7 @@ def from_id_to_xy(row : int = None, col : int = None, det : str = None, area : i
     row: Row index
     col: Column index
     det: Name of subdetector, Inner, Middle, Outer
-    area: Index of subdetector 0 (Inner), 1 (Middle), 2 (Outer)
+    area: Index of subdetector 0 (Outer), 1 (Middle), 2 (Inner)
 
     Returns
     --------------
@@ -52,6 +158,10 @@ def from_id_to_xy(row : int = None, col : int = None, det : str = None, area : i
             'Outer']:
         raise ValueError(f'Invalid subdetector name: \"{det}\"')
 
+    # Fully specified cell, use cached geometry
+    if row is not None and col is not None and (det is not None or area is not None):
+        return _xy_from_geometry(row=row, col=col, det=det, area=area)
+
     df = get_data()
     if area is not None:
         df = df[df.a==area]
@@ -65,32 +175,35 @@ def from_id_to_xy(row : int = None, col : int = None, det : str = None, area : i
     if col is not None:
         df = df[df.c==col]
 
-    are = area
-
-    has_row = row is not None
-    has_col = col is not None
-    has_det = det is not None
-    has_are = are is not None
-
-    full_description = has_row and has_col and (has_det or has_are)
-
-    if not full_description and len(df) <= 1:
+    if len(df) <= 1:
         log.error(df)
         raise ValueError('Expected dataframe with more than one row')
 
-    if not full_description and len(df) > 1:
-        return df
+    return df
+# ------------------------------------------------------
+def from_ids_to_xy(row : numpy.ndarray, col : numpy.ndarray, area : numpy.ndarray) -> tuple[numpy.ndarray,numpy.ndarray]:
+    '''
+    Vectorized version of from_id_to_xy
 
-    if full_description and len(df) != 1:
-        log.error(df)
-        log.info(f'{"Row":<10}{row}')
-        log.info(f'{"Col":<10}{col}')
-        log.info(f'{"Det":<10}{det}')
-        log.info(f'{"Reg":<10}{are}')
-        raise ValueError('Expected dataframe with one row')
+    Parameters
+    --------------
+    row : Array of row indices
+    col : Array of column indices
+    area: Array of subdetector indices 0 (Outer), 1 (Middle), 2 (Inner)
+
+    Returns
+    --------------
+    Tuple with arrays of x and y coordinates, cells that do not exist in the detector, e.g. -1 for electrons without brem, get NaN
+    '''
+    geo             = get_geometry()
+    index, is_valid = geo.get_indices(area=area, row=row, col=col)
+
+    arr_x = numpy.where(is_valid, geo.x[index], numpy.nan)
+    arr_y = numpy.where(is_valid, geo.y[index], numpy.nan)
 
-    x = df.iloc[0]['x']
-    y = df.iloc[0]['y']
+    ninvalid = numpy.count_nonzero(~is_valid)
+    if ninvalid > 0:
+        log.debug(f'Found {ninvalid} cells not in the detector')
 
-    return x, y
+    return arr_x, arr_y
 # ------------------------------------------------------
@@ -0,0 +1,51 @@
+'''
+Module holding ColumnFetcher class
+'''
+import numpy
+from ROOT                  import RDataFrame
+from dmu.logging.log_store import LogStore
+
+log=LogStore.add_logger('rx_data:column_fetcher')
+# --------------------------
+class ColumnFetcher:
+    '''
+    Class meant to read columns from a dataframe once, and serve them to several calculators, e.g.
+
+    fetcher = ColumnFetcher(rdf=rdf)
+    obj_1   = HOPCalculator(rdf=rdf, fetcher=fetcher)
+    obj_2   = SWPCalculator(rdf=rdf, ..., fetcher=fetcher)
+
+    The calculators request the columns they need when they are built, the first time any of them gets its columns,
+    all the requested columns are read in a single event loop. The arrays are kept as long as the fetcher exists.
+    '''
+    # --------------------------
+    def __init__(self, rdf : RDataFrame):
+        '''
+        rdf: ROOT dataframe from which columns are read
+        '''
+        self._rdf    = rdf
+        self._s_req  = set()
+        self._d_data = {}
+    # --------------------------
+    def request(self, l_col : list[str]) -> None:
+        '''
+        Registers columns that will be needed, they are read together with the others in the first call to `get`
+        '''
+        l_late = [ col for col in l_col if col not in self._s_req and len(self._d_data) > 0 ]
+        if len(l_late) > 0:
+            log.warning(f'Columns requested after reading, they will need another event loop: {l_late}')
+
+        self._s_req.update(l_col)
+    # --------------------------
+    def get(self, l_col : list[str]) -> dict[str,numpy.ndarray]:
+        '''
+        Returns dictionary mapping column names to arrays, columns not read yet are read, with all the requested ones
+        '''
+        s_miss = set(l_col) - set(self._d_data)
+        if len(s_miss) > 0:
+            l_read = sorted((self._s_req | s_miss) - set(self._d_data))
+            log.info(f'Reading {len(l_read)} columns')
+            self._d_data.update(self._rdf.AsNumpy(l_read))
+
+        return { col : self._d_data[col] for col in l_col }
+# --------------------------
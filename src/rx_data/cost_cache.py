@@ -0,0 +1,98 @@
+'''
+Module holding CostCache class
+'''
+import os
+import json
+import fcntl
+from contextlib import contextmanager
+
+from dmu.logging.log_store import LogStore
+
+log=LogStore.add_logger('rx_data:cost_cache')
+# --------------------------
+class CostCache:
+    '''
+    Class meant to store the time needed to process files, for each kind of calculation, in a JSON file
+    that can be shared by jobs running at the same time. The file holds:
+
+    {kind : {version : {file_name : [entries, seconds]}}}
+
+    The measurements are used to estimate the cost of processing a file, as its number of entries times the
+    time per entry of each kind. Only measurements from other versions are used, such that all the jobs of a
+    campaign, which write measurements for the same version, see the same costs.
+    '''
+    # --------------------------
+    def __init__(self, path : str):
+        '''
+        path: Path to JSON file, created if it does not exist
+        '''
+        self._path      = path
+        self._lock_path = f'{path}.lock'
+    # --------------------------
+    @contextmanager
+    def _lock(self, exclusive : bool):
+        dir_name = os.path.dirname(self._path)
+        if dir_name != '':
+            os.makedirs(dir_name, exist_ok=True)
+
+        with open(self._lock_path, 'a', encoding='utf-8') as ofile:
+            fcntl.flock(ofile, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(ofile, fcntl.LOCK_UN)
+    # --------------------------
+    def _read(self) -> dict:
+        if not os.path.isfile(self._path):
+            return {}
+
+        try:
+            with open(self._path, encoding='utf-8') as ifile:
+                return json.load(ifile)
+        except json.JSONDecodeError as exc:
+            log.warning(f'Cannot read cost cache {self._path}, ignoring it: {exc}')
+            return {}
+    # --------------------------
+    def add(self, version : str, name : str, entries : int, d_seconds : dict[str,float]) -> None:
+        '''
+        Stores time needed to process a file
+
+        version  : Version of the outputs
+        name     : Name of the file
+        entries  : Number of entries in the file
+        d_seconds: Dictionary mapping each kind of calculation done on the file to the time it needed
+        '''
+        with self._lock(exclusive=True):
+            d_cost = self._read()
+            for kind, seconds in d_seconds.items():
+                d_cost.setdefault(kind, {}).setdefault(version, {})[name] = [entries, seconds]
+
+            tmp_path = f'{self._path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as ofile:
+                json.dump(d_cost, ofile, indent=4, sort_keys=True)
+
+            os.replace(tmp_path, self._path)
+    # --------------------------
+    def get_rates(self, kinds : list[str], version : str) -> dict[str,float]:
+        '''
+        Returns dictionary with time per entry for each kind, from measurements of versions other than `version`
+        Kinds without measurements get the average rate of the other kinds, or 1 if there are no measurements
+        '''
+        with self._lock(exclusive=False):
+            d_cost = self._read()
+
+        d_rate = {}
+        for kind in kinds:
+            l_meas   = [ meas for vers, d_meas in d_cost.get(kind, {}).items() if vers != version for meas in d_meas.values() ]
+            nentries = sum(entries for entries, _ in l_meas)
+            seconds  = sum(seconds for _, seconds in l_meas)
+            if nentries == 0:
+                log.debug(f'No measurements found for {kind}')
+                continue
+
+            d_rate[kind] = seconds / nentries
+
+        default = sum(d_rate.values()) / len(d_rate) if len(d_rate) > 0 else 1.0
+
+        return { kind : d_rate.get(kind, default) for kind in kinds }
+# --------------------------
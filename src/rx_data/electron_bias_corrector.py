@@ -2,11 +2,17 @@
 Module with ElectronBiasCorrector class
 '''
 import math
+from typing                 import Union
+
+import numpy
 import pandas as pnd
+import ROOT
+from ROOT                   import RDataFrame
 from dmu.logging.log_store  import LogStore
 from vector                 import MomentumObject3D as v3d
 from vector                 import MomentumObject4D as v4d
 
+import rx_data.utilities         as ut
 from rx_data.brem_bias_corrector import BremBiasCorrector
 
 log=LogStore.add_logger('rx_data:electron_bias_corrector')
@@ -21,6 +27,13 @@ class ElectronBiasCorrector:
     brem_track_2: This will:
         - For electrons with brem: Do nothing
         - For electrons without brem: If `BREMTRACKBASEDENERGY > 50 MeV` add brem, otherwise do nothing.
+
+    The instances hold no per-call state, the methods can be called concurrently from several threads.
+    The corrections return, together with the electron, the brem status:
+
+    -1 : If the electron is not touched
+     0 : If the electron is not assigned any brem
+     1 : If the electron is assigned brem
     '''
     # ---------------------------------
     def __init__(self, skip_correction : bool = False, brem_energy_threshold : float = 300):
@@ -32,20 +45,15 @@ class ElectronBiasCorrector:
         self._mass            = 0.511
         self._min_brem_energy = brem_energy_threshold
         self._bcor            = BremBiasCorrector()
-        self._name : str
-
-        # -1 : If the electron is not touched
-        #  0 : If the electron is not assigned any brem
-        #  1 : If the electron is assigned brem
-        self._brem_status : int
+        self._maps_declared   = False
 
         if self._skip_correction:
             log.warning('Skipping electron correction')
     # ---------------------------------
-    def _get_electron(self, row : pnd.Series, kind : str) -> v4d:
-        px = self._attr_from_row(row, f'{self._name}_{kind}PX')
-        py = self._attr_from_row(row, f'{self._name}_{kind}PY')
-        pz = self._attr_from_row(row, f'{self._name}_{kind}PZ')
+    def _get_electron(self, row : pnd.Series, name : str, kind : str) -> v4d:
+        px = self._attr_from_row(row, f'{name}_{kind}PX')
+        py = self._attr_from_row(row, f'{name}_{kind}PY')
+        pz = self._attr_from_row(row, f'{name}_{kind}PZ')
 
         e_3d = v3d(px=px, py=py, pz=pz)
         pt   = e_3d.pt
@@ -57,8 +65,8 @@ class ElectronBiasCorrector:
 
         return e_4d
     # ---------------------------------
-    def _get_ebrem(self, row : pnd.Series, e_track : v4d) -> v4d:
-        e_full = self._get_electron(row, kind='')
+    def _get_ebrem(self, row : pnd.Series, name : str, e_track : v4d) -> v4d:
+        e_full = self._get_electron(row, name=name, kind='')
         e_brem = e_full - e_track
         e_brem = e_brem.to_pxpypzenergy()
 
@@ -82,37 +90,37 @@ class ElectronBiasCorrector:
 
         return e_brem
     # ---------------------------------
-    def _update_row(self, row : pnd.Series, e_corr : v4d) -> pnd.Series:
+    def _update_row(self, row : pnd.Series, name : str, e_corr : v4d, brem_status : int) -> pnd.Series:
         # If correction was not applied, do not update anything
         if e_corr is None:
             return row
 
         l_var = [
-                f'{self._name}_PX',
-                f'{self._name}_PY',
-                f'{self._name}_PZ']
+                f'{name}_PX',
+                f'{name}_PY',
+                f'{name}_PZ']
 
         row.loc[l_var] = [e_corr.px, e_corr.py, e_corr.pz]
 
         l_var = [
-                f'{self._name}_PT' ,
-                f'{self._name}_ETA',
-                f'{self._name}_PHI']
+                f'{name}_PT' ,
+                f'{name}_ETA',
+                f'{name}_PHI']
 
         row.loc[l_var] = [e_corr.pt, e_corr.eta, e_corr.phi]
 
-        row = self._update_brem(row)
+        row = self._update_brem(row, name, brem_status)
 
         return row
     # ---------------------------------
-    def _update_brem(self, row : pnd.Series) -> pnd.Series:
-        if self._brem_status == -1:
+    def _update_brem(self, row : pnd.Series, name : str, brem_status : int) -> pnd.Series:
+        if brem_status == -1:
             return row
 
-        if self._brem_status not in [0, 1]:
-            raise ValueError(f'Invalid brem status: {self._brem_status}')
+        if brem_status not in [0, 1]:
+            raise ValueError(f'Invalid brem status: {brem_status}')
 
-        row.loc[[f'{self._name}_HASBREMADDED']] = [self._brem_status]
+        row.loc[[f'{name}_HASBREMADDED']] = [brem_status]
 
         return row
     # ---------------------------------
@@ -125,26 +133,24 @@ class ElectronBiasCorrector:
 
         raise ValueError(f'Cannot find attribute {name} among:')
     # ---------------------------------
-    def _correct_with_bias_maps(self, e_track : v4d, e_brem : v4d, row : pnd.Series) -> v4d:
+    def _correct_with_bias_maps(self, e_track : v4d, e_brem : v4d, row : pnd.Series, name : str) -> tuple[v4d,int]:
         '''
         Takes track electron, brem and row in dataframe representing entry in TTree
-        Returns electron after correction
+        Returns electron after correction and brem status
         '''
         if self._skip_correction:
             log.warning('Skipping electron correction')
-            self._brem_status = -1
-            return e_track + e_brem
+            return e_track + e_brem, -1
 
         # Will only correct brem, no brem => no correction
-        if not self._attr_from_row(row, f'{self._name}_HASBREMADDED'):
-            self._brem_status = -1
-            return e_track + e_brem
+        if not self._attr_from_row(row, f'{name}_HASBREMADDED'):
+            return e_track + e_brem, -1
 
         log.info('Applying ecalo_bias correction')
 
-        brem_row = self._attr_from_row(row, f'{self._name}_BREMHYPOROW')
-        brem_col = self._attr_from_row(row, f'{self._name}_BREMHYPOCOL')
-        brem_area= self._attr_from_row(row, f'{self._name}_BREMHYPOAREA')
+        brem_row = self._attr_from_row(row, f'{name}_BREMHYPOROW')
+        brem_col = self._attr_from_row(row, f'{name}_BREMHYPOCOL')
+        brem_area= self._attr_from_row(row, f'{name}_BREMHYPOAREA')
 
         e_brem_corr = self._bcor.correct(brem=e_brem, row=brem_row, col=brem_col, area=brem_area)
 
@@ -162,24 +168,21 @@ class ElectronBiasCorrector:
 
         self._check_massless_brem(e_brem_corr)
 
-        self._brem_status = 1
         e_corr = e_track + e_brem_corr
 
-        return e_corr
+        return e_corr, 1
     # ---------------------------------
-    def _correct_with_track_brem_1(self, e_track : v4d, row : pnd.Series) -> v4d:
+    def _correct_with_track_brem_1(self, e_track : v4d, row : pnd.Series, name : str) -> tuple[Union[None,v4d],int]:
         '''
         Take electron from tracking system and brem, as well as dataframe row representing entry in TTree
-        Create brem photon colinear to track, add it to track, return sum
+        Create brem photon colinear to track, add it to track, return sum and brem status
         '''
         if self._skip_correction:
-            self._brem_status = -1
-            return None
+            return None, -1
 
-        brem_energy = self._attr_from_row(row, f'{self._name}_BREMTRACKBASEDENERGY')
+        brem_energy = self._attr_from_row(row, f'{name}_BREMTRACKBASEDENERGY')
         if brem_energy < self._min_brem_energy:
-            self._brem_status = 0
-            return e_track
+            return e_track, 0
 
         eta = e_track.eta
         phi = e_track.phi
@@ -194,31 +197,53 @@ class ElectronBiasCorrector:
 
         gamma  = v4d(px=px, py=py, pz=pz, e=e)
 
-        self._brem_status = 1
         self._check_massless_brem(gamma)
 
-        return e_track + gamma
+        return e_track + gamma, 1
     # ---------------------------------
-    def _correct_with_track_brem_2(self, e_track : v4d, row : pnd.Series) -> v4d:
+    def _correct_with_track_brem_2(self, e_track : v4d, row : pnd.Series, name : str) -> tuple[Union[None,v4d],int]:
         '''
         Smarter strategy than brem_track_1
         '''
         # If electron has brem, leave it untouched
-        if self._attr_from_row(row, f'{self._name}_HASBREMADDED'):
-            self._brem_status = -1
-            return None
+        if self._attr_from_row(row, f'{name}_HASBREMADDED'):
+            return None, -1
 
-        brem_energy = self._attr_from_row(row, f'{self._name}_BREMTRACKBASEDENERGY')
+        brem_energy = self._attr_from_row(row, f'{name}_BREMTRACKBASEDENERGY')
         # If brem is below self._min_brem_energy, this is not actual brem
         # return original electron
         if brem_energy <  self._min_brem_energy:
-            self._brem_status = -1
-            return None
+            return None, -1
 
         # The electron had no brem, but brem was found, correct electron with strategy 1.
-        e_corr = self._correct_with_track_brem_1(e_track, row)
+        return self._correct_with_track_brem_1(e_track, row, name)
+    # ---------------------------------
+    def correct_electron(self, row : pnd.Series, name : str, kind : str = 'brem_track_2') -> tuple[Union[None,v4d],int]:
+        '''
+        Corrects kinematics without modifying the row
 
-        return e_corr
+        row  : Pandas dataframe row
+        name : Particle name, e.g. L1
+        kind : Type of correction, [ecalo_bias, brem_track_1, brem_track_2]
+
+        Returns tuple with corrected electron, None if the electron is not to be changed, and brem status
+        '''
+        e_track = self._get_electron(row, name=name, kind='TRACK_')
+
+        if   kind == 'ecalo_bias':
+            e_brem              = self._get_ebrem(row, name, e_track)
+            e_corr, brem_status = self._correct_with_bias_maps(e_track, e_brem, row, name)
+        elif kind == 'brem_track_1':
+            e_corr, brem_status = self._correct_with_track_brem_1(e_track, row, name)
+        elif kind == 'brem_track_2':
+            e_corr, brem_status = self._correct_with_track_brem_2(e_track, row, name)
+        else:
+            raise NotImplementedError(f'Invalid correction of type: {kind}')
+
+        if brem_status not in [-1, 0, 1]:
+            raise ValueError(f'Brem status is invalid: {brem_status}')
+
+        return e_corr, brem_status
     # ---------------------------------
     def correct(self, row : pnd.Series, name : str, kind : str = 'brem_track_2') -> pnd.Series:
         '''
@@ -227,25 +252,210 @@ class ElectronBiasCorrector:
         name : Particle name, e.g. L1
         kind : Type of correction, [ecalo_bias, brem_track_1, brem_track_2]
         '''
-        self._name       = name
-        self._brem_status= None
+        e_corr, brem_status = self.correct_electron(row, name=name, kind=kind)
+
+        row = self._update_row(row, name, e_corr, brem_status)
+
+        return row
+    # ---------------------------------
+    def _get_column(self, data : Union[dict[str,numpy.ndarray], pnd.DataFrame], name : str) -> numpy.ndarray:
+        if name in data:
+            return numpy.asarray(data[name])
+
+        for col_name in data:
+            log.info(col_name)
+
+        raise ValueError(f'Cannot find column {name} among the ones above')
+    # ---------------------------------
+    def _get_track_columns(self, data : Union[dict[str,numpy.ndarray], pnd.DataFrame], name : str, kind : str) -> tuple[numpy.ndarray,...]:
+        '''
+        Returns px, py, pz and energy of electron, with electron mass hypothesis
+        '''
+        arr_px = self._get_column(data, f'{name}_{kind}PX').astype(float)
+        arr_py = self._get_column(data, f'{name}_{kind}PY').astype(float)
+        arr_pz = self._get_column(data, f'{name}_{kind}PZ').astype(float)
+        arr_e  = numpy.sqrt(arr_px ** 2 + arr_py ** 2 + arr_pz ** 2 + self._mass ** 2)
+
+        return arr_px, arr_py, arr_pz, arr_e
+    # ---------------------------------
+    def _correct_columns_with_bias_maps(self, data : Union[dict[str,numpy.ndarray], pnd.DataFrame], name : str) -> tuple[numpy.ndarray,...]:
+        '''
+        Columnar version of _correct_with_bias_maps
+        Returns px, py, pz arrays of corrected electrons, array with updated entries and brem status
+        '''
+        l_track = self._get_track_columns(data, name, kind='TRACK_')
+        l_full  = self._get_track_columns(data, name, kind='')
+        l_brem  = [ full - track for full, track in zip(l_full, l_track) ]
+
+        nentries   = len(l_track[0])
+        is_updated = numpy.ones(nentries, dtype=bool)
+        arr_status = numpy.full(nentries, -1)
+        if self._skip_correction:
+            log.warning('Skipping electron correction')
+            return *l_full[:3], is_updated, arr_status
+
+        # Will only correct brem, no brem => no correction
+        has_brem = self._get_column(data, f'{name}_HASBREMADDED') != 0
+        arr_row  = self._get_column(data, f'{name}_BREMHYPOROW' )[has_brem]
+        arr_col  = self._get_column(data, f'{name}_BREMHYPOCOL' )[has_brem]
+        arr_area = self._get_column(data, f'{name}_BREMHYPOAREA')[has_brem]
+
+        l_brem_corr = self._bcor.correct_batch(*[ brem[has_brem] for brem in l_brem[:4] ], row=arr_row, col=arr_col, area=arr_area)
+
+        l_corr = []
+        for full, track, brem_corr in zip(l_full[:3], l_track[:3], l_brem_corr[:3]):
+            corr           = full.copy()
+            corr[has_brem] = track[has_brem] + brem_corr
+            l_corr.append(corr)
+
+        arr_status[has_brem] = 1
+
+        return *l_corr, is_updated, arr_status
+    # ---------------------------------
+    def _correct_columns_with_track_brem(self, data : Union[dict[str,numpy.ndarray], pnd.DataFrame], name : str, kind : str) -> tuple[numpy.ndarray,...]:
+        '''
+        Columnar version of _correct_with_track_brem_1 and _correct_with_track_brem_2
+        Returns px, py, pz arrays of corrected electrons, array with updated entries and brem status
+        '''
+        l_track    = self._get_track_columns(data, name, kind='TRACK_')
+        nentries   = len(l_track[0])
+        arr_status = numpy.full(nentries, -1)
+
+        if self._skip_correction:
+            return *l_track[:3], numpy.zeros(nentries, dtype=bool), arr_status
+
+        arr_energy = self._get_column(data, f'{name}_BREMTRACKBASEDENERGY')
+        is_low     = arr_energy < self._min_brem_energy
+        add_brem   = ~is_low
+
+        if kind == 'brem_track_1':
+            is_updated = numpy.ones(nentries, dtype=bool)
+        elif kind == 'brem_track_2':
+            # Only electrons without brem and with enough track based brem energy are touched
+            has_brem   = self._get_column(data, f'{name}_HASBREMADDED') != 0
+            add_brem   = add_brem & ~has_brem
+            is_updated = add_brem
+        else:
+            raise NotImplementedError(f'Invalid correction of type: {kind}')
+
+        arr_status[is_updated] = 0
+        arr_status[add_brem]   = 1
+
+        # Photon is colinear to the track and massless
+        arr_p  = numpy.sqrt(l_track[0] ** 2 + l_track[1] ** 2 + l_track[2] ** 2)
+        factor = numpy.where(add_brem, arr_energy / arr_p, 0)
+        l_corr = [ (1 + factor) * track for track in l_track[:3] ]
+
+        return *l_corr, is_updated, arr_status
+    # ---------------------------------
+    def correct_columns(self,
+                        data : Union[dict[str,numpy.ndarray], pnd.DataFrame],
+                        name : str,
+                        kind : str = 'brem_track_2') -> dict[str,numpy.ndarray]:
+        '''
+        Columnar version of `correct`, corrects all the candidates at once
+
+        data : Dictionary of numpy arrays or pandas dataframe, with the same columns needed by `correct`
+        name : Particle name, e.g. L1
+        kind : Type of correction, [ecalo_bias, brem_track_1, brem_track_2]
+
+        Returns dictionary with arrays for {name}_PX, PY, PZ, PT, ETA, PHI and HASBREMADDED
+        where the entries not touched by the correction keep their original values
+        '''
+        if   kind == 'ecalo_bias':
+            arr_px, arr_py, arr_pz, is_updated, arr_status = self._correct_columns_with_bias_maps(data, name)
+        elif kind in ['brem_track_1', 'brem_track_2']:
+            arr_px, arr_py, arr_pz, is_updated, arr_status = self._correct_columns_with_track_brem(data, name, kind)
+        else:
+            raise NotImplementedError(f'Invalid correction of type: {kind}')
+
+        arr_pt = numpy.hypot(arr_px, arr_py)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            arr_eta = numpy.arcsinh(arr_pz / arr_pt)
+
+        d_corr = {
+                f'{name}_PX'  : arr_px,
+                f'{name}_PY'  : arr_py,
+                f'{name}_PZ'  : arr_pz,
+                f'{name}_PT'  : arr_pt,
+                f'{name}_ETA' : arr_eta,
+                f'{name}_PHI' : numpy.arctan2(arr_py, arr_px)}
+
+        d_data = {}
+        for column, arr_corr in d_corr.items():
+            arr_org        = self._get_column(data, column)
+            d_data[column] = numpy.where(is_updated, arr_corr, arr_org)
+
+        column         = f'{name}_HASBREMADDED'
+        arr_org        = self._get_column(data, column)
+        is_touched     = is_updated & (arr_status != -1)
+        d_data[column] = numpy.where(is_touched, arr_status, arr_org).astype(arr_org.dtype)
+
+        return d_data
+    # ---------------------------------
+    def _declare_maps(self) -> None:
+        '''
+        Declares C++ corrections and passes the brem correction maps to them
+        '''
+        if self._maps_declared:
+            return
+
+        ut.declare_cpp('electron_corrector.h')
+
+        d_map              = self._bcor.get_cell_maps()
+        arr_cell           = numpy.ascontiguousarray(d_map['cell_map'])
+        narea, nrow, ncol  = arr_cell.shape
+        nmap               = len(d_map['offset']) - 1
+
+        ROOT.rx_data.electron_corrector.set_maps(
+                arr_cell, narea, nrow, ncol,
+                d_map['offset'], nmap,
+                d_map['p'], d_map['mu'])
 
-        e_track = self._get_electron(row, kind='TRACK_')
+        self._maps_declared = True
+    # ---------------------------------
+    def define_columns(self, rdf : RDataFrame, name : str, kind : str = 'brem_track_2') -> RDataFrame:
+        '''
+        RDataFrame version of `correct_columns`, the corrections run in compiled C++ code within the event loop
+
+        rdf  : ROOT dataframe, preprocessed with `utilities.preprocess_rdf`
+        name : Particle name, e.g. L1
+        kind : Type of correction, [ecalo_bias, brem_track_1, brem_track_2]
+
+        Returns dataframe where {name}_PX, PY, PZ, PT, ETA, PHI and HASBREMADDED are redefined
+        with the entries not touched by the correction keeping their original values
+        '''
+        self._declare_maps()
+
+        nsp   = 'rx_data::electron_corrector'
+        skip  = 'true' if self._skip_correction else 'false'
+        track = f'{name}_TRACK_PX, {name}_TRACK_PY, {name}_TRACK_PZ'
 
         if   kind == 'ecalo_bias':
-            e_brem = self._get_ebrem(row, e_track)
-            e_corr = self._correct_with_bias_maps(e_track, e_brem, row)
+            expr = f'{nsp}::ecalo_bias({track}, {name}_PX, {name}_PY, {name}_PZ, {name}_HASBREMADDED, {name}_BREMHYPOROW, {name}_BREMHYPOCOL, {name}_BREMHYPOAREA, {skip})'
         elif kind == 'brem_track_1':
-            e_corr = self._correct_with_track_brem_1(e_track, row)
+            expr = f'{nsp}::brem_track_1({track}, {name}_BREMTRACKBASEDENERGY, {self._min_brem_energy}, {skip})'
         elif kind == 'brem_track_2':
-            e_corr = self._correct_with_track_brem_2(e_track, row)
+            expr = f'{nsp}::brem_track_2({track}, {name}_HASBREMADDED, {name}_BREMTRACKBASEDENERGY, {self._min_brem_energy}, {skip})'
         else:
             raise NotImplementedError(f'Invalid correction of type: {kind}')
 
-        if self._brem_status not in [-1, 0, 1]:
-            raise ValueError(f'Brem status is invalid: {self._brem_status}')
+        corr  = f'{name}_ecorr_{kind}'
+        pt    = f'std::hypot({corr}[0], {corr}[1])'
+        d_def = {
+                f'{name}_PX'  : f'{corr}[0]',
+                f'{name}_PY'  : f'{corr}[1]',
+                f'{name}_PZ'  : f'{corr}[2]',
+                f'{name}_PT'  : pt,
+                f'{name}_ETA' : f'std::asinh({corr}[2] / {pt})',
+                f'{name}_PHI' : f'std::atan2({corr}[1], {corr}[0])'}
 
-        row = self._update_row(row, e_corr)
+        rdf = rdf.Define(corr, expr)
+        for column, expr in d_def.items():
+            rdf = rdf.Redefine(column, f'{corr}[3] != 0 ? double({expr}) : double({column})')
 
-        return row
+        column = f'{name}_HASBREMADDED'
+        rdf    = rdf.Redefine(column, f'{corr}[3] != 0 && {corr}[4] != -1 ? int({corr}[4]) : int({column})')
+
+        return rdf
 # ---------------------------------
@@ -0,0 +1,225 @@
+'''
+Module with functions needed to describe inputs and record, next to each output, how it was made
+
+The manifest of an output is a JSON file with the same path plus `.json`, containing:
+
+input        : Fingerprint of the input file, see get_fingerprint and add_checksum
+settings     : Settings that change the content of the output, e.g. maximum number of entries
+code_version : Version of rx_data used to make the output
+'''
+# pylint: disable=broad-exception-caught
+
+import os
+import json
+import socket
+import hashlib
+from typing             import Union
+from importlib.metadata import version, PackageNotFoundError
+
+from dmu.logging.log_store import LogStore
+
+import rx_data.utilities   as ut
+
+log=LogStore.add_logger('rx_data:file_manifest')
+# --------------------------
+class Data:
+    '''
+    Class used to hold shared data
+    '''
+    sample_size = 1024 ** 2
+    block_size  = 16 * 1024 ** 2
+# --------------------------
+def get_code_version() -> str:
+    '''
+    Returns version of installed rx_data project
+    '''
+    try:
+        return version('rx_data')
+    except PackageNotFoundError:
+        log.warning('Cannot find version of rx_data, is it installed?')
+        return 'unknown'
+# --------------------------
+def get_key(settings : dict) -> str:
+    '''
+    Returns short hash identifying the settings and the version of the code
+    used to make outputs, e.g. to separate markers of processed files
+    made with different settings
+    '''
+    d_key = {'settings' : settings, 'code_version' : get_code_version()}
+    value = json.dumps(d_key, sort_keys=True)
+
+    return hashlib.sha256(value.encode()).hexdigest()[:12]
+# --------------------------
+def _get_quick_hash(path : str, size : int) -> str:
+    '''
+    Hash of the first and last MB of the file, cheap to calculate and changes when the file is rewritten
+    '''
+    hsh = hashlib.sha256()
+    with open(path, 'rb') as ifile:
+        hsh.update(ifile.read(Data.sample_size))
+        ifile.seek(max(0, size - Data.sample_size))
+        hsh.update(ifile.read(Data.sample_size))
+
+    return hsh.hexdigest()
+# --------------------------
+def _get_checksum(path : str) -> str:
+    '''
+    Hash of the whole file
+    '''
+    hsh = hashlib.sha256()
+    with open(path, 'rb') as ifile:
+        for block in iter(lambda : ifile.read(Data.block_size), b''):
+            hsh.update(block)
+
+    return hsh.hexdigest()
+# --------------------------
+def get_fingerprint(path : str, tree_name : str = 'DecayTree', checksum : bool = False) -> dict:
+    '''
+    Returns dictionary describing the input file, with size, modification time,
+    number of entries in the tree and a hash of the beginning and end of the file
+
+    checksum: If true, a hash of the whole file is added, see add_checksum
+    '''
+    real_path = os.path.realpath(path)
+    stat      = os.stat(real_path)
+
+    d_fpr     = {
+            'name'      : os.path.basename(path),
+            'size'      : stat.st_size,
+            'mtime'     : stat.st_mtime,
+            'entries'   : ut.get_entries(real_path, tree_name),
+            'quick_hash': _get_quick_hash(real_path, stat.st_size)}
+
+    if checksum:
+        add_checksum(d_fpr, path)
+
+    return d_fpr
+# --------------------------
+def add_checksum(fingerprint : dict, path : str) -> None:
+    '''
+    Adds to fingerprint of file a hash of the whole file. Slow, but copies of the same file,
+    e.g. in a new version of the inputs, are found to be the same input, even if their modification times differ
+    '''
+    if 'checksum' in fingerprint:
+        return
+
+    fingerprint['checksum'] = _get_checksum(os.path.realpath(path))
+# --------------------------
+def _is_same_input(d_old : Union[None, dict], d_new : dict) -> bool:
+    '''
+    Compares fingerprints, the checksums are used when both have them, otherwise the modification times and partial hashes
+    '''
+    if d_old is None:
+        return False
+
+    l_key = ['name', 'size', 'entries']
+    if 'checksum' in d_old and 'checksum' in d_new:
+        l_key.append('checksum')
+    else:
+        l_key += ['mtime', 'quick_hash']
+
+    return all(d_old.get(key) == d_new.get(key) for key in l_key)
+# --------------------------
+def _get_manifest_path(out_path : str) -> str:
+    return f'{out_path}.json'
+# --------------------------
+def write_manifest(out_path : str, fingerprint : dict, settings : dict) -> None:
+    '''
+    Writes manifest of output
+
+    out_path   : Path to output file
+    fingerprint: Fingerprint of input, from get_fingerprint
+    settings   : Dictionary with settings that change the content of the output
+    '''
+    d_man = {
+            'input'        : fingerprint,
+            'settings'     : settings,
+            'code_version' : get_code_version()}
+
+    man_path = _get_manifest_path(out_path)
+    tmp_path = f'{man_path}.{socket.gethostname()}_{os.getpid()}.part'
+    with open(tmp_path, 'w', encoding='utf-8') as ofile:
+        json.dump(d_man, ofile, indent=4, sort_keys=True)
+
+    os.replace(tmp_path, man_path)
+# --------------------------
+def remove_manifest(out_path : str) -> None:
+    '''
+    Removes manifest of output, if it exists
+    '''
+    man_path = _get_manifest_path(out_path)
+    if os.path.isfile(man_path):
+        os.remove(man_path)
+# --------------------------
+def read_manifest(out_path : str) -> Union[None, dict]:
+    '''
+    Returns manifest of output, None if it does not exist or cannot be read
+    '''
+    man_path = _get_manifest_path(out_path)
+    if not os.path.isfile(man_path):
+        return None
+
+    try:
+        with open(man_path, encoding='utf-8') as ifile:
+            return json.load(ifile)
+    except json.JSONDecodeError as exc:
+        log.warning(f'Cannot read manifest {man_path}: {exc}')
+        return None
+# --------------------------
+def adopt(out_path : str, fingerprint : dict, settings : dict, tree_name : str = 'DecayTree') -> bool:
+    '''
+    Meant for outputs made before manifests were introduced. If the output exists, has no manifest
+    and its tree can be read, a manifest is written for it and true is returned.
+
+    The content of the output is not checked against the input, it is assumed to come from it, with these settings
+    '''
+    if not os.path.isfile(out_path) or read_manifest(out_path) is not None:
+        return False
+
+    try:
+        ut.get_entries(out_path, tree_name)
+    except Exception as exc:
+        log.warning(f'Cannot read tree {tree_name} in {out_path}, not adopting it: {exc}')
+        return False
+
+    log.warning(f'Adopting output without manifest: {out_path}')
+    write_manifest(out_path, fingerprint, settings)
+
+    return True
+# --------------------------
+def is_up_to_date(out_path : str, fingerprint : dict, settings : dict, same_code : bool = False) -> bool:
+    '''
+    Returns true if the output exists and was made from the same input, with the same settings
+
+    Outputs without manifest are not trusted, they might come from jobs that were killed while writing them,
+    outputs made before manifests were introduced can be trusted with `adopt`.
+    Outputs made with other versions of the code are used, but a warning is shown, unless `same_code` is true,
+    in which case they are not up to date.
+    '''
+    if not os.path.isfile(out_path):
+        log.debug(f'Missing: {out_path}')
+        return False
+
+    d_man = read_manifest(out_path)
+    if d_man is None:
+        log.info(f'No manifest found, remaking: {out_path}')
+        return False
+
+    if not _is_same_input(d_man.get('input'), fingerprint):
+        log.debug(f'Input changed: {out_path}')
+        return False
+
+    if d_man.get('settings') != settings:
+        log.info(f'Settings changed, remaking: {out_path}')
+        return False
+
+    code_version = get_code_version()
+    if d_man.get('code_version') != code_version and same_code:
+        log.debug(f'Made with rx_data {d_man.get("code_version")}, current version is {code_version}: {out_path}')
+        return False
+
+    if d_man.get('code_version') != code_version:
+        log.warning(f'Output made with rx_data {d_man.get("code_version")}, current version is {code_version}: {out_path}')
+
+    return True
+# --------------------------
@@ -1,14 +1,15 @@
 '''
 Module containing HOPVarCalculator class
 '''
-import math
-from typing import Union
+from typing    import Union
 
 import numpy
 from ROOT      import RDataFrame, RDF
-from ROOT.Math import LorentzVector, XYZVector
 from dmu.logging.log_store  import LogStore
 
+import rx_data.utilities    as ut
+from rx_data.column_fetcher import ColumnFetcher
+
 log = LogStore.add_logger('rx_data:hop_calculator')
 # -------------------------------
 class HOPCalculator:
@@ -18,104 +19,135 @@ class HOPCalculator:
     https://cds.cern.ch/record/2102345/files/LHCb-INT-2015-037.pdf
     '''
     # -------------------------------
-    def __init__(self, rdf : RDataFrame):
+    def __init__(self, rdf : RDataFrame, fetcher : Union[ColumnFetcher,None] = None):
+        '''
+        rdf    : ROOT dataframe
+        fetcher: If passed, the input columns will be read through it, see ColumnFetcher
+        '''
         self._rdf           = rdf
+        self._fetcher       = fetcher
         self._extra_branches= ['EVENTNUMBER', 'RUNNUMBER']
+        self._d_vector      = {
+                'L1_P'   : 4,
+                'L2_P'   : 4,
+                'H_P'    : 4,
+                'B_BPV'  : 3,
+                'B_END_V': 3}
+
+        if self._fetcher is not None:
+            self._fetcher.request(self.get_input_columns())
     # -------------------------------
-    def _val_to_vector(self, arr_val : numpy.ndarray, ndim : int) -> Union[LorentzVector, XYZVector]:
-        if   ndim == 4:
-            [px, py, pz, pe] = arr_val.tolist()
-            vector = LorentzVector('ROOT::Math::PxPyPzE4D<double>')(px, py, pz, pe)
-        elif ndim == 3:
-            [px, py, pz    ] = arr_val.tolist()
-            vector = XYZVector(px, py, pz)
-        else:
-            raise NotImplementedError(f'Invalid dimentionality: {ndim}')
+    def get_input_columns(self) -> list[str]:
+        '''
+        Returns names of columns read from the input dataframe
+        '''
+        l_branch = [ f'{name}{axis}' for name, ndim in self._d_vector.items() for axis in 'XYZE'[:ndim] ]
 
-        return vector
+        return l_branch + self._extra_branches
     # -------------------------------
-    def _get_xvector(self, name : str, ndim : int) -> list[LorentzVector]:
-        if   ndim == 4:
-            l_branch = [f'{name}X', f'{name}Y', f'{name}Z', f'{name}E']
-        elif ndim == 3:
-            l_branch = [f'{name}X', f'{name}Y', f'{name}Z']
-        else:
-            raise NotImplementedError(f'Invalid ndim={ndim}')
-
-        d_data   = self._rdf.AsNumpy(l_branch)
-        l_array  = [ d_data[branch] for branch in l_branch ]
-        arr_dat  = numpy.array(l_array).T
-        l_4vec   = [ self._val_to_vector(arr_val, ndim) for arr_val in arr_dat ]
+    def _get_xvector(self, d_data : dict[str,numpy.ndarray], name : str) -> numpy.ndarray:
+        '''
+        Returns array of shape (nentries, ndim) with the components of the vector
+        '''
+        ndim     = self._d_vector[name]
+        l_branch = [ f'{name}{axis}' for axis in 'XYZE'[:ndim] ]
 
-        return l_4vec
+        return numpy.stack([ d_data[branch].astype(float) for branch in l_branch ], axis=1)
     # -------------------------------
-    def _get_alpha(self, pv : XYZVector, sv : XYZVector, l1 : LorentzVector, l2 : LorentzVector, kp : LorentzVector) -> float:
-        l1_3v     = l1.Vect()
-        l2_3v     = l2.Vect()
-        ll_3v     = l1_3v + l2_3v
-        kp_3v     = kp.Vect()
-        bp_dr     = sv - pv
-
-        cos_thhad = bp_dr.Dot(kp_3v) / (kp_3v.R() * bp_dr.R())
-        sin_thhad = math.sqrt(1.0 - cos_thhad ** 2)
-        had_pt    = kp_3v.R() * sin_thhad
-
-        cos_thll  = bp_dr.Dot(ll_3v) / (ll_3v.R() * bp_dr.R())
-        sin_thll  = math.sqrt(1.0 - cos_thll ** 2 )
-        ll_pt     = ll_3v.R() * sin_thll
-
-        alpha     = had_pt / ll_pt if ll_pt > 0. else 1.0
+    def _get_transverse(self, arr_dr : numpy.ndarray, arr_mom : numpy.ndarray) -> numpy.ndarray:
+        '''
+        Returns component of momenta perpendicular to the direction of flight
+        '''
+        arr_p   = numpy.linalg.norm(arr_mom, axis=1)
+        arr_cos = numpy.sum(arr_dr * arr_mom, axis=1) / (arr_p * numpy.linalg.norm(arr_dr, axis=1))
+        # Rounding can make the cosine slightly larger than 1
+        arr_sin = numpy.sqrt(numpy.clip(1.0 - arr_cos ** 2, 0, None))
 
-        return alpha
+        return arr_p * arr_sin
     # -------------------------------
-    def _correct_kinematics(self, alpha : float, particle : LorentzVector) -> LorentzVector:
-        px = alpha * particle.px()
-        py = alpha * particle.py()
-        pz = alpha * particle.pz()
-        ms =         particle.M()
+    def _get_alpha(self, pv : numpy.ndarray, sv : numpy.ndarray, l1 : numpy.ndarray, l2 : numpy.ndarray, kp : numpy.ndarray) -> numpy.ndarray:
+        bp_dr  = sv - pv
+        had_pt = self._get_transverse(bp_dr, kp[:, :3])
+        ll_pt  = self._get_transverse(bp_dr, l1[:, :3] + l2[:, :3])
 
-        return LorentzVector('ROOT::Math::PxPyPzM4D<double>')(px, py, pz, ms)
+        # NaNs fail the comparison, these candidates get 1
+        return numpy.where(ll_pt > 0., had_pt / ll_pt, 1.0)
     # -------------------------------
-    def _get_values(self) -> tuple[list[float], list[float]]:
-        l_l1 = self._get_xvector(ndim=4, name='L1_P'   )
-        l_l2 = self._get_xvector(ndim=4, name='L2_P'   )
-        l_kp = self._get_xvector(ndim=4, name='H_P'    )
-        l_pv = self._get_xvector(ndim=3, name='B_BPV'  )
-        l_sv = self._get_xvector(ndim=3, name='B_END_V')
-
-        l_alpha = []
-        l_mass  = []
-        for pv, sv, l1, l2, kp in zip(l_pv, l_sv, l_l1, l_l2, l_kp):
-            alpha   = self._get_alpha(pv, sv, l1, l2, kp)
-            l1_corr = self._correct_kinematics(alpha, l1)
-            l2_corr = self._correct_kinematics(alpha, l2)
-            mass    = (l1_corr + l2_corr + kp).M()
-
-            l_alpha.append(alpha)
-            l_mass.append(mass)
-
-        return l_alpha, l_mass
-    # -------------------------------
-    def _attach_extra_branches(self, d_data : dict) -> RDataFrame:
-        log.debug(f'Attaching extra branches: {self._extra_branches}')
+    def _correct_kinematics(self, alpha : numpy.ndarray, particle : numpy.ndarray) -> numpy.ndarray:
+        '''
+        Scales momenta by alpha keeping the masses, returns array with px, py, pz, e
+        Like in ROOT, negative squared masses are kept and energies are at least zero
+        '''
+        arr_m2 = particle[:, 3] ** 2 - numpy.sum(particle[:, :3] ** 2, axis=1)
+        arr_p  = alpha[:, None] * particle[:, :3]
+        arr_e  = numpy.sqrt(numpy.clip(numpy.sum(arr_p ** 2, axis=1) + arr_m2, 0, None))
 
-        d_ext = self._rdf.AsNumpy(self._extra_branches)
-        d_data.update(d_ext)
+        return numpy.column_stack([arr_p, arr_e])
+    # -------------------------------
+    def _get_mass(self, l_particle : list[numpy.ndarray]) -> numpy.ndarray:
+        '''
+        Returns mass of sum of particles, negative for negative squared masses, as in ROOT
+        '''
+        arr_sum = sum(l_particle)
+        arr_m2  = arr_sum[:, 3] ** 2 - numpy.sum(arr_sum[:, :3] ** 2, axis=1)
 
-        return d_data
+        return numpy.sign(arr_m2) * numpy.sqrt(numpy.abs(arr_m2))
+    # -------------------------------
+    def _get_values(self, d_data : dict[str,numpy.ndarray]) -> tuple[numpy.ndarray, numpy.ndarray]:
+        l1 = self._get_xvector(d_data, 'L1_P'   )
+        l2 = self._get_xvector(d_data, 'L2_P'   )
+        kp = self._get_xvector(d_data, 'H_P'    )
+        pv = self._get_xvector(d_data, 'B_BPV'  )
+        sv = self._get_xvector(d_data, 'B_END_V')
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            arr_alpha = self._get_alpha(pv, sv, l1, l2, kp)
+            l1_corr   = self._correct_kinematics(arr_alpha, l1)
+            l2_corr   = self._correct_kinematics(arr_alpha, l2)
+            arr_mass  = self._get_mass([l1_corr, l2_corr, kp])
+
+        return arr_alpha, arr_mass
     # -------------------------------
     def get_rdf(self, preffix : str) -> RDataFrame:
         '''
         Returns ROOT dataframe with HOP variables
         '''
+        l_branch = self.get_input_columns()
+        log.debug(f'Reading branches: {l_branch}')
+
+        # All the branches are read in a single event loop
+        if self._fetcher is None:
+            d_inp = self._rdf.AsNumpy(l_branch)
+        else:
+            d_inp = self._fetcher.get(l_branch)
+
+        arr_alpha, arr_mass = self._get_values(d_inp)
 
-        l_alpha, l_mass = self._get_values()
-        arr_alpha       = numpy.array(l_alpha)
-        arr_mass        = numpy.array(l_mass )
-        d_data          = {f'{preffix}_alpha' : arr_alpha, f'{preffix}_mass' : arr_mass}
-        d_data          = self._attach_extra_branches(d_data)
+        d_data              = {f'{preffix}_alpha' : arr_alpha, f'{preffix}_mass' : arr_mass}
+        d_data.update({ name : d_inp[name] for name in self._extra_branches })
 
         rdf = RDF.FromNumpy(d_data)
 
+        return rdf
+    # -------------------------------
+    def _get_arguments(self, name : str, ndim : int) -> str:
+        return ', '.join(f'{name}{axis}' for axis in 'XYZE'[:ndim])
+    # -------------------------------
+    def define_columns(self, preffix : str = 'hop') -> RDataFrame:
+        '''
+        Returns input dataframe with {preffix}_alpha and {preffix}_mass columns, defined with compiled C++ code
+        Nothing is computed until the columns are used, which can happen with implicit multithreading,
+        e.g. on dataframes from RDFGetter, without the need of a friend tree with the HOP variables
+        '''
+        ut.declare_cpp('hop_calculator.h')
+
+        nsp   = 'rx_data::hop_calculator'
+        l_3d  = [ self._get_arguments(name, ndim=3) for name in ['B_BPV', 'B_END_V', 'L1_P', 'L2_P', 'H_P'] ]
+        l_4d  = [ self._get_arguments(name, ndim=4) for name in ['L1_P', 'L2_P', 'H_P'] ]
+        alpha = f'{preffix}_alpha'
+
+        rdf   = self._rdf.Define(alpha, f'{nsp}::get_alpha({", ".join(l_3d)})')
+        rdf   = rdf.Define(f'{preffix}_mass', f'{nsp}::get_mass({alpha}, {", ".join(l_4d)})')
+
         return rdf
 # -------------------------------
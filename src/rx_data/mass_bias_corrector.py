@@ -3,8 +3,13 @@ Module storing MassBiasCorrector class
 '''
 # pylint: disable=too-many-return-statements
 
+import os
+import tempfile
+from typing import Union
+
 import vector
 import numpy
+import uproot
 import pandas as pnd
 from pandarallel                     import pandarallel
 from ROOT                            import RDataFrame, RDF
@@ -12,6 +17,7 @@ from dmu.logging.log_store           import LogStore
 
 import rx_data.utilities             as ut
 from rx_data.electron_bias_corrector import ElectronBiasCorrector
+from rx_data.column_fetcher          import ColumnFetcher
 
 log=LogStore.add_logger('rx_data:mass_bias_corrector')
 # ------------------------------------------
@@ -20,23 +26,43 @@ class MassBiasCorrector:
     Class meant to correct B mass without DTF constraint
     by correcting biases in electrons
     '''
+    l_engine = ['numpy', 'pandas', 'root']
+    l_column = [
+            'L1_PT', 'L1_PX', 'L1_PY', 'L1_PZ', 'L1_HASBREMADDED',
+            'L2_PT', 'L2_PX', 'L2_PY', 'L2_PZ', 'L2_HASBREMADDED',
+            'B_M'  , 'Jpsi_M', 'EVENTNUMBER', 'RUNNUMBER']
     # ------------------------------------------
     def __init__(self,
                  rdf                   : RDataFrame,
                  skip_correction       : bool  = False,
                  nthreads              : int   = 1,
                  brem_energy_threshold : float = 400,
-                 ecorr_kind            : str   = 'brem_track_2'):
+                 ecorr_kind            : str   = 'brem_track_2',
+                 engine                : str   = 'numpy',
+                 fetcher               : Union[ColumnFetcher,None] = None):
         '''
         rdf : ROOT dataframe
         skip_correction: Will do everything but not correction. Needed to check that only the correction is changing data.
         nthreads : Number of threads, used by pandarallel
         brem_energy_threshold: Lowest energy that an ECAL cluster needs to have to be considered a photon, used as argument of ElectronBiasCorrector, default 0 (MeV)
         ecorr_kind : Kind of correction to be added to electrons, [ecalo_bias, brem_track]
+        engine : How the correction is calculated:
+            numpy : Default, all the candidates are corrected at once with array operations
+            pandas: Row by row, with pandas apply (or pandarallel), slow, kept for validation
+            root  : Columns are added with Define, using compiled C++ code. Nothing is computed until the dataframe is used
+                    and the event loop can run with ROOT implicit multithreading. Unlike the other engines, the dataframe
+                    keeps all the input columns, use get_columns to pick the outputs, and entries with NaNs are not dropped
+        fetcher : If passed, get_rdf will read the input columns through it, see ColumnFetcher. Its dataframe has to be
+                  preprocessed with utilities.preprocess_rdf. Not used by the root engine or by save
         '''
-        self._df              = ut.df_from_rdf(rdf)
+        if engine not in self.l_engine:
+            raise ValueError(f'Invalid engine {engine}, expected one of: {self.l_engine}')
+
+        self._rdf             = rdf
         self._skip_correction = skip_correction
         self._nthreads        = nthreads
+        self._engine          = engine
+        self._fetcher         = fetcher
 
         self._ebc        = ElectronBiasCorrector(brem_energy_threshold = brem_energy_threshold)
         self._emass      = 0.511
@@ -45,8 +71,11 @@ class MassBiasCorrector:
 
         self._set_loggers()
 
-        if self._nthreads > 1:
+        if self._nthreads > 1 and self._engine == 'pandas':
             pandarallel.initialize(nb_workers=self._nthreads, progress_bar=True)
+
+        if self._fetcher is not None and self._engine != 'root':
+            self._fetcher.request(self.get_input_columns())
     # ------------------------------------------
     def _set_loggers(self) -> None:
         LogStore.set_level('rx_data:brem_bias_corrector'    , 50)
@@ -100,10 +129,103 @@ class MassBiasCorrector:
 
         return df
     # ------------------------------------------
+    def _get_momentum(self, df : pnd.DataFrame, name : str, mass : float) -> tuple[numpy.ndarray,...]:
+        arr_pt  = df[f'{name}_PT' ].to_numpy()
+        arr_eta = df[f'{name}_ETA'].to_numpy()
+        arr_phi = df[f'{name}_PHI'].to_numpy()
+
+        arr_px  = arr_pt * numpy.cos(arr_phi)
+        arr_py  = arr_pt * numpy.sin(arr_phi)
+        arr_pz  = arr_pt * numpy.sinh(arr_eta)
+        arr_e   = numpy.sqrt(arr_px ** 2 + arr_py ** 2 + arr_pz ** 2 + mass ** 2)
+
+        return arr_px, arr_py, arr_pz, arr_e
+    # ------------------------------------------
+    def _get_mass(self, l_momentum : list[tuple[numpy.ndarray,...]]) -> numpy.ndarray:
+        arr_px, arr_py, arr_pz, arr_e = [ sum(l_component) for l_component in zip(*l_momentum) ]
+
+        with numpy.errstate(invalid='ignore'):
+            arr_mass = numpy.sqrt(arr_e ** 2 - arr_px ** 2 - arr_py ** 2 - arr_pz ** 2)
+
+        return numpy.where(numpy.isnan(arr_mass), -1, arr_mass)
+    # ------------------------------------------
+    def _correct_with_numpy(self, df : pnd.DataFrame) -> pnd.DataFrame:
+        '''
+        Array version of _calculate_correction, applied to the whole dataframe
+        '''
+        if not self._skip_correction:
+            for name in ['L1', 'L2']:
+                d_corr = self._ebc.correct_columns(df, name=name, kind=self._ecorr_kind)
+                for column, arr_val in d_corr.items():
+                    df[column] = arr_val
+
+        l1 = self._get_momentum(df, 'L1', self._emass)
+        l2 = self._get_momentum(df, 'L2', self._emass)
+        kp = self._get_momentum(df,  'H', self._kmass)
+
+        df['B_M'   ] = self._get_mass([l1, l2, kp])
+        df['Jpsi_M'] = self._get_mass([l1, l2])
+
+        return df
+    # ------------------------------------------
+    def _correct_with_pandas(self, df : pnd.DataFrame) -> pnd.DataFrame:
+        if self._nthreads > 1:
+            sr_data = df.parallel_apply(self._calculate_correction, axis=1)
+        else:
+            sr_data = df.apply(self._calculate_correction, axis=1)
+
+        l_var     = sr_data.columns
+        df[l_var] = sr_data
+
+        return df
+    # ------------------------------------------
+    def _get_rdf_with_root(self, suffix : str) -> RDataFrame:
+        '''
+        Equivalent of _get_corrected_df, where everything is done with Define
+        '''
+        rdf = ut.preprocess_rdf(self._rdf)
+        if not self._skip_correction:
+            for name in ['L1', 'L2']:
+                rdf = self._ebc.define_columns(rdf, name=name, kind=self._ecorr_kind)
+
+        ut.declare_cpp('electron_corrector.h')
+        nsp   = 'rx_data::electron_corrector'
+        d_lep = {'L1' : self._emass, 'L2' : self._emass, 'H' : self._kmass}
+        d_def = {'B_M' : ['L1', 'L2', 'H'], 'Jpsi_M' : ['L1', 'L2']}
+        for mass_name, l_name in d_def.items():
+            l_arg = [ 'ROOT::RVecD{' + ', '.join(f'{name}_{var}' for name in l_name) + '}' for var in ['PT', 'ETA', 'PHI'] ]
+            l_arg+= [ 'ROOT::RVecD{' + ', '.join(str(d_lep[name]) for name in l_name) + '}' ]
+            expr  = f'{nsp}::get_mass({", ".join(l_arg)})'
+
+            rdf   = rdf.Redefine(mass_name, expr) if rdf.HasColumn(mass_name) else rdf.Define(mass_name, expr)
+
+        if suffix is None:
+            return rdf
+
+        for name in self.l_column:
+            rdf = rdf.Define(f'{name}_{suffix}', name)
+
+        return rdf
+    # ------------------------------------------
+    def get_input_columns(self) -> list[str]:
+        '''
+        Returns names of columns read from the input dataframe
+        '''
+        return ut.pick_columns(self._rdf)
+    # ------------------------------------------
+    def get_columns(self, suffix : str = None) -> list[str]:
+        '''
+        Returns list of names of corrected columns, as they will appear in the dataframe returned by get_rdf
+
+        suffix: Same as in get_rdf
+        '''
+        if suffix is None:
+            return list(self.l_column)
+
+        return [ f'{name}_{suffix}' for name in self.l_column ]
+    # ------------------------------------------
     def _filter_df(self, df : pnd.DataFrame) -> float:
-        l_to_keep  = ['L1_PT', 'L1_PX', 'L1_PY', 'L1_PZ', 'L1_HASBREMADDED']
-        l_to_keep += ['L2_PT', 'L2_PX', 'L2_PY', 'L2_PZ', 'L2_HASBREMADDED']
-        l_to_keep += ['B_M'  , 'Jpsi_M', 'EVENTNUMBER', 'RUNNUMBER']
+        l_to_keep  = self.l_column
 
         log.debug(20 * '-')
         log.debug('Keeping variables:')
@@ -123,27 +245,88 @@ class MassBiasCorrector:
 
         return df
     # ------------------------------------------
-    def get_rdf(self, suffix: str = None) -> RDataFrame:
-        '''
-        Returns corrected ROOT dataframe
+    def _get_input_df(self) -> pnd.DataFrame:
+        if self._fetcher is None:
+            return ut.df_from_rdf(self._rdf)
 
-        mass_name (str) : Name of the column containing the corrected mass, by default B_M
-        '''
-        log.info('Applying bias correction')
+        d_data = self._fetcher.get(self.get_input_columns())
 
-        df = self._df
-        if self._nthreads > 1:
-            sr_data = df.parallel_apply(self._calculate_correction, axis=1)
+        return ut.df_from_data(d_data)
+    # ------------------------------------------
+    def _get_corrected_df(self, df : pnd.DataFrame, suffix : str) -> pnd.DataFrame:
+        if self._engine == 'numpy':
+            df = self._correct_with_numpy(df)
         else:
-            sr_data = df.apply(self._calculate_correction, axis=1)
-
-        l_var     = sr_data.columns
-        df[l_var] = sr_data
+            df = self._correct_with_pandas(df)
 
         df        = self._filter_df(df)
         df        = df.fillna(-1)
         df        = self._add_suffix(df, suffix)
+
+        return df
+    # ------------------------------------------
+    def get_rdf(self, suffix: str = None) -> RDataFrame:
+        '''
+        Returns corrected ROOT dataframe
+
+        mass_name (str) : Name of the column containing the corrected mass, by default B_M
+        '''
+        log.info(f'Applying bias correction with {self._engine} engine')
+        if self._engine == 'root':
+            return self._get_rdf_with_root(suffix)
+
+        df        = self._get_input_df()
+        df        = self._get_corrected_df(df, suffix)
         rdf       = RDF.FromPandas(df)
 
         return rdf
+    # ------------------------------------------
+    def save(self, out_path : str, tree_name : str = 'DecayTree', suffix : str = None, chunk_size : int = 100_000) -> None:
+        '''
+        Streaming version of get_rdf, the input is read once and corrected and written in chunks
+        such that only one chunk is in memory at any time
+
+        out_path  : Path to ROOT file where the corrected tree will be saved
+        tree_name : Name of output tree, by default DecayTree
+        suffix    : Same as in get_rdf
+        chunk_size: Maximum number of entries per chunk, not used by the root engine, which streams with Snapshot
+        '''
+        if self._engine == 'root':
+            rdf = self.get_rdf(suffix=suffix)
+            rdf.Snapshot(tree_name, out_path, self.get_columns(suffix=suffix))
+            return
+
+        # The input columns are written to a temporary file in a single event loop, which works also with
+        # implicit multithreading, and read back in chunks. The input is read only once
+        rdf   = ut.preprocess_rdf(self._rdf)
+        l_col = ut.pick_columns(rdf)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_path))) as tmp_dir:
+            tmp_path = f'{tmp_dir}/input.root'
+            rdf.Snapshot(tree_name, tmp_path, l_col)
+
+            log.info(f'Applying bias correction with {self._engine} engine in chunks of {chunk_size} entries')
+            with uproot.recreate(out_path) as ofile:
+                for ichunk, d_data in enumerate(self._iterate(tmp_path, tree_name, chunk_size)):
+                    df    = ut.df_from_data(d_data)
+                    df    = self._get_corrected_df(df, suffix)
+                    d_arr = { name : df[name].to_numpy() for name in df.columns }
+
+                    if ichunk == 0:
+                        ofile[tree_name] = d_arr
+                    else:
+                        ofile[tree_name].extend(d_arr)
+
+                    log.debug(f'Wrote chunk {ichunk + 1} with {len(df)} entries')
+    # ------------------------------------------
+    def _iterate(self, path : str, tree_name : str, chunk_size : int):
+        '''
+        Yields dictionaries with arrays of at most chunk_size entries, or with empty arrays, once, for empty inputs
+        '''
+        with uproot.open(path) as ifile:
+            tree = ifile[tree_name]
+            if tree.num_entries == 0:
+                yield tree.arrays(library='np')
+                return
+
+            yield from tree.iterate(step_size=chunk_size, library='np')
 # ------------------------------------------
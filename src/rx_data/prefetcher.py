@@ -0,0 +1,160 @@
+'''
+Module holding Prefetcher class
+'''
+import os
+import shutil
+import tempfile
+import threading
+from typing import Union
+
+from dmu.logging.log_store import LogStore
+
+log=LogStore.add_logger('rx_data:prefetcher')
+# --------------------------
+class Prefetcher:
+    '''
+    Class meant to read, in a background thread, the next files of a list while the current one is processed.
+    The files are either read, such that they end up in the page cache, or copied to a scratch directory, e.g.
+
+    with Prefetcher(l_path=l_path, nfiles=2) as pre:
+        for path in l_path:
+            local_path = pre.get_path(path)
+            process(local_path)
+            pre.release(path)
+
+    The files have to be processed in the order in which they were passed.
+    '''
+    # --------------------------
+    def __init__(self, l_path : list[str], nfiles : int = 1, budget : int = 4096, scratch_dir : Union[str,None] = None):
+        '''
+        l_path     : List of paths to files, in the order in which they will be processed
+        nfiles     : Maximum number of files to prefetch ahead of the one being processed
+        budget     : Maximum size, in MB, of the files that have been prefetched and not released.
+                     Files larger than this are not prefetched
+        scratch_dir: If passed, files will be copied to a temporary directory inside, otherwise they will only be read
+        '''
+        self._d_index     = { path : index for index, path in enumerate(l_path) }
+        self._l_path      = l_path
+        self._nfiles      = nfiles
+        self._budget      = budget * 1024 ** 2
+        self._scratch_dir = scratch_dir
+        self._block_size  = 16 * 1024 ** 2
+
+        self._tmp_dir     = None
+        self._icurrent    = -1
+        self._stop        = False
+        self._d_state     = {}
+        self._d_held      = {}
+        self._d_local     = {}
+        self._cond        = threading.Condition()
+        self._thread      = threading.Thread(target=self._run, daemon=True)
+    # --------------------------
+    def __enter__(self) -> 'Prefetcher':
+        if self._scratch_dir is not None:
+            os.makedirs(self._scratch_dir, exist_ok=True)
+            self._tmp_dir = tempfile.mkdtemp(prefix='prefetch_', dir=self._scratch_dir)
+            log.debug(f'Copying files to: {self._tmp_dir}')
+
+        self._thread.start()
+
+        return self
+    # --------------------------
+    def __exit__(self, *_) -> None:
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+        self._thread.join()
+
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+    # --------------------------
+    def _can_fetch(self, index : int, size : int) -> bool:
+        if index > self._icurrent + self._nfiles:
+            return False
+
+        return sum(self._d_held.values()) + size <= self._budget
+    # --------------------------
+    def _wait_to_fetch(self, index : int, size : int) -> None:
+        '''
+        Called with the lock held, waits until the file can be fetched or the prefetcher is stopped
+        '''
+        self._cond.wait_for(lambda : self._stop or self._can_fetch(index, size))
+    # --------------------------
+    def _run(self) -> None:
+        for index, path in enumerate(self._l_path):
+            size = os.path.getsize(os.path.realpath(path))
+            if size > self._budget:
+                log.debug(f'File larger than budget, not prefetching: {path}')
+                continue
+
+            with self._cond:
+                self._wait_to_fetch(index, size)
+                if self._stop:
+                    return
+
+                # Already requested by the consumer
+                if path in self._d_state:
+                    continue
+
+                self._d_state[path] = 'running'
+                self._d_held[path]  = size
+
+            state = 'done'
+            try:
+                self._fetch(path)
+            except OSError as exc:
+                log.warning(f'Cannot prefetch {path}: {exc}')
+                state = 'failed'
+
+            with self._cond:
+                self._d_state[path] = state
+                if state == 'failed':
+                    self._d_held.pop(path, None)
+
+                self._cond.notify_all()
+    # --------------------------
+    def _fetch(self, path : str) -> None:
+        real_path = os.path.realpath(path)
+        if self._tmp_dir is None:
+            with open(real_path, 'rb') as ifile:
+                while ifile.read(self._block_size):
+                    pass
+
+            log.debug(f'Read: {path}')
+            return
+
+        local_path = f'{self._tmp_dir}/{os.path.basename(path)}'
+        shutil.copy2(real_path, f'{local_path}.part')
+        os.replace(f'{local_path}.part', local_path)
+
+        self._d_local[path] = local_path
+        log.debug(f'Copied: {path}')
+    # --------------------------
+    def get_path(self, path : str) -> str:
+        '''
+        Called before processing a file, waits for its prefetching to finish, if it started.
+        Returns path to local copy, if it exists, otherwise the original path
+        '''
+        with self._cond:
+            self._icurrent = self._d_index[path]
+            self._cond.notify_all()
+            self._cond.wait_for(lambda : self._d_state.get(path) != 'running')
+
+            # Not started, the background thread will not fetch it
+            self._d_state.setdefault(path, 'skipped')
+
+            return self._d_local.get(path, path)
+    # --------------------------
+    def release(self, path : str) -> None:
+        '''
+        Called after processing a file, removes the local copy, if any, and frees its space in the budget
+        '''
+        with self._cond:
+            self._d_held.pop(path, None)
+            local_path = self._d_local.pop(path, None)
+            self._cond.notify_all()
+
+        if local_path is not None:
+            os.remove(local_path)
+# --------------------------
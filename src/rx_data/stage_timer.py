@@ -0,0 +1,117 @@
+'''
+Module holding StageTimer class and functions to report its measurements
+'''
+import os
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+from tabulate              import tabulate
+from dmu.logging.log_store import LogStore
+
+log=LogStore.add_logger('rx_data:stage_timer')
+# --------------------------
+class StageTimer:
+    '''
+    Class meant to measure the time spent in each stage of the processing of a file, e.g.
+
+    timer = StageTimer(name='file.root')
+    with timer.stage('open'):
+        rdf = RDataFrame('DecayTree', 'file.root')
+
+    ROOT dataframes are lazy, the time of the event loop goes to the stage where the loop is triggered
+    '''
+    # --------------------------
+    def __init__(self, name : str):
+        '''
+        name: Name of the file being processed
+        '''
+        self._name     = name
+        self._entries  = 0
+        self._d_stage  = {}
+    # --------------------------
+    @contextmanager
+    def stage(self, name : str):
+        '''
+        Context manager measuring the time spent inside it, the time is added to any earlier measurement of the stage
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._d_stage[name] = self._d_stage.get(name, 0) + time.perf_counter() - start
+    # --------------------------
+    def get_seconds(self, stages : list[str]) -> float:
+        '''
+        Returns time spent so far in the stages passed
+        '''
+        return sum(self._d_stage.get(name, 0) for name in stages)
+    # --------------------------
+    def set_entries(self, entries : int) -> None:
+        '''
+        Sets the number of entries processed, used to calculate the rate
+        '''
+        self._entries = entries
+    # --------------------------
+    def to_dict(self) -> dict:
+        '''
+        Returns dictionary with the measurements:
+
+        file        : Name of file
+        entries     : Number of entries processed
+        stages      : Dictionary with the seconds spent in each stage
+        total       : Sum of seconds over the stages
+        rate        : Entries per second
+        peak_rss_mb : Peak resident memory of the process, so far, in MB
+        '''
+        total = sum(self._d_stage.values())
+        # In Linux ru_maxrss is in kB
+        rss   = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        d_data= {
+                'file'        : self._name,
+                'entries'     : self._entries,
+                'stages'      : dict(self._d_stage),
+                'total'       : total,
+                'rate'        : self._entries / total if total > 0 else 0,
+                'peak_rss_mb' : rss}
+
+        return d_data
+# --------------------------
+def write_report(l_meas : list[dict], path : str) -> None:
+    '''
+    Writes to JSON file the measurements, as returned by StageTimer.to_dict
+    '''
+    dir_name = os.path.dirname(path)
+    if dir_name != '':
+        os.makedirs(dir_name, exist_ok=True)
+
+    with open(path, 'w', encoding='utf-8') as ofile:
+        json.dump(l_meas, ofile, indent=4)
+
+    log.info(f'Timing report saved to: {path}')
+# --------------------------
+def get_summary(l_meas : list[dict]) -> str:
+    '''
+    Returns table with the measurements of each file and the totals
+    '''
+    l_stage = []
+    for d_meas in l_meas:
+        l_stage += [ stage for stage in d_meas['stages'] if stage not in l_stage ]
+
+    l_header= ['File', 'Entries', *l_stage, 'Total [s]', 'Entries/s', 'RSS [MB]']
+    l_row   = []
+    for d_meas in l_meas:
+        l_time = [ d_meas['stages'].get(stage, 0) for stage in l_stage ]
+        l_row.append([d_meas['file'], d_meas['entries'], *l_time, d_meas['total'], d_meas['rate'], d_meas['peak_rss_mb']])
+
+    entries = sum(d_meas['entries'] for d_meas in l_meas)
+    total   = sum(d_meas['total'  ] for d_meas in l_meas)
+    l_time  = [ sum(d_meas['stages'].get(stage, 0) for d_meas in l_meas) for stage in l_stage ]
+    rss     = max((d_meas['peak_rss_mb'] for d_meas in l_meas), default=0)
+    rate    = entries / total if total > 0 else 0
+    l_row.append(['Total', entries, *l_time, total, rate, rss])
+
+    return tabulate(l_row, headers=l_header, floatfmt='.1f')
+# --------------------------
@@ -1,66 +1,117 @@
 '''
 Module with class used to swap mass hypotheses
 '''
+from typing                import Union
+from functools             import cache
 
-import pandas as pnd
+import numpy
 from ROOT                  import RDataFrame, RDF
-from tqdm                  import tqdm
 from particle              import Particle         as part
-from vector                import MomentumObject3D as v3d
-from vector                import MomentumObject4D as v4d
 from dmu.logging.log_store import LogStore
 
+from rx_data.column_fetcher import ColumnFetcher
+
 log = LogStore.add_logger('rx_data:swp_calculator')
 #---------------------------------
+@cache
+def _get_properties(pdg_id : int) -> tuple[float,float]:
+    '''
+    Returns mass and charge of particle, cached such that the PDG table is searched once per ID
+    '''
+    try:
+        par = part.from_pdgid(pdg_id)
+    except Exception as exc:
+        raise ValueError(f'Cannot create particle for PDGID: {pdg_id}') from exc
+
+    mass = numpy.nan if par.mass is None else float(par.mass)
+
+    return mass, float(par.charge)
+#---------------------------------
 class SWPCalculator:
     '''
     Class used to calculate di-track masses, after mass hypothesis swaps
     '''
     #---------------------------------
-    def __init__(self, rdf : RDataFrame, d_lep : dict[str,int], d_had : dict[str,int]):
+    def __init__(self,
+                 rdf        : RDataFrame,
+                 d_lep      : dict[str,int] = None,
+                 d_had      : dict[str,int] = None,
+                 hypotheses : list[tuple[dict[str,int],dict[str,int],str]] = None,
+                 fetcher    : Union[ColumnFetcher,None] = None):
+        '''
+        rdf        : ROOT dataframe
+        d_lep      : Dictionary mapping lepton names, e.g. L1, to the PDG ID of the new hypothesis
+        d_had      : Same as d_lep for hadrons
+        hypotheses : Instead of d_lep and d_had, list of (d_lep, d_had, preffix) tuples. All the hypotheses
+                     are calculated from the same input, read only once, and their masses go to the same dataframe
+        fetcher    : If passed, the input columns will be read through it, see ColumnFetcher
+        '''
         self._rdf    = rdf
-        self._d_lep  = d_lep
-        self._d_had  = d_had
+        self._l_hyp  = self._get_hypotheses(d_lep, d_had, hypotheses)
+        self._fetcher= fetcher
 
         self._extra_branches= ['EVENTNUMBER', 'RUNNUMBER']
-        self._df            = self._pnd_from_root(rdf)
+        self._d_data        = None
         self._initialized   = False
 
         self._use_ss : bool
+
+        if self._fetcher is not None:
+            self._fetcher.request(self.get_input_columns())
     #---------------------------------
-    def _pnd_from_root(self, rdf : RDataFrame) -> pnd.DataFrame:
-        s_col_all = { name.c_str() for name in rdf.GetColumnNames() }
-        s_col     = { name         for name in s_col_all if self._pick_column(name) }
+    def _get_hypotheses(self, d_lep : dict[str,int], d_had : dict[str,int], hypotheses : list) -> list[tuple[dict[str,int],dict[str,int],str]]:
+        '''
+        Returns list of (d_lep, d_had, preffix), the preffix is None for a single hypothesis, and provided in get_rdf
+        '''
+        if hypotheses is None and (d_lep is None or d_had is None):
+            raise ValueError('Either both d_lep and d_had or hypotheses are needed')
 
-        ncol  = len(s_col)
-        log.debug(f'Using {ncol} columns for dataframe')
+        if hypotheses is not None and (d_lep is not None or d_had is not None):
+            raise ValueError('Cannot use hypotheses together with d_lep or d_had')
+
+        if hypotheses is None:
+            return [(d_lep, d_had, None)]
+
+        l_preffix = [ preffix for _, _, preffix in hypotheses ]
+        if None in l_preffix or len(set(l_preffix)) != len(l_preffix):
+            raise ValueError(f'Hypotheses need distinct preffixes, found: {l_preffix}')
 
-        d_data= rdf.AsNumpy(list(s_col))
-        df    = pnd.DataFrame(d_data)
+        return list(hypotheses)
+    #---------------------------------
+    def get_input_columns(self) -> list[str]:
+        '''
+        Returns names of columns read from the input dataframe
+        '''
+        s_par = { par for d_lep, d_had, _ in self._l_hyp for par in list(d_lep) + list(d_had) }
+        l_col = [ f'{par}_{var}' for par in sorted(s_par) for var in ['PX', 'PY', 'PZ', 'ID'] ]
 
-        return df
+        return l_col + self._extra_branches
     #---------------------------------
-    def _pick_column(self, name : str) -> bool:
-        l_par = list(self._d_lep) + list(self._d_had)
-        l_kin = []
-        for par in l_par:
-            l_kin += [
-                    f'{par}_PX',
-                    f'{par}_PY',
-                    f'{par}_PZ',
-                    f'{par}_PE',
-                    f'{par}_ID']
-
-        return name in l_kin
+    def _get_data(self) -> dict[str,numpy.ndarray]:
+        '''
+        Reads kinematics and extra branches in a single event loop, the first time it is called
+        '''
+        if self._d_data is not None:
+            return self._d_data
+
+        l_col = self.get_input_columns()
+        ncol  = len(l_col)
+        log.debug(f'Using {ncol} columns for dataframe')
+
+        if self._fetcher is None:
+            self._d_data = self._rdf.AsNumpy(l_col)
+        else:
+            self._d_data = self._fetcher.get(l_col)
+
+        return self._d_data
     #---------------------------------
     def _initialize(self):
         if self._initialized:
             return
 
-        self._check_particle(self._d_lep)
-        self._check_particle(self._d_had)
-
-        tqdm.pandas(ascii=' -')
+        for d_lep, d_had, _ in self._l_hyp:
+            self._check_particle(d_lep)
+            self._check_particle(d_had)
 
         self._initialized=True
     #---------------------------------
@@ -69,99 +120,89 @@ class SWPCalculator:
             raise ValueError(f'Dictionary expected, found: {d_part}')
 
         for pdg_id in d_part.values():
-            try:
-                part.from_pdgid(pdg_id)
-            except Exception as exc:
-                raise ValueError(f'Cannot create particle for PDGID: {pdg_id}') from exc
+            _get_properties(pdg_id)
     #---------------------------------
-    def _get_4vec(self, row : pnd.Series, name : str) -> v4d:
+    def _get_pdg_table(self, arr_id : numpy.ndarray) -> tuple[numpy.ndarray,numpy.ndarray]:
         '''
-        This function is needed because the PE (energy) of the particle was not stored
-        in the ntuples
+        Takes array of PDG IDs, returns arrays of masses and charges
+        The particle table is only searched for the few distinct IDs
         '''
-        px     = row[f'{name}_PX']
-        py     = row[f'{name}_PY']
-        pz     = row[f'{name}_PZ']
-        par_3d = v3d(px=px, py=py, pz=pz)
+        arr_uid, arr_inv = numpy.unique(arr_id, return_inverse=True)
+        arr_mass, arr_chg= numpy.array([ _get_properties(int(pdg_id)) for pdg_id in arr_uid ]).reshape(-1, 2).T
 
-        par_id = row[f'{name}_ID']
-        par    = part.from_pdgid(par_id)
-        ms     = par.mass
-        vec    = v4d(pt=par_3d.pt, eta=par_3d.eta, phi=par_3d.phi, m=ms)
-
-        return vec
-    #---------------------------------
-    def _build_mass(self, row, d_part) -> float:
-        l_vec = []
-        for name, new_id in d_part.items():
-            vec_1 = self._get_4vec(row, name)
-            old_id= row[f'{name}_ID']
-            par   = part.from_pdgid(new_id)
-            ms    = par.mass
-            log.debug(f'{name}: {vec_1.mass:0f}({old_id}) -> {ms:.0f}({new_id})')
-
-            vec_2 = v4d(pt=vec_1.pt, eta=vec_1.eta, phi=vec_1.phi, mass=ms)
-            l_vec.append(vec_2)
-
-        if len(l_vec) != 2:
-            raise ValueError('Not found two and only two particles')
-
-        vec_1 = l_vec[0]
-        vec_2 = l_vec[1]
-        vec   = vec_1 + vec_2
-        mass  = float(vec.mass)
-
-        return mass
+        return arr_mass[arr_inv], arr_chg[arr_inv]
     #---------------------------------
-    def _combine(self, row : pnd.Series, had_name, kind : str, new_had_id : int) ->  float:
-        old_had_id = row[f'{had_name}_ID']
-        had        = part.from_pdgid(old_had_id)
-        l_mass     = []
-        for lep_name, new_lep_id in self._d_lep.items():
-            old_lep_id = row[f'{lep_name}_ID']
-            lep        = part.from_pdgid(old_lep_id)
-
-            if lep.charge == had.charge and not self._use_ss:
-                continue
-
-            if lep.charge != had.charge and     self._use_ss:
-                continue
-
-            lep_id = new_lep_id if kind == 'swp' else old_lep_id
-            had_id = new_had_id if kind == 'swp' else old_had_id
-
-            mass   = self._build_mass(row, {had_name : had_id, lep_name : lep_id})
-
-            l_mass.append(mass)
-
-        ncmb = len(l_mass)
+    def _get_momentum(self, name : str) -> numpy.ndarray:
+        d_data = self._get_data()
 
-        if ncmb == 0:
-            log.warning(f'Found no combinations with masses: {l_mass}')
-            log.debug(row)
-            return -999
+        return numpy.stack([ d_data[f'{name}_{var}'].astype(float) for var in ['PX', 'PY', 'PZ'] ], axis=1)
+    #---------------------------------
+    def _build_mass(self, arr_p1 : numpy.ndarray, arr_m1 : numpy.ndarray, arr_p2 : numpy.ndarray, arr_m2 : numpy.ndarray) -> numpy.ndarray:
+        '''
+        Takes momenta and masses of two particles, returns mass of the pair
+        '''
+        arr_e1  = numpy.sqrt(numpy.sum(arr_p1 ** 2, axis=1) + arr_m1 ** 2)
+        arr_e2  = numpy.sqrt(numpy.sum(arr_p2 ** 2, axis=1) + arr_m2 ** 2)
+        arr_p   = arr_p1 + arr_p2
 
-        log.debug(f'Found {ncmb} combinations with masses: {l_mass}')
+        with numpy.errstate(invalid='ignore'):
+            arr_mass = numpy.sqrt((arr_e1 + arr_e2) ** 2 - numpy.sum(arr_p ** 2, axis=1))
 
-        return l_mass[0]
+        return arr_mass
     #---------------------------------
-    def _calculate_mass(self, progress_bar : bool, had_name : str, kind : str, new_had_id : int) -> pnd.Series:
-        if progress_bar:
-            sr_mass = self._df.progress_apply(self._combine, args=(had_name, kind, new_had_id), axis=1)
-        else:
-            sr_mass = self._df.apply(self._combine, args=(had_name, kind, new_had_id), axis=1)
+    def _calculate_mass(self, d_lep : dict[str,int], had_name : str, kind : str, new_had_id : int) -> numpy.ndarray:
+        '''
+        For each candidate, returns the mass of the hadron and the first lepton with the right charge,
+        -999 if there is no such lepton
+        '''
+        d_data             = self._get_data()
+        arr_had_id         = d_data[f'{had_name}_ID'].astype(int)
+        arr_had_ms, had_ch = self._get_pdg_table(arr_had_id)
+        arr_had_p          = self._get_momentum(had_name)
+        if kind == 'swp':
+            arr_had_ms     = numpy.full_like(arr_had_ms, _get_properties(new_had_id)[0])
+
+        arr_mass = numpy.full(len(arr_had_id), -999.)
+        is_found = numpy.zeros(len(arr_had_id), dtype=bool)
+        for lep_name, new_lep_id in d_lep.items():
+            arr_lep_id         = d_data[f'{lep_name}_ID'].astype(int)
+            arr_lep_ms, lep_ch = self._get_pdg_table(arr_lep_id)
+            if kind == 'swp':
+                arr_lep_ms     = numpy.full_like(arr_lep_ms, _get_properties(new_lep_id)[0])
+
+            is_same  = lep_ch == had_ch
+            is_valid = is_same if self._use_ss else ~is_same
+            is_new   = is_valid & ~is_found
+
+            arr_pair = self._build_mass(arr_had_p, arr_had_ms, self._get_momentum(lep_name), arr_lep_ms)
+            arr_mass = numpy.where(is_new, arr_pair, arr_mass)
+            is_found = is_found | is_valid
+
+        nmiss = numpy.count_nonzero(~is_found)
+        if nmiss > 0:
+            log.warning(f'Found {nmiss} candidates with no combinations, assigned mass -999')
+
+        return arr_mass
+    #---------------------------------
+    def _check_preffix(self, preffix : str, hyp_preffix : str) -> str:
+        if hyp_preffix is None and preffix is None:
+            raise ValueError('Preffix needed when using d_lep and d_had')
+
+        if hyp_preffix is not None and preffix is not None:
+            raise ValueError('Preffix not expected when using hypotheses')
 
-        return sr_mass
+        return preffix if hyp_preffix is None else hyp_preffix
     #---------------------------------
     def get_rdf(self,
-                preffix      : str,
+                preffix      : str  = None,
                 progress_bar : bool = False,
                 use_ss       : bool = False) -> RDataFrame:
         '''
         Parameters:
         ------------------
-        preffix: Will be used to name branches with masses as `{preffix}_mass_org/swp` for the original and swapped masses
-        progress_bar: If True, will show progress bar, by default false
+        preffix: Will be used to name branches with masses as `{preffix}_mass_org/swp` for the original and swapped masses.
+                 Needed with d_lep and d_had, with hypotheses, the preffix of each hypothesis is used
+        progress_bar: Not used, the masses of all the candidates are calculated at once, kept for backward compatibility
         use_ss: If true, it will combine tracks with same sign, instead of opposite, False by default
 
         Returns:
@@ -171,19 +212,23 @@ class SWPCalculator:
         if use_ss:
             log.warning('Building candidates from Same Sign tracks')
 
+        if progress_bar:
+            log.debug('Progress bar not available, masses are calculated for all candidates at once')
+
         self._use_ss = use_ss
         self._initialize()
 
         d_data = {}
-        for had_name, new_had_id in self._d_had.items():
-            for kind in ['org', 'swp']:
-                log.info(f'Adding column for {had_name}/{new_had_id}/{kind}')
+        for d_lep, d_had, hyp_preffix in self._l_hyp:
+            hyp_preffix = self._check_preffix(preffix, hyp_preffix)
+            for had_name, new_had_id in d_had.items():
+                for kind in ['org', 'swp']:
+                    log.info(f'Adding column for {hyp_preffix}/{had_name}/{new_had_id}/{kind}')
 
-                sr_mass = self._calculate_mass(progress_bar, had_name, kind, new_had_id)
-                d_data[f'{preffix}_mass_{kind}'] = sr_mass.to_numpy().flatten()
+                    d_data[f'{hyp_preffix}_mass_{kind}'] = self._calculate_mass(d_lep, had_name, kind, new_had_id)
 
-        d_extra = self._rdf.AsNumpy(self._extra_branches)
-        d_data.update(d_extra)
+        d_inp  = self._get_data()
+        d_data.update({ name : d_inp[name] for name in self._extra_branches })
 
         rdf    = RDF.FromNumpy(d_data)
 
@@ -6,9 +6,12 @@ Module with utility functions
 import os
 import re
 from dataclasses            import dataclass
+from importlib.resources    import files
 
+import numpy
+import uproot
 import pandas as pnd
-from ROOT                   import RDataFrame
+from ROOT                   import RDataFrame, gInterpreter
 from dmu.logging.log_store  import LogStore
 
 log   = LogStore.add_logger('rx_data:utilities')
@@ -77,13 +80,30 @@ def _info_from_data_path(path : str) -> tuple[str,str]:
 
     return sample, line
 # ---------------------------------
+def get_entries(path : str, tree_name : str = 'DecayTree') -> int:
+    '''
+    Returns number of entries in tree, only the header of the tree is read
+    '''
+    with uproot.open(path) as ifile:
+        nentries = ifile[tree_name].num_entries
+
+    return nentries
+# ---------------------------------
 def df_from_rdf(rdf : RDataFrame) -> pnd.DataFrame:
     '''
     Utility method needed to get pandas dataframe from ROOT dataframe
     '''
-    rdf    = _preprocess_rdf(rdf)
-    l_col  = [ name.c_str() for name in rdf.GetColumnNames() if _pick_column(name.c_str()) ]
+    rdf    = preprocess_rdf(rdf)
+    l_col  = pick_columns(rdf)
     d_data = rdf.AsNumpy(l_col)
+
+    return df_from_data(d_data)
+# ---------------------------------
+def df_from_data(d_data : dict[str,numpy.ndarray]) -> pnd.DataFrame:
+    '''
+    Takes dictionary with arrays, from a dataframe preprocessed with preprocess_rdf
+    Returns pandas dataframe without entries with NaNs
+    '''
     df     = pnd.DataFrame(d_data)
 
     sr_nan = df.isna().any(axis=1)
@@ -104,7 +124,16 @@ def df_from_rdf(rdf : RDataFrame) -> pnd.DataFrame:
 
     return df
 # ------------------------------------------
-def _preprocess_rdf(rdf: RDataFrame) -> RDataFrame:
+def pick_columns(rdf : RDataFrame) -> list[str]:
+    '''
+    Returns names of columns needed for the electron corrections
+    '''
+    return [ name.c_str() for name in rdf.GetColumnNames() if _pick_column(name.c_str()) ]
+# ------------------------------------------
+def preprocess_rdf(rdf: RDataFrame) -> RDataFrame:
+    '''
+    Redefines brem columns of leptons and kaon, such that they can be used in the electron corrections
+    '''
     rdf = _preprocess_lepton(rdf, 'L1')
     rdf = _preprocess_lepton(rdf, 'L2')
     rdf = _preprocess_lepton(rdf,  'H')
@@ -178,3 +207,17 @@ def _pick_column(name : str) -> bool:
 
     return False
 # ------------------------------------------
+def declare_cpp(name : str) -> None:
+    '''
+    Declares to the ROOT interpreter the C++ code in the rx_data_data/cpp/{name} header
+    The headers have include guards, declaring them more than once does nothing
+    '''
+    path = files('rx_data_data').joinpath(f'cpp/{name}')
+    with open(path, encoding='utf-8') as ifile:
+        code = ifile.read()
+
+    if not gInterpreter.Declare(code):
+        raise RuntimeError(f'Cannot declare C++ code in: {path}')
+
+    log.debug(f'Declared: {path}')
+# ------------------------------------------
@@ -0,0 +1,248 @@
+'''
+Module holding WorkQueue class
+'''
+import os
+import time
+import uuid
+import socket
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Union
+
+from dmu.logging.log_store import LogStore
+
+log=LogStore.add_logger('rx_data:work_queue')
+# --------------------------
+def _run_heartbeat(conn : Connection, heartbeat : float, parent_pid : int) -> None:
+    '''
+    Runs in its own process, updates modification time of locks, every `heartbeat` seconds.
+    Receives ('add', path), ('remove', path) or ('stop', None) messages from the worker
+    and stops if the worker dies
+    '''
+    s_path    = set()
+    last_beat = time.monotonic()
+    while True:
+        wait = max(0, heartbeat - (time.monotonic() - last_beat))
+        if conn.poll(wait):
+            try:
+                command, path = conn.recv()
+            except EOFError:
+                return
+
+            if command == 'stop':
+                return
+
+            if command == 'add':
+                s_path.add(path)
+            else:
+                s_path.discard(path)
+
+            continue
+
+        if os.getppid() != parent_pid:
+            return
+
+        for path in s_path:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+        last_beat = time.monotonic()
+# --------------------------
+class WorkQueue:
+    '''
+    Class meant to share a list of tasks, e.g. input files, among workers running in any machine with access to
+    the same filesystem, without a coordinator. In the queue directory, for a task called `name`:
+
+    name.lock   : Created atomically by the worker processing the task, its modification time is updated periodically
+    name.done   : Created when the task finished
+    name.failed : Created when the task failed, holds one line per failure, with the worker and the error
+
+    Locks that have not been updated in `timeout` seconds belong to workers that died and are claimed by other workers.
+    The locks are updated from a separate process, such that they are kept also while the worker holds the GIL, e.g.
+    in long ROOT event loops.
+    Workers wait for tasks locked by other workers to finish, such that they can be claimed if these workers die.
+    Failed tasks are claimed again, by any worker, until they failed `attempts` times. Workers using a larger
+    number of attempts will retry tasks that failed in previous runs. To rerun all the tasks, the directory has to be removed.
+
+    with WorkQueue(queue_dir=queue_dir, l_task=l_path) as queue:
+        while (path := queue.claim()) is not None:
+            process(path)
+            queue.done(path)
+    '''
+    # --------------------------
+    def __init__(self, queue_dir : str, l_task : list[str], heartbeat : float = 60, timeout : float = 600, attempts : int = 1):
+        '''
+        queue_dir: Directory in shared filesystem where locks and markers are stored
+        l_task   : List of tasks, they are identified by their basenames
+        heartbeat: Seconds between updates of locks held by this worker
+        timeout  : Seconds after which a lock that was not updated is considered abandoned
+        attempts : Number of times a task is processed before it is considered failed, e.g. 3 retries transient errors twice
+        '''
+        if timeout <= 2 * heartbeat:
+            raise ValueError(f'Timeout {timeout} has to be larger than twice the heartbeat {heartbeat}')
+
+        if attempts < 1:
+            raise ValueError(f'Number of attempts has to be at least 1, found: {attempts}')
+
+        self._queue_dir = queue_dir
+        self._l_task    = l_task
+        self._heartbeat = heartbeat
+        self._timeout   = timeout
+        self._attempts  = attempts
+        self._owner     = f'{socket.gethostname()}:{os.getpid()}'
+
+        self._s_held    = set()
+        self._conn      = None
+        self._process   = None
+    # --------------------------
+    def __enter__(self) -> 'WorkQueue':
+        os.makedirs(self._queue_dir, exist_ok=True)
+
+        # Spawned, forking is not safe after ROOT has been initialized
+        ctx                   = multiprocessing.get_context('spawn')
+        self._conn, beat_conn = ctx.Pipe()
+        self._process         = ctx.Process(target=_run_heartbeat, args=(beat_conn, self._heartbeat, os.getpid()), daemon=True)
+        self._process.start()
+
+        return self
+    # --------------------------
+    def __exit__(self, *_) -> None:
+        # Tasks claimed and not finished, e.g. because of an exception, are released for other workers
+        for task in list(self._s_held):
+            self._release(task)
+
+        self._conn.send(('stop', None))
+        self._process.join()
+        self._conn.close()
+    # --------------------------
+    def _get_path(self, task : str, kind : str) -> str:
+        name = os.path.basename(task)
+
+        return f'{self._queue_dir}/{name}.{kind}'
+    # --------------------------
+    def _create_lock(self, task : str) -> bool:
+        lock_path = self._get_path(task, 'lock')
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, 'w', encoding='utf-8') as ofile:
+            ofile.write(self._owner)
+
+        self._s_held.add(task)
+        self._conn.send(('add', lock_path))
+
+        return True
+    # --------------------------
+    def _is_stale(self, path : str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(path) > self._timeout
+        except FileNotFoundError:
+            return False
+    # --------------------------
+    def _reclaim(self, task : str) -> bool:
+        '''
+        Removes abandoned lock and tries to lock task, returns true if it succeeded
+        '''
+        lock_path = self._get_path(task, 'lock')
+        if not self._is_stale(lock_path):
+            return False
+
+        # Only one of the workers trying to reclaim the lock can rename it
+        old_path = f'{lock_path}.{uuid.uuid4().hex}'
+        try:
+            os.rename(lock_path, old_path)
+        except FileNotFoundError:
+            return False
+
+        # Another worker replaced the stale lock with its own between the check and the rename, put it back
+        if not self._is_stale(old_path):
+            try:
+                os.link(old_path, lock_path)
+            except FileExistsError:
+                log.warning(f'Cannot restore lock of {task}, it might be processed twice')
+
+            os.remove(old_path)
+            return False
+
+        os.remove(old_path)
+        log.warning(f'Reclaiming abandoned task: {task}')
+
+        return self._create_lock(task)
+    # --------------------------
+    def _get_failures(self, task : str) -> int:
+        try:
+            with open(self._get_path(task, 'failed'), encoding='utf-8') as ifile:
+                return len(ifile.read().splitlines())
+        except FileNotFoundError:
+            return 0
+    # --------------------------
+    def _is_finished(self, task : str) -> bool:
+        return os.path.isfile(self._get_path(task, 'done')) or self._get_failures(task) >= self._attempts
+    # --------------------------
+    def claim(self) -> Union[str,None]:
+        '''
+        Returns next task that is not finished or processed by another worker.
+        If all the tasks not finished are being processed, waits for them to finish or be abandoned.
+        Returns None when all the tasks are finished
+        '''
+        while True:
+            l_busy = []
+            for task in self._l_task:
+                if self._is_finished(task):
+                    continue
+
+                if self._create_lock(task) or self._reclaim(task):
+                    # Another worker could have finished it between the check and the lock
+                    if self._is_finished(task):
+                        self._release(task)
+                        continue
+
+                    log.debug(f'Claimed: {task}')
+                    return task
+
+                l_busy.append(task)
+
+            if len(l_busy) == 0:
+                return None
+
+            log.debug(f'Waiting for {len(l_busy)} tasks processed by other workers')
+            time.sleep(self._heartbeat)
+    # --------------------------
+    def _release(self, task : str) -> None:
+        lock_path = self._get_path(task, 'lock')
+        self._s_held.discard(task)
+        self._conn.send(('remove', lock_path))
+
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            log.warning(f'Lock of task was removed: {task}')
+    # --------------------------
+    def done(self, task : str) -> None:
+        '''
+        Marks task as finished
+        '''
+        with open(self._get_path(task, 'done'), 'w', encoding='utf-8') as ofile:
+            ofile.write(self._owner)
+
+        self._release(task)
+    # --------------------------
+    def fail(self, task : str, message : str) -> bool:
+        '''
+        Records failure of task, it will be claimed again until it failed `attempts` times
+        Returns true if the task will be claimed again
+        '''
+        # The task is locked, no other worker writes to this file
+        message = message.replace('\n', ' ')
+        with open(self._get_path(task, 'failed'), 'a', encoding='utf-8') as ofile:
+            ofile.write(f'{self._owner}: {message}\n')
+
+        retry = not self._is_finished(task)
+        self._release(task)
+
+        return retry
+# --------------------------
@@ -0,0 +1,127 @@
+#ifndef RX_DATA_ELECTRON_CORRECTOR_H
+#define RX_DATA_ELECTRON_CORRECTOR_H
+
+// C++ version of the corrections in rx_data/electron_bias_corrector.py, meant to be used
+// in RDataFrame::Define. The correction functions return {px, py, pz, updated, brem_status}, where:
+//
+// updated     : 1 if the kinematics of the electron have to be replaced by px, py, pz
+// brem_status : -1 electron not touched, 0 no brem assigned, 1 brem assigned
+
+#include <algorithm>
+#include <cmath>
+#include <vector>
+
+#include "ROOT/RVec.hxx"
+
+namespace rx_data::electron_corrector
+{
+    inline const double electron_mass = 0.511;
+
+    // Brem correction maps, see rx_data/brem_maps.py. Filled once, from python, with set_maps.
+    // cell_map holds, for each (area, row, col) cell, the index of the map or -1.
+    inline std::vector<int>    cell_map;
+    inline std::vector<long>   map_offset;
+    inline std::vector<double> map_p;
+    inline std::vector<double> map_mu;
+    inline int narea = 0;
+    inline int nrow  = 0;
+    inline int ncol  = 0;
+
+    inline void set_maps(const int* cells, int n_area, int n_row, int n_col, const long* offset, int nmap, const double* p, const double* mu)
+    {
+        narea = n_area;
+        nrow  = n_row;
+        ncol  = n_col;
+
+        cell_map.assign(cells, cells + narea * nrow * ncol);
+        map_offset.assign(offset, offset + nmap + 1);
+        map_p.assign(p  , p  + map_offset.back());
+        map_mu.assign(mu, mu + map_offset.back());
+    }
+
+    // Same binning convention as BremBiasCorrector, photons without map are not corrected
+    inline double get_mu(double row, double col, double area, double energy)
+    {
+        // NaNs and non integer values fail this
+        for (double value : {row, col, area})
+            if (std::floor(value) != value)
+                return 1;
+
+        if (area < 0 || area >= narea || row < 0 || row >= nrow || col < 0 || col >= ncol)
+            return 1;
+
+        const int imap = cell_map[(int(area) * nrow + int(row)) * ncol + int(col)];
+        if (imap < 0)
+            return 1;
+
+        const long start = map_offset[imap];
+        const long stop  = map_offset[imap + 1];
+        if (start == stop)
+            return 1;
+
+        // As in numpy.digitize, NaNs are above the last edge and energies below the first one use the first bin
+        long index = stop - 1;
+        if (!std::isnan(energy))
+            index = std::upper_bound(map_p.begin() + start, map_p.begin() + stop, energy) - map_p.begin() - 1;
+
+        return map_mu[std::max(index, start)];
+    }
+
+    inline ROOT::RVecD ecalo_bias(double tpx, double tpy, double tpz, double px, double py, double pz, double has_brem, double row, double col, double area, bool skip)
+    {
+        if (skip || has_brem == 0)
+            return {px, py, pz, 1, -1};
+
+        const double m2      = electron_mass * electron_mass;
+        const double e_track = std::sqrt(tpx * tpx + tpy * tpy + tpz * tpz + m2);
+        const double e_full  = std::sqrt( px *  px +  py *  py +  pz *  pz + m2);
+        const double mu      = get_mu(row, col, area, e_full - e_track);
+
+        return {tpx + (px - tpx) / mu, tpy + (py - tpy) / mu, tpz + (pz - tpz) / mu, 1, 1};
+    }
+
+    // Brem photon colinear to the track and massless
+    inline ROOT::RVecD brem_track_1(double tpx, double tpy, double tpz, double brem_energy, double min_energy, bool skip)
+    {
+        if (skip)
+            return {tpx, tpy, tpz, 0, -1};
+
+        if (brem_energy < min_energy)
+            return {tpx, tpy, tpz, 1, 0};
+
+        const double factor = 1 + brem_energy / std::sqrt(tpx * tpx + tpy * tpy + tpz * tpz);
+
+        return {factor * tpx, factor * tpy, factor * tpz, 1, 1};
+    }
+
+    inline ROOT::RVecD brem_track_2(double tpx, double tpy, double tpz, double has_brem, double brem_energy, double min_energy, bool skip)
+    {
+        if (has_brem != 0 || brem_energy < min_energy)
+            return {tpx, tpy, tpz, 0, -1};
+
+        return brem_track_1(tpx, tpy, tpz, brem_energy, min_energy, skip);
+    }
+
+    // Invariant mass of the sum of particles, -1 if not physical
+    inline double get_mass(const ROOT::RVecD& pt, const ROOT::RVecD& eta, const ROOT::RVecD& phi, const ROOT::RVecD& mass)
+    {
+        double px = 0, py = 0, pz = 0, e = 0;
+        for (std::size_t i = 0; i < pt.size(); ++i)
+        {
+            const double ppx = pt[i] * std::cos(phi[i]);
+            const double ppy = pt[i] * std::sin(phi[i]);
+            const double ppz = pt[i] * std::sinh(eta[i]);
+
+            px += ppx;
+            py += ppy;
+            pz += ppz;
+            e  += std::sqrt(ppx * ppx + ppy * ppy + ppz * ppz + mass[i] * mass[i]);
+        }
+
+        const double m2 = e * e - px * px - py * py - pz * pz;
+
+        return m2 >= 0 ? std::sqrt(m2) : -1;
+    }
+}
+
+#endif
@@ -0,0 +1,71 @@
+#ifndef RX_DATA_HOP_CALCULATOR_H
+#define RX_DATA_HOP_CALCULATOR_H
+
+// C++ version of the calculation in rx_data/hop_calculator.py, meant to be used in RDataFrame::Define
+
+#include <algorithm>
+#include <array>
+#include <cmath>
+
+namespace rx_data::hop_calculator
+{
+    // Component of the momentum perpendicular to the direction of flight
+    inline double get_transverse(double dx, double dy, double dz, double px, double py, double pz)
+    {
+        const double p   = std::sqrt(px * px + py * py + pz * pz);
+        const double dr  = std::sqrt(dx * dx + dy * dy + dz * dz);
+        const double cos = (dx * px + dy * py + dz * pz) / (p * dr);
+
+        // Rounding can make the cosine slightly larger than 1, NaNs are kept
+        return p * std::sqrt(std::max(1.0 - cos * cos, 0.0));
+    }
+
+    inline double get_alpha(
+            double pvx, double pvy, double pvz,
+            double svx, double svy, double svz,
+            double l1x, double l1y, double l1z,
+            double l2x, double l2y, double l2z,
+            double kpx, double kpy, double kpz)
+    {
+        const double dx     = svx - pvx;
+        const double dy     = svy - pvy;
+        const double dz     = svz - pvz;
+
+        const double had_pt = get_transverse(dx, dy, dz, kpx, kpy, kpz);
+        const double ll_pt  = get_transverse(dx, dy, dz, l1x + l2x, l1y + l2y, l1z + l2z);
+
+        // NaNs fail the comparison, these candidates get 1
+        return ll_pt > 0 ? had_pt / ll_pt : 1.0;
+    }
+
+    // Mass of the sum of the leptons, with momenta scaled by alpha keeping their masses, and the kaon
+    // Like in ROOT, negative squared masses are kept, energies are at least zero and negative squared masses give negative masses
+    inline double get_mass(
+            double alpha,
+            double l1x, double l1y, double l1z, double l1e,
+            double l2x, double l2y, double l2z, double l2e,
+            double kpx, double kpy, double kpz, double kpe)
+    {
+        double px = kpx;
+        double py = kpy;
+        double pz = kpz;
+        double e  = kpe;
+
+        for (const auto& [x, y, z, ee] : {std::array<double, 4>{l1x, l1y, l1z, l1e}, std::array<double, 4>{l2x, l2y, l2z, l2e}})
+        {
+            const double m2 = ee * ee - x * x - y * y - z * z;
+            const double p2 = alpha * alpha * (x * x + y * y + z * z);
+
+            px += alpha * x;
+            py += alpha * y;
+            pz += alpha * z;
+            e  += std::sqrt(std::max(p2 + m2, 0.0));
+        }
+
+        const double m2 = e * e - px * px - py * py - pz * pz;
+
+        return m2 >= 0 ? std::sqrt(m2) : -std::sqrt(-m2);
+    }
+}
+
+#endif
@@ -8,8 +8,12 @@ Script used to create small trees with extra branches from input trees
 
 import os
 import glob
+import socket
+import shutil
 import fnmatch
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
 
 import tqdm
@@ -17,6 +21,14 @@ from ROOT                   import RDataFrame
 from dmu.logging.log_store  import LogStore
 from dmu.generic            import version_management as vman
 
+import rx_data.utilities         as ut
+import rx_data.file_manifest     as fman
+import rx_data.stage_timer       as stm
+from rx_data.cost_cache          import CostCache
+from rx_data.stage_timer         import StageTimer
+from rx_data.prefetcher          import Prefetcher
+from rx_data.work_queue          import WorkQueue
+from rx_data.column_fetcher      import ColumnFetcher
 from rx_data.mis_calculator      import MisCalculator
 from rx_data.hop_calculator      import HOPCalculator
 from rx_data.swp_calculator      import SWPCalculator
@@ -30,8 +42,22 @@ class Data:
     Class used to hold shared data
     '''
     vers : str
-    kind : str
+    kinds: list[str]
     nmax : int
+    chunk: int
+    engine: str
+    workers: int
+    balance: str
+    cost_path: str
+    incremental: bool
+    checksum: bool
+    timing: bool
+    prefetch: int
+    budget: int
+    scratch: str
+    queue: bool
+    retries: int
+    adopt: bool
     part : tuple[int,int]
     pbar : bool
     dry  : bool
@@ -40,27 +66,61 @@ class Data:
 
     l_kind    = ['hop', 'swp_jpsi_misid', 'swp_cascade', 'ecalo_bias', 'brem_track_1', 'brem_track_2']
     l_ecorr   = ['ecalo_bias', 'brem_track_1', 'brem_track_2']
+    l_balance = ['size', 'entries', 'cost']
     tree_name = 'DecayTree'
+    # Lepton and hadron mass hypotheses of swaps
+    d_swp     = {
+            'swp_jpsi_misid' : ({'L1' :  13, 'L2' :  13}, {'H' :  13}),
+            'swp_cascade'    : ({'L1' : 211, 'L2' : 211}, {'H' : 321})}
 # ---------------------------------
 def _parse_args() -> None:
     '''
     Parse arguments
     '''
     parser = argparse.ArgumentParser(description='Script used to create ROOT files with trees with extra branches by picking up inputs from directory and patitioning them')
-    parser.add_argument('-k', '--kind', type=str, help='Kind of branch to create', choices=Data.l_kind, required=True)
+    parser.add_argument('-k', '--kind', type=str, help='Kind(s) of branch to create, with several kinds, each input is read once', choices=Data.l_kind, nargs='+', required=True)
     parser.add_argument('-v', '--vers', type=str, help='Version of outputs', required=True)
     parser.add_argument('-w', '--wc'  , type=str, help='Wildcard, if passed will be used to match paths')
     parser.add_argument('-n', '--nmax', type=int, help='If used, limit number of entries to process to this value')
-    parser.add_argument('-p', '--part', nargs= 2, help='Partitioning, first number is the index, second is the number of parts', required=True)
+    parser.add_argument('-c', '--chunk', type=int, help='If used, electron corrections will be done in chunks of this number of entries, to cap memory usage')
+    parser.add_argument('-e', '--engine', type=str, help='Engine used for electron corrections', choices=MassBiasCorrector.l_engine, default='numpy')
+    parser.add_argument('-p', '--part', nargs= 2, help='Partitioning, first number is the index, second is the number of parts, needed unless -q is used')
+    parser.add_argument('-q', '--queue',          help='If used, instead of partitioning, the files will be taken from a queue shared by all the jobs, until all are processed. Files that failed are not retried, unless -R is used', action='store_true')
+    parser.add_argument('-R', '--retries', type=int, help='With -q, number of times files that failed, in this or previous runs, are processed again', default=0)
+    parser.add_argument('-j', '--workers', type=int, help='Number of processes used to create the files of this partition, one file per process at a time', default=1)
+    parser.add_argument('-B', '--balance', type=str, help='Quantity used to balance partitions: file size, number of entries or cost estimated from previous runs, which needs earlier runs with -t', choices=Data.l_balance, default='size')
+    parser.add_argument('-I', '--incremental',    help='If used, outputs of previous versions made from the same inputs will be reused', action='store_true')
+    parser.add_argument('-C', '--checksum',       help='If used, inputs whose modification time changed will be compared with a checksum of the whole file', action='store_true')
+    parser.add_argument('-a', '--adopt',          help='If used, existing outputs without manifest, e.g. made before manifests were introduced, will be kept and get a manifest', action='store_true')
+    parser.add_argument('-t', '--timing',         help='If used, will measure time spent in each stage, for each file, and save a report', action='store_true')
+    parser.add_argument('-P', '--prefetch', type=int, help='Number of input files to read in the background, ahead of the one being processed', default=0)
+    parser.add_argument('-M', '--budget'  , type=int, help='Maximum size, in MB, of the files prefetched', default=4096)
+    parser.add_argument('-S', '--scratch' , type=str, help='If used, prefetched files will be copied to this directory, otherwise they will be only read, to be in the page cache')
     parser.add_argument('-b', '--pbar',           help='If used, will show progress bar whenever it is available', action='store_true')
     parser.add_argument('-d', '--dry' ,           help='If used, will do dry drun, e.g. stop before processing', action='store_true')
     parser.add_argument('-l', '--lvl' , type=int, help='log level', choices=[10, 20, 30], default=20)
     args = parser.parse_args()
+    if args.part is None and not args.queue:
+        parser.error('Either -p or -q has to be used')
 
-    Data.kind = args.kind
+    Data.kinds= args.kind
     Data.vers = args.vers
     Data.part = args.part
     Data.nmax = args.nmax
+    Data.chunk= args.chunk
+    Data.engine=args.engine
+    Data.workers=args.workers
+    Data.balance=args.balance
+    Data.cost_path=f'{os.environ["DATADIR"]}/branch_calculator/costs.json'
+    Data.incremental=args.incremental
+    Data.checksum=args.checksum
+    Data.timing=args.timing
+    Data.prefetch=args.prefetch
+    Data.budget=args.budget
+    Data.scratch=args.scratch
+    Data.queue=args.queue
+    Data.retries=args.retries
+    Data.adopt=args.adopt
     Data.pbar = args.pbar
     Data.dry  = args.dry
     Data.lvl  = args.lvl
@@ -76,13 +136,35 @@ def _get_path_size(path : str) -> int:
 
     return size
 # ---------------------------------
+def _get_weights(l_path : list[str]) -> dict[str,float]:
+    '''
+    Returns dictionary mapping paths to the quantity used to balance the partitions
+    '''
+    if Data.balance == 'size':
+        return { path : _get_path_size(path) for path in l_path }
+
+    d_entries = { path : ut.get_entries(path, Data.tree_name) for path in l_path }
+    if Data.balance == 'entries':
+        return d_entries
+
+    if Data.balance != 'cost':
+        raise ValueError(f'Invalid balance: {Data.balance}')
+
+    # Cost is entries times time per entry of each kind of branch made for the file
+    d_rate = CostCache(Data.cost_path).get_rates(kinds=Data.kinds, version=Data.vers)
+    for kind, rate in d_rate.items():
+        log.debug(f'{kind:<20}{rate:.3e} s/entry')
+
+    return { path : nentries * sum(d_rate[kind] for kind in _get_kinds(path)) for path, nentries in d_entries.items() }
+# ---------------------------------
 def _get_partition(l_path : list[str]) -> list[str]:
     igroup, ngroup = Data.part
     igroup = int(igroup)
     ngroup = int(ngroup)
 
-    d_path      = { path : _get_path_size(path) for path in l_path }
-    sorted_files= sorted(d_path.items(), key=lambda x: x[1], reverse=True)
+    d_path      = _get_weights(l_path)
+    # Ties are broken by path, such that all the jobs build the same groups
+    sorted_files= sorted(d_path.items(), key=lambda x: (-x[1], x[0]))
 
     groups      = {i: [] for i in range(ngroup)}
     group_sizes = {i: 0  for i in range(ngroup)}
@@ -105,25 +187,32 @@ def _get_partition(l_path : list[str]) -> list[str]:
 # ---------------------------------
 def _print_groups(group : dict[int,list[str]], sizes : dict[int,float], this_group : int) -> None:
     log.info(30 * '-')
-    log.info(f'{"Group":<10}{"NFiles":<10}{"Size":<10}')
+    log.info(f'{"Group":<10}{"NFiles":<10}{Data.balance.capitalize():<10}')
     log.info(30 * '-')
     for igroup, l_file in group.items():
         size  = sizes[igroup]
         nfile = len(l_file)
 
         if igroup == this_group:
-            log.info(f'{igroup:<10}{nfile:<10}{size:<10}{"<---":<10}')
+            log.info(f'{igroup:<10}{nfile:<10}{size:<10.0f}{"<---":<10}')
         else:
-            log.info(f'{igroup:<10}{nfile:<10}{size:<10}')
+            log.info(f'{igroup:<10}{nfile:<10}{size:<10.0f}')
 
     log.info(30 * '-')
 # ---------------------------------
+def _get_kinds(path : str) -> list[str]:
+    '''
+    Returns kinds of branches to create for a given input, electron corrections are not done for muon files
+    '''
+    if 'MuMu' not in path:
+        return Data.kinds
+
+    return [ kind for kind in Data.kinds if kind not in Data.l_ecorr ]
+# ---------------------------------
 def _filter_paths(l_path : list[str]) -> list[str]:
     ninit = len(l_path)
     log.debug(f'Filtering {ninit} paths')
-    if Data.kind in Data.l_ecorr:
-        # For electron corrections, drop muon paths
-        l_path = [ path for path in l_path if 'MuMu' not in path ]
+    l_path = [ path for path in l_path if len(_get_kinds(path)) > 0 ]
 
     if Data.wild_card is not None:
         l_path = [ path for path in l_path if fnmatch.fnmatch(path, f'*{Data.wild_card}*') ]
@@ -138,7 +227,11 @@ def _get_paths() -> list[str]:
     data_dir = vman.get_last_version(dir_path=f'{data_dir}/main', version_only=False)
     l_path   = glob.glob(f'{data_dir}/*.root')
     l_path   = _filter_paths(l_path)
-    l_path   = _get_partition(l_path)
+    if Data.queue:
+        # Largest files are processed first, such that the smallest ones fill the gaps at the end
+        l_path = sorted(l_path, key=_get_path_size, reverse=True)
+    else:
+        l_path = _get_partition(l_path)
 
     nfiles   = len(l_path)
     if nfiles == 0:
@@ -148,20 +241,19 @@ def _get_paths() -> list[str]:
 
     return l_path
 # ---------------------------------
-def _get_out_dir() -> str:
-    out_dir  = os.environ['DATADIR']
-    out_dir  = f'{out_dir}/{Data.kind}/{Data.vers}'
+def _get_out_dirs() -> dict[str,str]:
+    data_dir = os.environ['DATADIR']
+    d_out_dir= { kind : f'{data_dir}/{kind}/{Data.vers}' for kind in Data.kinds }
 
     if not Data.dry:
-        os.makedirs(out_dir, exist_ok=True)
+        for out_dir in d_out_dir.values():
+            os.makedirs(out_dir, exist_ok=True)
 
-    return out_dir
+    return d_out_dir
 # ---------------------------------
-def _get_out_path(path : str) -> str:
+def _get_out_path(path : str, kind : str) -> str:
     fname    = os.path.basename(path)
-    out_path = f'{Data.out_dir}/{fname}'
-
-    log.debug(f'Creating : {out_path}')
+    out_path = f'{Data.d_out_dir[kind]}/{fname}'
 
     return out_path
 # ---------------------------------
@@ -174,55 +266,297 @@ def _is_mc(path : str) -> bool:
 
     raise ValueError(f'Cannot determine if MC or data for: {path}')
 # ---------------------------------
-def _create_file(path : str, trigger : str) -> None:
-    out_path = _get_out_path(path)
-    if os.path.isfile(out_path):
-        log.debug(f'Output found, skipping {out_path}')
-        return
+def _get_settings(kind : str) -> dict:
+    '''
+    Returns settings that change the content of the outputs of a given kind, stored in their manifests
+    '''
+    d_set = {'nmax' : Data.nmax}
+    # The root engine does not drop entries with NaNs
+    if kind in Data.l_ecorr:
+        d_set['engine'] = Data.engine
+
+    return d_set
+# ---------------------------------
+def _is_up_to_date(out_path : str, path : str, fingerprint : dict, kind : str, same_code : bool = False) -> bool:
+    '''
+    Checks if output was made from input in `path`, see file_manifest.is_up_to_date
+    With checksums, the checksum of the input is calculated, once, only if the modification time and partial hash do not match
+    '''
+    settings = _get_settings(kind)
+    if fman.is_up_to_date(out_path, fingerprint, settings, same_code=same_code):
+        return True
+
+    if not Data.checksum or 'checksum' in fingerprint or not os.path.isfile(out_path):
+        return False
+
+    fman.add_checksum(fingerprint, path)
+
+    return fman.is_up_to_date(out_path, fingerprint, settings, same_code=same_code)
+# ---------------------------------
+def _get_missing_kinds(path : str, fingerprint : dict) -> list[str]:
+    '''
+    Returns kinds for which the output is missing, was not completed or is stale
+    '''
+    l_kind = []
+    for kind in _get_kinds(path):
+        out_path = _get_out_path(path, kind)
+        if Data.adopt and fman.adopt(out_path, fingerprint, _get_settings(kind), Data.tree_name):
+            continue
+
+        if _is_up_to_date(out_path, path, fingerprint, kind):
+            log.debug(f'Output found, skipping {out_path}')
+            continue
 
+        l_kind.append(kind)
+
+    return l_kind
+# ---------------------------------
+def _get_tmp_path(path : str, kind : str) -> str:
+    '''
+    Outputs are written to this path and only moved to the final one when they are complete
+    The path is unique to this process, such that jobs processing the same input do not write to the same file
+    '''
+    out_path = _get_out_path(path, kind)
+
+    return f'{out_path}.{socket.gethostname()}_{os.getpid()}.part'
+# ---------------------------------
+def _finalize_output(path : str, kind : str, fingerprint : dict) -> None:
+    tmp_path = _get_tmp_path(path, kind)
+    out_path = _get_out_path(path, kind)
+
+    # Needed to find this output from copies of the input, e.g. in a new version of the inputs
+    if Data.checksum:
+        fman.add_checksum(fingerprint, path)
+
+    # Otherwise, if the job dies before writing the new manifest, the new output would be described by the old one
+    fman.remove_manifest(out_path)
+    os.replace(tmp_path, out_path)
+    fman.write_manifest(out_path, fingerprint, _get_settings(kind))
+
+    log.debug(f'Created: {out_path}')
+# ---------------------------------
+def _remove_tmp_outputs(path : str, l_kind : list[str]) -> None:
+    '''
+    Removes outputs left in temporary paths, e.g. by calculators that failed
+    '''
+    for kind in l_kind:
+        tmp_path = _get_tmp_path(path, kind)
+        if os.path.isfile(tmp_path):
+            log.debug(f'Removing: {tmp_path}')
+            os.remove(tmp_path)
+# ---------------------------------
+def _get_old_dirs(kind : str) -> list[str]:
+    '''
+    Returns directories with outputs of other versions, newest first
+    '''
+    data_dir  = os.environ['DATADIR']
+    l_dir     = glob.glob(f'{data_dir}/{kind}/*')
+    l_dir     = [ dir_path for dir_path in l_dir if os.path.isdir(dir_path) and os.path.basename(dir_path) != Data.vers ]
+
+    return sorted(l_dir, key=os.path.getmtime, reverse=True)
+# ---------------------------------
+def _link_file(src_path : str, tgt_path : str) -> None:
+    '''
+    Hard links file, copies it if that is not possible, e.g. it is in a different filesystem
+    '''
+    try:
+        os.link(src_path, tgt_path)
+    except OSError as exc:
+        log.debug(f'Cannot link {src_path}, copying it: {exc}')
+        shutil.copy2(src_path, tgt_path)
+# ---------------------------------
+def _reuse_output(path : str, kind : str, fingerprint : dict) -> bool:
+    '''
+    Looks for output of a previous version made from the same input, with the same settings and code
+    If found, it is linked to the output path and true is returned
+    '''
+    fname = os.path.basename(path)
+    for old_dir in _get_old_dirs(kind):
+        old_path = f'{old_dir}/{fname}'
+        if not _is_up_to_date(old_path, path, fingerprint, kind, same_code=True):
+            continue
+
+        tmp_path = _get_tmp_path(path, kind)
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+        try:
+            _link_file(old_path, tmp_path)
+            _finalize_output(path, kind, fingerprint)
+        except BaseException:
+            _remove_tmp_outputs(path, [kind])
+            raise
+        log.debug(f'Reused: {old_path}')
+
+        return True
+
+    return False
+# ---------------------------------
+def _save_empty(path : str, kind : str) -> None:
+    rdf=RDataFrame(0)
+    rdf=rdf.Define('fake_column', '1')
+    rdf.Snapshot(Data.tree_name, _get_tmp_path(path, kind))
+# ---------------------------------
+def _streams_ecorr() -> bool:
+    '''
+    True if the electron corrections are done while the input is read, instead of on columns read in memory
+    '''
+    return Data.chunk is not None or Data.engine == 'root'
+# ---------------------------------
+def _get_fetcher(rdf : RDataFrame, l_kind : list[str]) -> ColumnFetcher:
+    '''
+    Returns object reading, in one event loop, the columns needed by all the calculators
+    '''
+    # The electron corrections need the brem columns to be preprocessed, the other calculators do not use them
+    use_ecorr = any(kind in Data.l_ecorr for kind in l_kind)
+    if use_ecorr and not _streams_ecorr():
+        rdf = ut.preprocess_rdf(rdf)
+
+    return ColumnFetcher(rdf=rdf)
+# ---------------------------------
+def _get_calculators(rdf : RDataFrame, path : str, l_kind : list[str]) -> list[tuple[object,list[str]]]:
+    '''
+    Returns list of tuples with calculator and kinds of branches it makes
+    All the swaps are done by the same calculator and the calculators share the columns read from the input
+    '''
+    fetcher= _get_fetcher(rdf, l_kind)
+    l_calc = []
+    l_swp  = [ kind for kind in l_kind if kind in Data.d_swp ]
+    if len(l_swp) > 0:
+        l_hyp = [ (*Data.d_swp[kind], kind) for kind in l_swp ]
+        obj   = SWPCalculator(rdf=rdf, hypotheses=l_hyp, fetcher=fetcher)
+        l_calc.append((obj, l_swp))
+
+    if 'hop' in l_kind:
+        obj = HOPCalculator(rdf=rdf, fetcher=fetcher)
+        l_calc.append((obj, ['hop']))
+
+    for kind in l_kind:
+        if kind not in Data.l_ecorr:
+            continue
+
+        skip_correction = _is_mc(path) and kind == 'ecalo_bias'
+        if skip_correction:
+            log.warning('Turning off ecalo_bias correction for MC sample')
+
+        ecorr_fetcher = None if _streams_ecorr() else fetcher
+        obj = MassBiasCorrector(rdf=rdf, skip_correction=skip_correction, ecorr_kind=kind, engine=Data.engine, fetcher=ecorr_fetcher)
+        l_calc.append((obj, [kind]))
+
+    return l_calc
+# ---------------------------------
+def _save_outputs(obj : object, l_kind : list[str], path : str, trigger : str, timer : StageTimer) -> None:
+    '''
+    Writes outputs of calculator to temporary paths
+    '''
+    [kind, *_] = l_kind
+    if   kind == 'hop':
+        with timer.stage('calculator'):
+            rdf = obj.get_rdf(preffix=kind)
+
+        with timer.stage('snapshot'):
+            rdf.Snapshot(Data.tree_name, _get_tmp_path(path, kind))
+    elif kind in Data.l_ecorr:
+        tmp_path = _get_tmp_path(path, kind)
+        # The root engine keeps the input columns, save will write only the corrected ones
+        # calculation and writing happen in the same loop
+        if _streams_ecorr():
+            with timer.stage('snapshot'):
+                obj.save(out_path=tmp_path, tree_name=Data.tree_name, suffix=kind, chunk_size=Data.chunk)
+            return
+
+        with timer.stage('calculator'):
+            rdf = obj.get_rdf(suffix=kind)
+
+        with timer.stage('snapshot'):
+            rdf.Snapshot(Data.tree_name, tmp_path)
+    elif kind in Data.d_swp:
+        # TODO: Remove the SS condition for the SWPCalculator
+        # When the data ntuples with fixed descriptor be ready
+        is_ss = 'SameSign' in trigger
+        with timer.stage('calculator'):
+            rdf = obj.get_rdf(progress_bar=Data.pbar, use_ss=is_ss)
+
+        with timer.stage('snapshot'):
+            for swp_kind in l_kind:
+                l_col = [f'{swp_kind}_mass_org', f'{swp_kind}_mass_swp', 'EVENTNUMBER', 'RUNNUMBER']
+                rdf.Snapshot(Data.tree_name, _get_tmp_path(path, swp_kind), l_col)
+    else:
+        raise ValueError(f'Invalid kind: {kind}')
+# ---------------------------------
+def _create_file(path : str, trigger : str, timer : StageTimer) -> None:
+    # Dry runs stop before opening the inputs
     if Data.dry:
         return
 
-    rdf = RDataFrame(Data.tree_name, path)
-    nentries = rdf.Count().GetValue()
+    fingerprint = fman.get_fingerprint(path, Data.tree_name)
+    l_kind      = _get_missing_kinds(path, fingerprint)
+    if len(l_kind) == 0:
+        return
+
+    if Data.incremental:
+        l_kind = [ kind for kind in l_kind if not _reuse_output(path, kind, fingerprint) ]
+        if len(l_kind) == 0:
+            return
+
+    # Read from the header of the tree, no event loop is needed
+    nentries = fingerprint['entries']
     if nentries == 0:
         log.warning(f'Found empty input file: {path}/{Data.tree_name}')
-        rdf=RDataFrame(0)
-        rdf=rdf.Define('fake_column', '1')
-        rdf.Snapshot(Data.tree_name, out_path)
+        for kind in l_kind:
+            try:
+                _save_empty(path, kind)
+                _finalize_output(path, kind, fingerprint)
+            except BaseException:
+                _remove_tmp_outputs(path, [kind])
+                raise
         return
 
+    timer.set_entries(nentries if Data.nmax is None else min(nentries, Data.nmax))
+    with timer.stage('open'):
+        rdf = RDataFrame(Data.tree_name, path)
+
     if Data.nmax is not None:
         log.warning(f'Limitting dataframe to {Data.nmax} entries')
         rdf=rdf.Range(Data.nmax)
 
-    msc = MisCalculator(rdf=rdf, trigger=trigger)
-    rdf = msc.get_rdf()
-
-    # TODO: Remove the SS condition for the SWPCalculator
-    # When the data ntuples with fixed descriptor be ready
-    is_ss = 'SameSign' in trigger
-
-    if   Data.kind == 'hop':
-        obj = HOPCalculator(rdf=rdf)
-        rdf = obj.get_rdf(preffix=Data.kind)
-    elif Data.kind in Data.l_ecorr:
-        skip_correction = _is_mc(path) and Data.kind == 'ecalo_bias'
-        if skip_correction:
-            log.warning('Turning off ecalo_bias correction for MC sample')
-
-        cor = MassBiasCorrector(rdf=rdf, skip_correction=skip_correction, ecorr_kind=Data.kind)
-        rdf = cor.get_rdf(suffix=Data.kind)
-    elif Data.kind == 'swp_jpsi_misid':
-        obj = SWPCalculator(rdf=rdf, d_lep={'L1' :  13, 'L2' :  13}, d_had={'H' :  13})
-        rdf = obj.get_rdf(preffix=Data.kind, progress_bar=Data.pbar, use_ss=is_ss)
-    elif Data.kind == 'swp_cascade'   :
-        obj = SWPCalculator(rdf=rdf, d_lep={'L1' : 211, 'L2' : 211}, d_had={'H' : 321})
-        rdf = obj.get_rdf(preffix=Data.kind, progress_bar=Data.pbar, use_ss=is_ss)
-    else:
-        raise ValueError(f'Invalid kind: {Data.kind}')
+    with timer.stage('mis'):
+        msc = MisCalculator(rdf=rdf, trigger=trigger)
+        rdf = msc.get_rdf()
+
+    with timer.stage('calculator'):
+        l_calc = _get_calculators(rdf, path, l_kind)
+
+    d_seconds = {}
+    for obj, l_obj_kind in l_calc:
+        start = timer.get_seconds(['calculator', 'snapshot'])
+        try:
+            _save_outputs(obj, l_obj_kind, path, trigger, timer)
+            for kind in l_obj_kind:
+                _finalize_output(path, kind, fingerprint)
+        except BaseException:
+            _remove_tmp_outputs(path, l_obj_kind)
+            raise
+
+        # Kinds made by the same calculator, e.g. several swaps, share its time
+        seconds = (timer.get_seconds(['calculator', 'snapshot']) - start) / len(l_obj_kind)
+        d_seconds.update({ kind : seconds for kind in l_obj_kind })
+
+    _record_cost(path, nentries, d_seconds)
+# ---------------------------------
+def _record_cost(path : str, nentries : int, d_seconds : dict[str,float]) -> None:
+    '''
+    Stores time spent calculating and writing each kind of output, used to balance partitions with the cost model
+    Only done when timing is requested, to avoid locking the shared file in every job
+    '''
+    if not Data.timing or Data.nmax is not None:
+        return
 
-    rdf.Snapshot(Data.tree_name, out_path)
+    cache = CostCache(Data.cost_path)
+    try:
+        cache.add(version=Data.vers, name=os.path.basename(path), entries=nentries, d_seconds=d_seconds)
+    except OSError as exc:
+        log.warning(f'Cannot record processing time in {Data.cost_path}: {exc}')
 # ---------------------------------
 def _trigger_from_path(path : str) -> str:
     ichar   = path.index('Hlt2')
@@ -237,6 +571,180 @@ def _trigger_from_path(path : str) -> str:
 
     return trigger
 # ---------------------------------
+def _process_file(path : str) -> dict:
+    '''
+    Creates outputs for input file, returns dictionary with time spent in each stage
+    '''
+    trigger = _trigger_from_path(path)
+    timer   = StageTimer(name=os.path.basename(path))
+    _create_file(path, trigger, timer)
+
+    return timer.to_dict()
+# ---------------------------------
+def _get_state() -> dict:
+    '''
+    Returns the settings of this script, needed by the worker processes
+    '''
+    l_name = ['kinds', 'vers', 'nmax', 'chunk', 'engine', 'part', 'pbar', 'dry', 'lvl', 'wild_card', 'd_out_dir', 'balance', 'cost_path', 'incremental', 'checksum', 'timing', 'queue', 'retries', 'adopt']
+
+    return { name : getattr(Data, name) for name in l_name }
+# ---------------------------------
+def _initialize_worker(d_state : dict) -> None:
+    for name, value in d_state.items():
+        setattr(Data, name, value)
+
+    LogStore.set_level('rx_data:branch_calculator', Data.lvl)
+# ---------------------------------
+def _process_in_pool(l_path : list[str], l_meas : list[dict]) -> None:
+    '''
+    Creates files in a pool of processes, each process picks the next file when it is done with the previous one.
+    The largest files are submitted first, such that the smallest ones fill the gaps at the end.
+    Time measurements of files processed are appended to `l_meas`
+    '''
+    l_path = sorted(l_path, key=_get_path_size, reverse=True)
+    if Data.prefetch > 0:
+        log.warning('Prefetching is only done when processing files one at a time, ignoring it')
+
+    # ROOT does not support forking after it has been initialized
+    ctx    = multiprocessing.get_context('spawn')
+    l_fail = []
+    with ProcessPoolExecutor(max_workers=Data.workers, mp_context=ctx, initializer=_initialize_worker, initargs=(_get_state(),)) as pool:
+        d_path = { pool.submit(_process_file, path) : path for path in l_path }
+        for future in tqdm.tqdm(as_completed(d_path), total=len(d_path), ascii=' -'):
+            path = d_path[future]
+            try:
+                l_meas.append(future.result())
+            except Exception as exc:
+                log.error(f'Failed to process {path}: {exc}')
+                l_fail.append(path)
+
+    if len(l_fail) == 0:
+        return
+
+    for path in l_fail:
+        log.info(path)
+
+    raise RuntimeError(f'Failed to process {len(l_fail)}/{len(l_path)} files, shown above')
+# ---------------------------------
+def _get_pending(l_path : list[str]) -> list[str]:
+    '''
+    Returns paths of inputs for which at least one output is missing or stale
+    '''
+    l_pend = [ path for path in l_path if len(_get_missing_kinds(path, fman.get_fingerprint(path, Data.tree_name))) > 0 ]
+    log.info(f'Found {len(l_pend)}/{len(l_path)} files with outputs to make')
+
+    return l_pend
+# ---------------------------------
+def _process_serially(l_path : list[str], l_meas : list[dict]) -> None:
+    '''
+    Creates files one after the other, while the next ones are prefetched, if requested.
+    Time measurements of files processed are appended to `l_meas`
+    '''
+    if Data.prefetch == 0 or Data.dry:
+        for path in tqdm.tqdm(l_path, ascii=' -'):
+            l_meas.append(_process_file(path))
+        return
+
+    # Files with outputs up to date are not prefetched
+    l_path = _get_pending(l_path)
+    with Prefetcher(l_path=l_path, nfiles=Data.prefetch, budget=Data.budget, scratch_dir=Data.scratch) as pre:
+        for path in tqdm.tqdm(l_path, ascii=' -'):
+            local_path = pre.get_path(path)
+            try:
+                l_meas.append(_process_file(local_path))
+            finally:
+                pre.release(path)
+# ---------------------------------
+def _get_queue_dir(l_path : list[str]) -> str:
+    '''
+    Returns directory with the markers of the files processed. It depends on the version of the inputs,
+    the settings and the version of the code, such that files processed with other ones are processed again
+    '''
+    data_dir = os.environ['DATADIR']
+    kinds    = '_'.join(sorted(Data.kinds))
+    d_key    = {kind : _get_settings(kind) for kind in Data.kinds}
+    d_key['inputs'] = os.path.dirname(l_path[0])
+    key      = fman.get_key(d_key)
+
+    return f'{data_dir}/branch_calculator/queue/{Data.vers}/{kinds}/{key}'
+# ---------------------------------
+def _run_queue(l_path : list[str]) -> tuple[list[dict],list[str]]:
+    '''
+    Creates files taken from the queue until all are processed
+    Returns time measurements of files processed and paths of files that failed
+    '''
+    l_meas = []
+    l_fail = []
+    with WorkQueue(queue_dir=_get_queue_dir(l_path), l_task=l_path, attempts=Data.retries + 1) as queue:
+        while (path := queue.claim()) is not None:
+            try:
+                l_meas.append(_process_file(path))
+            except Exception as exc:
+                log.error(f'Failed to process {path}: {exc}')
+                if queue.fail(path, str(exc)):
+                    log.warning(f'Will retry: {path}')
+                else:
+                    l_fail.append(path)
+                continue
+
+            queue.done(path)
+
+    return l_meas, l_fail
+# ---------------------------------
+def _process_queue(l_path : list[str], l_meas : list[dict]) -> None:
+    '''
+    Creates files taken from a queue shared with other jobs, with one or more processes.
+    Time measurements of files processed are appended to `l_meas`
+    '''
+    if Data.prefetch > 0:
+        log.warning('Prefetching is not done when processing files from a queue, ignoring it')
+
+    log.info(f'Using queue in: {_get_queue_dir(l_path)}')
+    if Data.workers == 1:
+        l_proc_meas, l_fail = _run_queue(l_path)
+        l_meas.extend(l_proc_meas)
+    else:
+        ctx    = multiprocessing.get_context('spawn')
+        l_fail = []
+        with ProcessPoolExecutor(max_workers=Data.workers, mp_context=ctx, initializer=_initialize_worker, initargs=(_get_state(),)) as pool:
+            l_future = [ pool.submit(_run_queue, l_path) for _ in range(Data.workers) ]
+            for future in as_completed(l_future):
+                l_proc_meas, l_proc_fail = future.result()
+                l_meas.extend(l_proc_meas)
+                l_fail.extend(l_proc_fail)
+
+    if len(l_fail) == 0:
+        return
+
+    for path in l_fail:
+        log.info(path)
+
+    raise RuntimeError(f'Failed to process {len(l_fail)} files, shown above')
+# ---------------------------------
+def _report_timing(l_meas : list[dict]) -> None:
+    '''
+    Saves time measurements of files processed in this partition and prints summary
+    '''
+    if not Data.timing:
+        return
+
+    # Files skipped, because outputs exist, are not measured
+    l_meas = [ d_meas for d_meas in l_meas if len(d_meas['stages']) > 0 ]
+    if len(l_meas) == 0:
+        log.info('No file was processed, not saving timing report')
+        return
+
+    if Data.queue:
+        name = f'queue_{socket.gethostname()}_{os.getpid()}'
+    else:
+        igroup, ngroup = Data.part
+        name = f'part_{igroup}_{ngroup}'
+
+    out_path = f'{os.environ["DATADIR"]}/branch_calculator/timing/{Data.vers}/{name}.json'
+    stm.write_report(l_meas, out_path)
+
+    log.info(f'\n{stm.get_summary(l_meas)}')
+# ---------------------------------
 def main():
     '''
     Script starts here
@@ -244,10 +752,18 @@ def main():
     _parse_args()
 
     l_path       = _get_paths()
-    Data.out_dir = _get_out_dir()
-    for path in tqdm.tqdm(l_path, ascii=' -'):
-        trigger = _trigger_from_path(path)
-        _create_file(path, trigger)
+    Data.d_out_dir = _get_out_dirs()
+    l_meas       = []
+    try:
+        # Dry runs do not process files, they would be marked as done in the queue
+        if Data.queue and not Data.dry:
+            _process_queue(l_path, l_meas)
+        elif Data.workers > 1:
+            _process_in_pool(l_path, l_meas)
+        else:
+            _process_serially(l_path, l_meas)
+    finally:
+        _report_timing(l_meas)
 # ---------------------------------
 if __name__ == '__main__':
     main()
@@ -0,0 +1,33 @@
+'''
+Script used to compile the YAML files with brem correction maps into a binary file
+'''
+import argparse
+
+from dmu.logging.log_store import LogStore
+from rx_data               import brem_maps
+
+log=LogStore.add_logger('rx_data:compile_brem_maps')
+# ------------------------------
+class Data:
+    '''
+    Data class used to store shared data
+    '''
+    out_path : str
+# ------------------------------
+def _parse_args() -> None:
+    parser = argparse.ArgumentParser(description='Script used to compile brem correction maps, needed after the YAML files with the maps change')
+    parser.add_argument('-o', '--out_path' , type=str, help='Path to output file, by default it will update the file shipped with the project')
+    args = parser.parse_args()
+
+    Data.out_path = args.out_path
+# ------------------------------
+def main():
+    '''
+    Starts here
+    '''
+    _parse_args()
+
+    brem_maps.compile_maps(out_path=Data.out_path)
+# ------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+'''
+Module with functions used by the tests to make random inputs for the calculators
+'''
+import numpy
+
+# -----------------------------------------------
+def get_data(nentries : int, seed : int = 10) -> dict[str,numpy.ndarray]:
+    '''
+    Returns dictionary with the columns read by the HOP and swap calculators:
+
+    - Momenta, energies and PDG IDs of the leptons and the kaon. The energies are smeared, such that some
+      particles are off shell, with negative squared masses
+    - Primary and decay vertices of the B
+    - Event and run numbers
+    '''
+    rng    = numpy.random.default_rng(seed=seed)
+    d_data = {}
+    for name, pdg_id, mass in [('L1', 11, 0.511), ('L2', 11, 0.511), ('H', 321, 493.7)]:
+        for axis in 'XYZ':
+            d_data[f'{name}_P{axis}'] = rng.normal(0, 5_000, nentries)
+
+        arr_p2 = d_data[f'{name}_PX'] ** 2 + d_data[f'{name}_PY'] ** 2 + d_data[f'{name}_PZ'] ** 2
+
+        d_data[f'{name}_PE'] = numpy.sqrt(arr_p2 + mass ** 2) * rng.choice([0.999, 1.0, 1.001], nentries)
+        d_data[f'{name}_ID'] = rng.choice([pdg_id, -pdg_id], nentries)
+
+    for name in ['B_BPV', 'B_END_V']:
+        for axis in 'XYZ':
+            d_data[f'{name}{axis}'] = rng.normal(0, 10, nentries)
+
+    d_data['EVENTNUMBER'] = numpy.arange(nentries)
+    d_data['RUNNUMBER'  ] = numpy.arange(nentries)
+
+    return d_data
+# -----------------------------------------------
@@ -87,3 +87,53 @@ def test_scan(energy : float):
     plt.savefig(plot_path)
     plt.close()
 # -----------------------------------------------
+# -----------------------------------------------
+def test_cell_table():
+    '''
+    Checks that the precomputed cell -> bin table agrees with translating cells to x, y and searching the bins
+    '''
+    obj = BremBiasCorrector()
+    df  = ctran.get_data()
+
+    arr_ibin, arr_region = obj.get_cell_bins(row=df.r.to_numpy(), col=df.c.to_numpy(), area=df.a.to_numpy())
+    for are, row, col, ibin, region in zip(df.a, df.r, df.c, arr_ibin, arr_region):
+        x, y = ctran.from_id_to_xy(row=row, col=col, area=are)
+        val  = obj._bfinder.find(x, y) # pylint: disable=protected-access
+
+        assert val == (None if ibin == -1 else (ibin, region))
+
+    arr_ibin, arr_region = obj.get_cell_bins(row=numpy.array([-1]), col=numpy.array([-1]), area=numpy.array([-1]))
+
+    assert arr_ibin[0]   == -1
+    assert arr_region[0] == -1
+# -----------------------------------------------
+@pytest.mark.parametrize('energy', [100, 6_000, 30_000, 80_000, 500_000])
+def test_correct_batch(energy : float):
+    '''
+    Checks that the vectorized correction agrees with the one done photon by photon
+    '''
+    obj  = BremBiasCorrector()
+    brem = _get_input(energy=energy)
+
+    arr_loc = numpy.array(Data.locations)
+    arr_are = arr_loc[:, 0]
+    arr_row = arr_loc[:, 3]
+    arr_col = arr_loc[:, 4]
+    nphoton = len(arr_loc)
+
+    arr_px, arr_py, arr_pz, arr_e = obj.correct_batch(
+            px  = numpy.full(nphoton, brem.px),
+            py  = numpy.full(nphoton, brem.py),
+            pz  = numpy.full(nphoton, brem.pz),
+            e   = numpy.full(nphoton, brem.e ),
+            row = arr_row,
+            col = arr_col,
+            area= arr_are)
+
+    for index, (are, _, _, row, col) in enumerate(Data.locations):
+        brem_corr = obj.correct(brem=brem, row=row, col=col, area=are)
+
+        assert numpy.isclose(brem_corr.px, arr_px[index])
+        assert numpy.isclose(brem_corr.py, arr_py[index])
+        assert numpy.isclose(brem_corr.pz, arr_pz[index])
+        assert numpy.isclose(brem_corr.e , arr_e[index])
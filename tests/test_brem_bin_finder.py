@@ -0,0 +1,80 @@
+'''
+Module with functions needed to test BremBinFinder class
+'''
+from importlib.resources import files
+
+import yaml
+import numpy
+import pytest
+
+from dmu.logging.log_store   import LogStore
+from rx_data.brem_bin_finder import BremBinFinder
+from rx_data                 import calo_translator as ctran
+
+log=LogStore.add_logger('rx_data:test_brem_bin_finder')
+# -----------------------------------------------
+class Data:
+    '''
+    Data class
+    '''
+    d_bound : dict[int,list]
+# -----------------------------------------------
+@pytest.fixture(scope='session', autouse=True)
+def _initialize():
+    LogStore.set_level('rx_data:brem_bin_finder', 10)
+
+    Data.d_bound = {}
+    for region in [0, 1, 2]:
+        path = files('rx_data_data').joinpath(f'brem_correction/region{region}_bins.yaml')
+        with open(path, encoding='utf-8') as ifile:
+            Data.d_bound[region] = yaml.safe_load(ifile)
+# -----------------------------------------------
+def _find_linear(x : float, y : float) -> tuple[int,int]:
+    '''
+    Reference implementation, scans all the rectangles
+    '''
+    for region, l_l_bound in Data.d_bound.items():
+        for ibin, [xmin, xmax, ymin, ymax] in enumerate(l_l_bound):
+            if (xmin < x < xmax) and (ymin < y < ymax):
+                return ibin, region
+
+    return -1, -1
+# -----------------------------------------------
+def _get_points() -> tuple[numpy.ndarray,numpy.ndarray]:
+    df    = ctran.get_data()
+    rng   = numpy.random.default_rng(seed=10)
+
+    # Centers of cells, random points and points in the edges of the bins
+    l_bnd = [ bound for l_bound in Data.d_bound.values() for bound in l_bound ]
+    arr_b = numpy.array(l_bnd)
+    arr_x = numpy.concatenate([df.x.to_numpy(), rng.uniform(-4_500, 4_500, 5_000), arr_b[:, 0], arr_b[:, 1], arr_b[:, 0]])
+    arr_y = numpy.concatenate([df.y.to_numpy(), rng.uniform(-3_500, 3_500, 5_000), arr_b[:, 2], arr_b[:, 2], arr_b[:, 2] + 1])
+
+    return arr_x, arr_y
+# -----------------------------------------------
+def test_against_linear_scan():
+    '''
+    Checks that the grid based lookup agrees with scanning the rectangles
+    '''
+    bfn          = BremBinFinder(d_bound=Data.d_bound)
+    arr_x, arr_y = _get_points()
+
+    arr_ibin, arr_region = bfn.find_array(arr_x, arr_y)
+    for x, y, ibin, region in zip(arr_x, arr_y, arr_ibin, arr_region):
+        assert (ibin, region) == _find_linear(x, y)
+
+    assert numpy.any(arr_ibin >= 0)
+# -----------------------------------------------
+@pytest.mark.parametrize('x, y', [(0, 0), (100, 200), (-2_000, 1_500), (1e6, 0), (numpy.nan, 0)])
+def test_scalar(x : float, y : float):
+    '''
+    Checks lookup of single points
+    '''
+    bfn = BremBinFinder(d_bound=Data.d_bound)
+    val = bfn.find(x, y)
+
+    ibin, region = _find_linear(x, y)
+    if ibin == -1:
+        assert val is None
+    else:
+        assert val == (ibin, region)
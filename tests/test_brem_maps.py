@@ -0,0 +1,67 @@
+'''
+Module with functions needed to test compilation and loading of brem correction maps
+'''
+import os
+
+import numpy
+import pytest
+
+from dmu.logging.log_store import LogStore
+from rx_data               import brem_maps
+
+log=LogStore.add_logger('rx_data:test_brem_maps')
+# -----------------------------------------------
+class Data:
+    '''
+    Data class
+    '''
+    out_dir = '/tmp/tests/rx_data/brem_maps'
+# -----------------------------------------------
+@pytest.fixture(scope='session', autouse=True)
+def _initialize():
+    LogStore.set_level('rx_data:brem_maps', 10)
+    os.makedirs(Data.out_dir, exist_ok=True)
+# -----------------------------------------------
+def _check_equal(d_map_1 : dict, d_map_2 : dict) -> None:
+    assert set(d_map_1) == set(d_map_2)
+
+    for name, arr_val in d_map_1.items():
+        assert numpy.array_equal(arr_val, d_map_2[name]), name
+# -----------------------------------------------
+def test_shipped():
+    '''
+    Checks that the compiled maps shipped with the project are up to date
+    '''
+    d_cmp = brem_maps._maps_from_compiled(path=brem_maps._get_path(brem_maps.Data.compiled), source_hash=brem_maps._get_source_hash()) # pylint: disable=protected-access
+
+    assert d_cmp is not None
+# -----------------------------------------------
+def test_compile():
+    '''
+    Compiles maps and checks that they agree with the YAML files
+    '''
+    path  = brem_maps.compile_maps(out_path=f'{Data.out_dir}/compiled.npz')
+    d_cmp = brem_maps.load_maps(path=path)
+    d_yml = brem_maps._maps_from_yaml() # pylint: disable=protected-access
+
+    _check_equal(d_cmp, d_yml)
+
+    arr_offset = d_cmp['corr_offset']
+
+    assert len(arr_offset) == len(d_cmp['corr_key']) + 1
+    assert arr_offset[-1]  == len(d_cmp['corr_mu'])
+# -----------------------------------------------
+def test_fallback():
+    '''
+    Checks that stale or missing compiled files are not used
+    '''
+    d_yml = brem_maps._maps_from_yaml() # pylint: disable=protected-access
+
+    d_stale            = dict(d_yml)
+    d_stale['corr_mu'] = numpy.zeros_like(d_yml['corr_mu'])
+
+    stale_path = f'{Data.out_dir}/stale.npz'
+    numpy.savez(stale_path, source_hash=numpy.array('wrong_hash'), **d_stale)
+
+    _check_equal(brem_maps.load_maps(path=stale_path)                  , d_yml)
+    _check_equal(brem_maps.load_maps(path=f'{Data.out_dir}/missing.npz'), d_yml)
@@ -3,6 +3,7 @@ Module with functions meant to test the row,col <-> x,y translation
 '''
 import os
 
+import numpy
 import pytest
 import pandas             as pnd
 import matplotlib.pyplot  as plt
@@ -167,3 +168,48 @@ def test_fully_defined():
     assert x1 == x2
     assert y1 == y2
 # --------------------------------
+# --------------------------------
+def test_geometry():
+    '''
+    Tests that the cached geometry arrays agree with the CSV file
+    '''
+    df  = ctran.get_data()
+    geo = ctran.get_geometry()
+
+    assert geo is ctran.get_geometry()
+
+    for are, row, col, x, y in df[['a', 'r', 'c', 'x', 'y']].itertuples(index=False):
+        x_geo, y_geo = ctran.from_id_to_xy(row=row, col=col, area=are)
+
+        assert x_geo == x
+        assert y_geo == y
+# --------------------------------
+@pytest.mark.parametrize('row, col, area', [(0, 0, 2), (14, 35, 3), (14.5, 35, 2), (-1, 35, 2)])
+def test_missing_cell(row : int, col : int, area : int):
+    '''
+    Tests that cells that do not exist in the detector raise
+    '''
+    with pytest.raises(ValueError):
+        ctran.from_id_to_xy(row=row, col=col, area=area)
+# --------------------------------
+def test_vectorized():
+    '''
+    Tests that the vectorized translation agrees with the scalar one and flags missing cells with NaNs
+    '''
+    df           = ctran.get_data()
+    arr_x, arr_y = ctran.from_ids_to_xy(row=df.r.to_numpy(), col=df.c.to_numpy(), area=df.a.to_numpy())
+
+    assert numpy.array_equal(arr_x, df.x.to_numpy())
+    assert numpy.array_equal(arr_y, df.y.to_numpy())
+
+    arr_row = numpy.array([14, 0, -1, 14.5, numpy.nan, 14])
+    arr_col = numpy.array([35, 0, 35,   35,        35, 35])
+    arr_are = numpy.array([ 2, 2,  2,    2,         2,  5])
+
+    arr_x, arr_y = ctran.from_ids_to_xy(row=arr_row, col=arr_col, area=arr_are)
+    x, y         = ctran.from_id_to_xy(row=14, col=35, area=2)
+
+    assert arr_x[0] == x
+    assert arr_y[0] == y
+    assert numpy.all(numpy.isnan(arr_x[1:]))
+    assert numpy.all(numpy.isnan(arr_y[1:]))
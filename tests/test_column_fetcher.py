@@ -0,0 +1,61 @@
+'''
+Module with tests for ColumnFetcher class
+'''
+import numpy
+import pytest
+from ROOT                   import RDataFrame, RDF
+from dmu.logging.log_store  import LogStore
+from rx_data.column_fetcher import ColumnFetcher
+from rx_data.hop_calculator import HOPCalculator
+from rx_data.swp_calculator import SWPCalculator
+
+import random_data as rdat
+
+log=LogStore.add_logger('rx_data:test_column_fetcher')
+# -----------------------------------------------
+@pytest.fixture(scope='session', autouse=True)
+def _initialize():
+    LogStore.set_level('rx_data:column_fetcher', 10)
+# -----------------------------------------------
+def _get_rdf(nentries : int) -> RDataFrame:
+    d_data = rdat.get_data(nentries=nentries)
+
+    return RDF.FromNumpy(d_data)
+# -----------------------------------------------
+def test_simple():
+    '''
+    Checks that requested columns are read in one event loop
+    '''
+    rdf     = _get_rdf(nentries=100)
+    fetcher = ColumnFetcher(rdf=rdf)
+    fetcher.request(['L1_PX', 'EVENTNUMBER'])
+    fetcher.request(['L2_PX', 'EVENTNUMBER'])
+
+    d_l1    = fetcher.get(['L1_PX', 'EVENTNUMBER'])
+    d_l2    = fetcher.get(['L2_PX'])
+
+    assert rdf.GetNRuns() == 1
+    assert list(d_l1) == ['L1_PX', 'EVENTNUMBER']
+    assert numpy.array_equal(d_l2['L2_PX'], rdf.AsNumpy(['L2_PX'])['L2_PX'])
+# -----------------------------------------------
+def test_calculators():
+    '''
+    Checks that calculators sharing a fetcher read the input once and give the same outputs as without it
+    '''
+    rdf     = _get_rdf(nentries=1_000)
+    d_hop   = HOPCalculator(rdf=rdf).get_rdf(preffix='hop').AsNumpy()
+    d_swp   = SWPCalculator(rdf=rdf, d_lep={'L1' : 211, 'L2' : 211}, d_had={'H' : 321}).get_rdf(preffix='swp').AsNumpy()
+    nruns   = rdf.GetNRuns()
+
+    fetcher = ColumnFetcher(rdf=rdf)
+    hop     = HOPCalculator(rdf=rdf, fetcher=fetcher)
+    swp     = SWPCalculator(rdf=rdf, d_lep={'L1' : 211, 'L2' : 211}, d_had={'H' : 321}, fetcher=fetcher)
+
+    d_hop_fetch = hop.get_rdf(preffix='hop').AsNumpy()
+    d_swp_fetch = swp.get_rdf(preffix='swp').AsNumpy()
+
+    assert rdf.GetNRuns() == nruns + 1
+    for d_org, d_new in [(d_hop, d_hop_fetch), (d_swp, d_swp_fetch)]:
+        for name, arr_org in d_org.items():
+            assert numpy.array_equal(arr_org, d_new[name], equal_nan=True), name
+# -----------------------------------------------
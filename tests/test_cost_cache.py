@@ -0,0 +1,72 @@
+'''
+Module with tests for CostCache class
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from dmu.logging.log_store import LogStore
+from rx_data.cost_cache    import CostCache
+
+log=LogStore.add_logger('rx_data:test_cost_cache')
+# -----------------------------------------------
+class Data:
+    '''
+    Data class
+    '''
+    out_dir = '/tmp/tests/rx_data/cost_cache'
+# -----------------------------------------------
+@pytest.fixture(scope='session', autouse=True)
+def _initialize():
+    LogStore.set_level('rx_data:cost_cache', 10)
+    os.makedirs(Data.out_dir, exist_ok=True)
+# -----------------------------------------------
+def _get_cache(name : str) -> CostCache:
+    path = f'{Data.out_dir}/{name}.json'
+    if os.path.isfile(path):
+        os.remove(path)
+
+    return CostCache(path)
+# -----------------------------------------------
+def _add_measurement(path : str, index : int) -> None:
+    cache = CostCache(path)
+    cache.add(version='v2', name=f'file_{index:03}.root', entries=100, d_seconds={'hop' : 1})
+# -----------------------------------------------
+def test_rates():
+    '''
+    Checks that rates are calculated only from other versions and that kinds without measurements get a default
+    '''
+    cache = _get_cache('rates')
+
+    assert cache.get_rates(kinds=['hop'], version='v2') == {'hop' : 1.0}
+
+    cache.add(version='v1', name='a.root', entries=1_000, d_seconds={'hop' : 1})
+    cache.add(version='v1', name='b.root', entries=1_000, d_seconds={'hop' : 2, 'swp_cascade' : 3})
+    cache.add(version='v2', name='a.root', entries=1_000, d_seconds={'hop' : 100})
+
+    d_rate = cache.get_rates(kinds=['hop', 'swp_cascade', 'brem_track_2'], version='v2')
+
+    assert d_rate['hop'         ] == pytest.approx(3 / 2_000)
+    assert d_rate['swp_cascade' ] == pytest.approx(3 / 1_000)
+    assert d_rate['brem_track_2'] == pytest.approx((3 / 2_000 + 3 / 1_000) / 2)
+# -----------------------------------------------
+def test_concurrent():
+    '''
+    Checks that measurements written by several processes at the same time are not lost
+    '''
+    cache = _get_cache('concurrent')
+    path  = f'{Data.out_dir}/concurrent.json'
+
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        list(pool.map(_add_measurement, [path] * 20, range(20)))
+
+    d_rate = cache.get_rates(kinds=['hop'], version='v1')
+
+    assert d_rate['hop'] == pytest.approx(1 / 100)
+
+    with open(path, encoding='utf-8') as ifile:
+        ntext = ifile.read().count('.root')
+
+    assert ntext == 20
+# -----------------------------------------------
@@ -3,6 +3,7 @@ Module used to test bias corrections
 '''
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
 import pytest
@@ -185,3 +186,47 @@ def test_correction_brem_track():
     _check_equal(df_org, df_cor, must_differ = True)
     LogStore.set_level('rx_data:electron_bias_corrector', 10)
 #-----------------------------------------
+@pytest.mark.parametrize('kind', ['ecalo_bias', 'brem_track_1', 'brem_track_2'])
+def test_columnar(kind : str):
+    '''
+    Checks that the columnar correction agrees with the row by row one
+    '''
+    LogStore.set_level('rx_data:electron_bias_corrector', 40)
+
+    df_org = _get_df(nentries = 1_000)
+    cor    = ElectronBiasCorrector(skip_correction=False)
+    df_row = df_org.apply(lambda row : cor.correct(row.copy(), 'L1', kind=kind), axis=1)
+    d_col  = cor.correct_columns(df_org, 'L1', kind=kind)
+
+    for column, arr_col in d_col.items():
+        arr_row = df_row[column].to_numpy()
+
+        assert numpy.allclose(arr_col, arr_row, rtol=1e-5), column
+
+    LogStore.set_level('rx_data:electron_bias_corrector', 10)
+#-----------------------------------------
+@pytest.mark.parametrize('kind', ['ecalo_bias', 'brem_track_1', 'brem_track_2'])
+def test_thread_safe(kind : str):
+    '''
+    Checks that a single corrector shared by several threads gives the same results as sequential calls
+    '''
+    LogStore.set_level('rx_data:electron_bias_corrector', 40)
+
+    df_org = _get_df(nentries = 1_000)
+    l_row  = [ row for _, row in df_org.iterrows() ]
+    cor    = ElectronBiasCorrector(skip_correction=False)
+
+    l_seq  = [ cor.correct_electron(row, 'L1', kind=kind) for row in l_row ]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        l_thr = list(pool.map(lambda row : cor.correct_electron(row, 'L1', kind=kind), l_row))
+
+    for (e_seq, status_seq), (e_thr, status_thr) in zip(l_seq, l_thr):
+        assert status_seq == status_thr
+
+        if e_seq is None:
+            assert e_thr is None
+        else:
+            assert e_seq.isclose(e_thr)
+
+    LogStore.set_level('rx_data:electron_bias_corrector', 10)
+#-----------------------------------------
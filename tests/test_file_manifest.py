@@ -0,0 +1,136 @@
+'''
+Module with tests for functions in file_manifest module
+'''
+import os
+import shutil
+
+import numpy
+import pytest
+import uproot
+
+from dmu.logging.log_store import LogStore
+from rx_data               import file_manifest as fman
+
+log=LogStore.add_logger('rx_data:test_file_manifest')
+# -----------------------------------------------
+class Data:
+    '''
+    Data class
+    '''
+    out_dir = '/tmp/tests/rx_data/file_manifest'
+# -----------------------------------------------
+@pytest.fixture(scope='session', autouse=True)
+def _initialize():
+    LogStore.set_level('rx_data:file_manifest', 10)
+    os.makedirs(Data.out_dir, exist_ok=True)
+# -----------------------------------------------
+def _make_file(name : str, nentries : int) -> str:
+    path = f'{Data.out_dir}/{name}.root'
+    with uproot.recreate(path) as ofile:
+        ofile['DecayTree'] = {'x' : numpy.arange(nentries)}
+
+    return path
+# -----------------------------------------------
+def test_fingerprint():
+    '''
+    Checks that fingerprint describes the input
+    '''
+    path  = _make_file('input', nentries=100)
+    d_fpr = fman.get_fingerprint(path)
+
+    assert d_fpr['entries'] == 100
+    assert d_fpr['name'   ] == 'input.root'
+    assert d_fpr['size'   ] == os.path.getsize(path)
+    assert d_fpr == fman.get_fingerprint(path)
+# -----------------------------------------------
+def test_checksum():
+    '''
+    Checks that copies of a file are the same input when the checksum is used, and that
+    outputs made with and without checksum are up to date when the input did not change
+    '''
+    path   = _make_file('input_3', nentries=100)
+    d_fpr  = fman.get_fingerprint(path, checksum=True)
+
+    copy_path = f'{Data.out_dir}/copy/input_3.root'
+    os.makedirs(os.path.dirname(copy_path), exist_ok=True)
+    shutil.copy(path, copy_path)
+
+    out_path = _make_file('output_3', nentries=100)
+    settings = {'nmax' : None}
+    fman.write_manifest(out_path, d_fpr, settings)
+
+    assert     fman.is_up_to_date(out_path, fman.get_fingerprint(copy_path, checksum=True), settings)
+    assert not fman.is_up_to_date(out_path, fman.get_fingerprint(copy_path), settings)
+    assert     fman.is_up_to_date(out_path, fman.get_fingerprint(path), settings)
+
+    fman.write_manifest(out_path, fman.get_fingerprint(path), settings)
+    assert     fman.is_up_to_date(out_path, d_fpr, settings)
+# -----------------------------------------------
+def test_up_to_date():
+    '''
+    Checks that missing, unfinished and stale outputs are found
+    '''
+    inp_path = _make_file('input_2', nentries=100)
+    out_path = f'{Data.out_dir}/output.root'
+    for path in [out_path, f'{out_path}.json']:
+        if os.path.isfile(path):
+            os.remove(path)
+
+    d_fpr    = fman.get_fingerprint(inp_path)
+    settings = {'nmax' : None}
+    assert not fman.is_up_to_date(out_path, d_fpr, settings)
+
+    # Output without manifest, e.g. job killed before finishing
+    _make_file('output', nentries=10)
+    assert not fman.is_up_to_date(out_path, d_fpr, settings)
+
+    fman.write_manifest(out_path, d_fpr, settings)
+    assert     fman.is_up_to_date(out_path, d_fpr, settings)
+    assert not fman.is_up_to_date(out_path, d_fpr, {'nmax' : 10})
+
+    # Input remade
+    inp_path = _make_file('input_2', nentries=200)
+    d_fpr    = fman.get_fingerprint(inp_path)
+    assert not fman.is_up_to_date(out_path, d_fpr, settings)
+
+    # Output being replaced, e.g. job killed after removing the old manifest
+    fman.write_manifest(out_path, d_fpr, settings)
+    fman.remove_manifest(out_path)
+    assert not os.path.isfile(f'{out_path}.json')
+    assert not fman.is_up_to_date(out_path, d_fpr, settings)
+# -----------------------------------------------
+def test_adopt():
+    '''
+    Checks that outputs without manifest get one, only if they can be read
+    '''
+    inp_path = _make_file('input_4', nentries=100)
+    d_fpr    = fman.get_fingerprint(inp_path)
+    settings = {'nmax' : None}
+
+    out_path = _make_file('output_4', nentries=100)
+    if os.path.isfile(f'{out_path}.json'):
+        os.remove(f'{out_path}.json')
+
+    assert     fman.adopt(out_path, d_fpr, settings)
+    assert     fman.is_up_to_date(out_path, d_fpr, settings)
+    # Already has manifest
+    assert not fman.adopt(out_path, d_fpr, settings)
+
+    # Output truncated, e.g. job killed while writing it
+    bad_path = f'{Data.out_dir}/output_5.root'
+    with open(out_path, 'rb') as ifile, open(bad_path, 'wb') as ofile:
+        ofile.write(ifile.read(100))
+
+    assert not fman.adopt(bad_path, d_fpr, settings)
+# -----------------------------------------------
+def test_key():
+    '''
+    Checks that keys change only when the settings change
+    '''
+    key_1 = fman.get_key({'nmax' : None, 'engine' : 'numpy'})
+    key_2 = fman.get_key({'engine' : 'numpy', 'nmax' : None})
+    key_3 = fman.get_key({'nmax' : 1000 , 'engine' : 'numpy'})
+
+    assert key_1 == key_2
+    assert key_1 != key_3
+# -----------------------------------------------
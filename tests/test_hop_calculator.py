@@ -3,14 +3,18 @@ Module containing tests for HOPVarAdder
 '''
 import os
 
+import numpy
 import yaml
 import pytest
 import matplotlib.pyplot as plt
-from ROOT                   import RDataFrame
+from ROOT                   import RDataFrame, RDF
+from ROOT.Math              import LorentzVector, XYZVector
 from dmu.logging.log_store  import LogStore
 from rx_data.hop_calculator import HOPCalculator
 from rx_data.mis_calculator import MisCalculator
 
+import random_data as rdat
+
 # ----------------------------
 class Data:
     '''
@@ -126,3 +130,60 @@ def test_data(sample : str, trigger : str):
 
     _plot_variables(rdf=rdf_org, rdf_hop=rdf_hop, name=f'data_{sample}_{trigger}')
 # ----------------------------
+def _get_reference(d_data : dict[str,numpy.ndarray], index : int) -> tuple[float,float]:
+    '''
+    Calculates HOP variables for one candidate with ROOT vectors
+    '''
+    def _get_vector(name : str):
+        if name.startswith('B_'):
+            return XYZVector(*[ float(d_data[f'{name}{axis}'][index]) for axis in 'XYZ' ])
+
+        return LorentzVector('ROOT::Math::PxPyPzE4D<double>')(*[ float(d_data[f'{name}{axis}'][index]) for axis in 'XYZE' ])
+
+    l1, l2, kp = _get_vector('L1_P'), _get_vector('L2_P'), _get_vector('H_P')
+    bp_dr      = _get_vector('B_END_V') - _get_vector('B_BPV')
+
+    had_pt = kp.Vect().Cross(bp_dr.Unit()).R()
+    ll_pt  = (l1 + l2).Vect().Cross(bp_dr.Unit()).R()
+    alpha  = had_pt / ll_pt if ll_pt > 0 else 1.0
+
+    l_lep  = [ LorentzVector('ROOT::Math::PxPyPzM4D<double>')(alpha * lep.px(), alpha * lep.py(), alpha * lep.pz(), lep.M()) for lep in [l1, l2] ]
+    mass   = (l_lep[0] + l_lep[1] + kp).M()
+
+    return alpha, mass
+# ----------------------------
+def test_vectorized():
+    '''
+    Checks the vectorized calculation against one done candidate by candidate with ROOT vectors
+    '''
+    d_data  = rdat.get_data(nentries=1_000)
+    rdf     = RDF.FromNumpy(d_data)
+
+    obj     = HOPCalculator(rdf=rdf)
+    rdf_hop = obj.get_rdf(preffix='hop')
+    d_hop   = rdf_hop.AsNumpy(['hop_alpha', 'hop_mass', 'EVENTNUMBER'])
+
+    assert numpy.array_equal(d_hop['EVENTNUMBER'], d_data['EVENTNUMBER'])
+
+    for index, (alpha, mass) in enumerate(zip(d_hop['hop_alpha'], d_hop['hop_mass'])):
+        alpha_ref, mass_ref = _get_reference(d_data, index)
+
+        assert alpha == pytest.approx(alpha_ref, rel=1e-6)
+        assert mass  == pytest.approx(mass_ref , rel=1e-5, abs=1e-3)
+# ----------------------------
+def test_define_columns():
+    '''
+    Checks that the HOP variables defined with C++ agree with the vectorized calculation
+    '''
+    d_data  = rdat.get_data(nentries=1_000)
+    rdf     = RDF.FromNumpy(d_data)
+
+    obj     = HOPCalculator(rdf=rdf)
+    d_vec   = obj.get_rdf(preffix='hop').AsNumpy(['hop_alpha', 'hop_mass'])
+
+    rdf_def = obj.define_columns(preffix='hop')
+    d_def   = rdf_def.AsNumpy(['hop_alpha', 'hop_mass'])
+
+    for name, arr_vec in d_vec.items():
+        assert numpy.allclose(arr_vec, d_def[name], rtol=1e-9), name
+# ----------------------------
@@ -6,6 +6,7 @@ import os
 import copy
 from importlib.resources import files
 
+import numpy
 import mplhep
 import pytest
 import yaml
@@ -15,8 +16,10 @@ from ROOT                        import RDataFrame, EnableImplicitMT, DisableImp
 from dmu.logging.log_store       import LogStore
 from dmu.plotting.plotter_1d     import Plotter1D as Plotter
 from rx_selection                import selection as sel
+import rx_data.utilities         as ut
 from rx_data.rdf_getter          import RDFGetter
 from rx_data.mass_bias_corrector import MassBiasCorrector
+from rx_data.column_fetcher      import ColumnFetcher
 
 log=LogStore.add_logger('rx_data:test_mass_bias_corrector')
 #-----------------------------------------
@@ -233,3 +236,95 @@ def test_brem_threshold(nbrem : int, brem_energy_threshold: float):
 
     _compare_masses(d_rdf, f'brem_{nbrem:03}/energy_{brem_energy_threshold:03}', f'$E_{{\\gamma}}>{brem_energy_threshold}$ MeV')
 #-----------------------------------------
+#-----------------------------------------
+@pytest.mark.parametrize('kind', ['ecalo_bias', 'brem_track_1', 'brem_track_2'])
+def test_engines(kind : str):
+    '''
+    Checks that the vectorized correction agrees with the row by row one
+    '''
+    DisableImplicitMT()
+
+    rdf_org = _get_rdf()
+    rdf_org = rdf_org.Range(1_000)
+
+    d_data  = {}
+    for engine in ['numpy', 'pandas']:
+        cor            = MassBiasCorrector(rdf=rdf_org, nthreads=1, ecorr_kind=kind, engine=engine)
+        rdf_cor        = cor.get_rdf()
+        d_data[engine] = rdf_cor.AsNumpy()
+
+    for column, arr_pandas in d_data['pandas'].items():
+        arr_numpy = d_data['numpy'][column]
+
+        assert numpy.allclose(arr_numpy, arr_pandas, rtol=1e-5), column
+
+    EnableImplicitMT(Data.nthreads)
+#-----------------------------------------
+@pytest.mark.parametrize('chunk_size', [300, 1_000, 5_000])
+def test_save_chunks(chunk_size : int):
+    '''
+    Checks that correcting and saving in chunks gives the same output as doing it in one go
+    '''
+    DisableImplicitMT()
+
+    rdf_org = _get_rdf()
+    rdf_org = rdf_org.Range(1_000)
+    cor     = MassBiasCorrector(rdf=rdf_org, ecorr_kind='brem_track_2')
+
+    out_path= f'{Data.plt_dir}/chunks_{chunk_size:05}.root'
+    cor.save(out_path=out_path, suffix='brem_track_2', chunk_size=chunk_size)
+
+    d_all   = cor.get_rdf(suffix='brem_track_2').AsNumpy()
+    d_chk   = RDataFrame('DecayTree', out_path).AsNumpy()
+
+    assert set(d_all) == set(d_chk)
+    for column, arr_all in d_all.items():
+        assert numpy.allclose(arr_all, d_chk[column]), column
+
+    EnableImplicitMT(Data.nthreads)
+#-----------------------------------------
+@pytest.mark.parametrize('kind', ['ecalo_bias', 'brem_track_1', 'brem_track_2'])
+def test_root_engine(kind : str):
+    '''
+    Checks that the correction done with Define agrees with the vectorized one
+    '''
+    DisableImplicitMT()
+
+    rdf_org = _get_rdf()
+    rdf_org = rdf_org.Range(1_000)
+
+    cor     = MassBiasCorrector(rdf=rdf_org, ecorr_kind=kind, engine='numpy')
+    d_numpy = cor.get_rdf(suffix=kind).AsNumpy()
+
+    cor     = MassBiasCorrector(rdf=rdf_org, ecorr_kind=kind, engine='root')
+    d_root  = cor.get_rdf(suffix=kind).AsNumpy(cor.get_columns(suffix=kind))
+
+    assert set(d_numpy) == set(d_root)
+    for column, arr_numpy in d_numpy.items():
+        assert numpy.allclose(arr_numpy, d_root[column], rtol=1e-5), column
+
+    EnableImplicitMT(Data.nthreads)
+#-----------------------------------------
+@pytest.mark.parametrize('kind', ['ecalo_bias', 'brem_track_1', 'brem_track_2'])
+def test_fetcher(kind : str):
+    '''
+    Checks that reading the input columns through a ColumnFetcher, as done in branch_calculator, gives the same output
+    '''
+    DisableImplicitMT()
+
+    rdf_org = _get_rdf()
+    rdf_org = rdf_org.Range(1_000)
+
+    cor     = MassBiasCorrector(rdf=rdf_org, ecorr_kind=kind)
+    d_org   = cor.get_rdf(suffix=kind).AsNumpy()
+
+    fetcher = ColumnFetcher(rdf=ut.preprocess_rdf(rdf_org))
+    cor     = MassBiasCorrector(rdf=rdf_org, ecorr_kind=kind, fetcher=fetcher)
+    d_ftc   = cor.get_rdf(suffix=kind).AsNumpy()
+
+    assert set(d_org) == set(d_ftc)
+    for column, arr_org in d_org.items():
+        assert numpy.allclose(arr_org, d_ftc[column], equal_nan=True), column
+
+    EnableImplicitMT(Data.nthreads)
+#-----------------------------------------
@@ -0,0 +1,67 @@
+'''
+Module with tests for Prefetcher class
+'''
+import os
+import time
+
+import pytest
+from dmu.logging.log_store import LogStore
+from rx_data.prefetcher    import Prefetcher
+
+log=LogStore.add_logger('rx_data:test_prefetcher')
+# -----------------------------------------------
+class Data:
+    '''
+    Data class
+    '''
+    inp_dir = '/tmp/tests/rx_data/prefetcher/input'
+    scr_dir = '/tmp/tests/rx_data/prefetcher/scratch'
+# -----------------------------------------------
+@pytest.fixture(scope='session', autouse=True)
+def _initialize():
+    LogStore.set_level('rx_data:prefetcher', 10)
+    os.makedirs(Data.inp_dir, exist_ok=True)
+# -----------------------------------------------
+def _make_files(nfiles : int, size : int) -> list[str]:
+    l_path = []
+    for ifile in range(nfiles):
+        path = f'{Data.inp_dir}/file_{ifile:03}.root'
+        with open(path, 'wb') as ofile:
+            ofile.write(os.urandom(size))
+
+        l_path.append(path)
+
+    return l_path
+# -----------------------------------------------
+@pytest.mark.parametrize('scratch_dir', [None, Data.scr_dir])
+def test_simple(scratch_dir : str):
+    '''
+    Checks that files are served in order, copied when requested and cleaned up
+    '''
+    l_path = _make_files(nfiles=5, size=1024 ** 2)
+    with Prefetcher(l_path=l_path, nfiles=2, budget=3, scratch_dir=scratch_dir) as pre:
+        for path in l_path:
+            # Emulates processing of previous file, while next one is fetched
+            time.sleep(0.1)
+            local_path = pre.get_path(path)
+            with open(path, 'rb') as ifile, open(local_path, 'rb') as jfile:
+                assert ifile.read() == jfile.read()
+
+            if scratch_dir is not None:
+                assert local_path.startswith(scratch_dir)
+
+            pre.release(path)
+
+    if scratch_dir is not None:
+        assert os.listdir(scratch_dir) == []
+# -----------------------------------------------
+def test_budget():
+    '''
+    Checks that files larger than the budget are not copied
+    '''
+    l_path = _make_files(nfiles=2, size=2 * 1024 ** 2)
+    with Prefetcher(l_path=l_path, nfiles=2, budget=1, scratch_dir=Data.scr_dir) as pre:
+        for path in l_path:
+            assert pre.get_path(path) == path
+            pre.release(path)
+# -----------------------------------------------
@@ -0,0 +1,54 @@
+'''
+Module with tests for StageTimer class
+'''
+import os
+import json
+import time
+
+from dmu.logging.log_store import LogStore
+from rx_data.stage_timer   import StageTimer
+import rx_data.stage_timer as stm
+
+log=LogStore.add_logger('rx_data:test_stage_timer')
+# -----------------------------------------------
+class Data:
+    '''
+    Data class
+    '''
+    out_dir = '/tmp/tests/rx_data/stage_timer'
+# -----------------------------------------------
+def test_simple():
+    '''
+    Checks that stages are measured and reported
+    '''
+    l_meas = []
+    for name in ['file_1.root', 'file_2.root']:
+        timer = StageTimer(name=name)
+        with timer.stage('open'):
+            time.sleep(0.01)
+
+        for _ in range(2):
+            with timer.stage('snapshot'):
+                time.sleep(0.01)
+
+        timer.set_entries(100)
+        l_meas.append(timer.to_dict())
+
+    d_meas = l_meas[0]
+    assert d_meas['stages']['open'    ] >= 0.01
+    assert d_meas['stages']['snapshot'] >= 0.02
+    assert abs(timer.get_seconds(['open', 'snapshot']) - l_meas[-1]['total']) < 1e-9
+    assert d_meas['peak_rss_mb'] > 0
+    assert abs(d_meas['rate'] - 100 / d_meas['total']) < 1e-6
+
+    out_path = f'{Data.out_dir}/report.json'
+    stm.write_report(l_meas, out_path)
+    with open(out_path, encoding='utf-8') as ifile:
+        assert json.load(ifile) == l_meas
+
+    summary = stm.get_summary(l_meas)
+    log.info(f'\n{summary}')
+    assert 'Total' in summary
+
+    os.remove(out_path)
+# -----------------------------------------------
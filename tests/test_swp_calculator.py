@@ -3,14 +3,19 @@ Module with tests for swap calculator class
 '''
 import os
 
+import numpy
 import pytest
 import matplotlib.pyplot as plt
-from ROOT                   import RDataFrame, EnableImplicitMT
+from particle               import Particle         as part
+from vector                 import MomentumObject4D as v4d
+from ROOT                   import RDataFrame, RDF, EnableImplicitMT
 from dmu.logging.log_store  import LogStore
 from rx_selection           import selection as sel
 from rx_data.rdf_getter     import RDFGetter
 from rx_data.swp_calculator import SWPCalculator
 
+import random_data as rdat
+
 log = LogStore.add_logger('rx_data:test_swp_calculator')
 # ----------------------------------
 class Data:
@@ -109,3 +114,63 @@ def _plot(rdf : RDataFrame, preffix : str, kind : str):
     plt.savefig(f'{Data.out_dir}/{preffix}_{kind}.png')
     plt.close('all')
 # ----------------------------------
+def _get_random_rdf(nentries : int) -> tuple[RDataFrame, dict[str,numpy.ndarray]]:
+    d_data = rdat.get_data(nentries=nentries)
+
+    return RDF.FromNumpy(d_data), d_data
+# ----------------------------------
+def _get_reference(d_data : dict[str,numpy.ndarray], index : int, kind : str, use_ss : bool) -> float:
+    '''
+    Mass of kaon and first lepton with right charge, calculated candidate by candidate
+    '''
+    def _get_vector(name : str, pdg_id : int) -> v4d:
+        mass = part.from_pdgid(pdg_id).mass
+        return v4d(px=d_data[f'{name}_PX'][index], py=d_data[f'{name}_PY'][index], pz=d_data[f'{name}_PZ'][index], m=mass)
+
+    had_id = int(d_data['H_ID'][index])
+    had    = _get_vector('H', 321 if kind == 'swp' else had_id)
+    for lep_name in ['L1', 'L2']:
+        lep_id = int(d_data[f'{lep_name}_ID'][index])
+        is_ss  = part.from_pdgid(lep_id).charge == part.from_pdgid(had_id).charge
+        if is_ss != use_ss:
+            continue
+
+        lep = _get_vector(lep_name, 211 if kind == 'swp' else lep_id)
+
+        return float((had + lep).mass)
+
+    return -999
+# ----------------------------------
+@pytest.mark.parametrize('use_ss', [True, False])
+def test_vectorized(use_ss : bool):
+    '''
+    Checks masses against a calculation done candidate by candidate
+    '''
+    rdf, d_inp = _get_random_rdf(nentries=1_000)
+    obj        = SWPCalculator(rdf, d_lep={'L1' : 211, 'L2' : 211}, d_had={'H' : 321})
+    rdf        = obj.get_rdf(preffix='cascade', use_ss=use_ss)
+    d_out      = rdf.AsNumpy(['cascade_mass_org', 'cascade_mass_swp'])
+
+    for kind in ['org', 'swp']:
+        arr_ref = [ _get_reference(d_inp, index, kind, use_ss) for index in range(1_000) ]
+
+        assert numpy.allclose(d_out[f'cascade_mass_{kind}'], arr_ref, rtol=1e-6)
+# ----------------------------------
+def test_hypotheses():
+    '''
+    Checks that calculating several hypotheses at once gives the same masses as one by one
+    '''
+    rdf, _ = _get_random_rdf(nentries=1_000)
+    l_hyp  = [
+            ({'L1' :  13, 'L2' :  13}, {'H' :  13}, 'jpsi_misid'),
+            ({'L1' : 211, 'L2' : 211}, {'H' : 321}, 'cascade')]
+
+    obj    = SWPCalculator(rdf, hypotheses=l_hyp)
+    d_all  = obj.get_rdf().AsNumpy()
+
+    for d_lep, d_had, preffix in l_hyp:
+        obj    = SWPCalculator(rdf, d_lep=d_lep, d_had=d_had)
+        d_one  = obj.get_rdf(preffix=preffix).AsNumpy()
+        for name, arr_one in d_one.items():
+            assert numpy.array_equal(arr_one, d_all[name]), name
+# ----------------------------------
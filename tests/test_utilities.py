@@ -3,7 +3,9 @@ Script meant to be used to test functions in utilities.py module
 '''
 import os
 import yaml
+import numpy
 import pytest
+import uproot
 
 from dmu.logging.log_store import LogStore
 from rx_data               import utilities as ut
@@ -48,3 +50,16 @@ def test_info_from_path(sample : str, trigger : str):
         log.info(v1)
         log.info(v2)
 # -----------------------------------------
+def test_get_entries():
+    '''
+    Tests reading number of entries from tree header
+    '''
+    out_dir = '/tmp/tests/rx_data/utilities'
+    os.makedirs(out_dir, exist_ok=True)
+
+    path = f'{out_dir}/entries.root'
+    with uproot.recreate(path) as ofile:
+        ofile['DecayTree'] = {'x' : numpy.arange(123)}
+
+    assert ut.get_entries(path) == 123
+# -----------------------------------------
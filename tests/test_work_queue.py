@@ -0,0 +1,148 @@
+'''
+Module with tests for WorkQueue class
+'''
+import os
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from dmu.logging.log_store import LogStore
+from rx_data.work_queue    import WorkQueue
+
+log=LogStore.add_logger('rx_data:test_work_queue')
+# -----------------------------------------------
+class Data:
+    '''
+    Data class
+    '''
+    out_dir = '/tmp/tests/rx_data/work_queue'
+    l_task  = [ f'/some/dir/file_{itask:03}.root' for itask in range(20) ]
+# -----------------------------------------------
+@pytest.fixture(scope='session', autouse=True)
+def _initialize():
+    LogStore.set_level('rx_data:work_queue', 10)
+# -----------------------------------------------
+def _get_queue_dir(name : str) -> str:
+    queue_dir = f'{Data.out_dir}/{name}'
+    shutil.rmtree(queue_dir, ignore_errors=True)
+
+    return queue_dir
+# -----------------------------------------------
+def _run_worker(queue_dir : str) -> list[str]:
+    l_task = []
+    with WorkQueue(queue_dir=queue_dir, l_task=Data.l_task, heartbeat=0.1, timeout=1) as queue:
+        while (task := queue.claim()) is not None:
+            time.sleep(0.01)
+            l_task.append(task)
+            queue.done(task)
+
+    return l_task
+# -----------------------------------------------
+def test_concurrent():
+    '''
+    Checks that tasks are processed once, when several workers share the queue
+    '''
+    queue_dir = _get_queue_dir('concurrent')
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        l_l_task = list(pool.map(_run_worker, 4 * [queue_dir]))
+
+    l_task = [ task for l_task in l_l_task for task in l_task ]
+
+    assert sorted(l_task) == Data.l_task
+    assert not _run_worker(queue_dir)
+# -----------------------------------------------
+def test_reclaim():
+    '''
+    Checks that tasks of workers that died are claimed and failed tasks are not retried
+    '''
+    queue_dir = _get_queue_dir('reclaim')
+    os.makedirs(queue_dir)
+
+    [task_1, task_2, *_] = Data.l_task
+    lock_path = f'{queue_dir}/{os.path.basename(task_1)}.lock'
+    with open(lock_path, 'w', encoding='utf-8') as ofile:
+        ofile.write('dead_worker')
+
+    past = time.time() - 60
+    os.utime(lock_path, (past, past))
+
+    with WorkQueue(queue_dir=queue_dir, l_task=Data.l_task, heartbeat=0.1, timeout=1) as queue:
+        assert queue.claim() == task_1
+        queue.fail(task_1, 'some error')
+
+        assert queue.claim() == task_2
+        queue.done(task_2)
+
+    assert os.path.isfile(f'{queue_dir}/{os.path.basename(task_1)}.failed')
+    assert not os.path.isfile(lock_path)
+    assert task_1 not in _run_worker(queue_dir)
+# -----------------------------------------------
+def test_heartbeat():
+    '''
+    Checks that locks of tasks being processed are kept up to date
+    '''
+    queue_dir = _get_queue_dir('heartbeat')
+    [task, *_] = Data.l_task
+    lock_path = f'{queue_dir}/{os.path.basename(task)}.lock'
+
+    with WorkQueue(queue_dir=queue_dir, l_task=Data.l_task, heartbeat=0.1, timeout=1) as queue:
+        assert queue.claim() == task
+        past = time.time() - 60
+        os.utime(lock_path, (past, past))
+        # Leaves time for the heartbeat process to start
+        time.sleep(1.0)
+
+        assert time.time() - os.path.getmtime(lock_path) < 0.5
+        queue.done(task)
+# -----------------------------------------------
+class _RacingQueue(WorkQueue):
+    '''
+    Queue where another worker finishes the first task right before it is locked
+    '''
+    def _create_lock(self, task : str) -> bool:
+        [task_1, *_] = Data.l_task
+        if task == task_1:
+            done_path = f'{self._queue_dir}/{os.path.basename(task)}.done'
+            with open(done_path, 'w', encoding='utf-8') as ofile:
+                ofile.write('other_worker')
+
+        return super()._create_lock(task)
+# -----------------------------------------------
+def test_finished_while_locking():
+    '''
+    Checks that tasks finished by another worker, between the check and the lock, are not claimed
+    '''
+    queue_dir = _get_queue_dir('finished_while_locking')
+    os.makedirs(queue_dir)
+
+    [task_1, task_2, *_] = Data.l_task
+    with _RacingQueue(queue_dir=queue_dir, l_task=Data.l_task, heartbeat=0.1, timeout=1) as queue:
+        assert queue.claim() == task_2
+        queue.done(task_2)
+
+    assert not os.path.isfile(f'{queue_dir}/{os.path.basename(task_1)}.lock')
+# -----------------------------------------------
+def test_retries():
+    '''
+    Checks that failed tasks are retried up to the number of attempts, also by later workers
+    '''
+    queue_dir = _get_queue_dir('retries')
+    [task_1, task_2, *_] = Data.l_task
+
+    with WorkQueue(queue_dir=queue_dir, l_task=Data.l_task, heartbeat=0.1, timeout=1, attempts=2) as queue:
+        assert queue.claim() == task_1
+        assert     queue.fail(task_1, 'transient error\nwith two lines')
+
+        assert queue.claim() == task_1
+        assert not queue.fail(task_1, 'transient error')
+
+        assert queue.claim() == task_2
+        queue.done(task_2)
+
+    assert task_1 not in _run_worker(queue_dir)
+
+    with WorkQueue(queue_dir=queue_dir, l_task=Data.l_task, heartbeat=0.1, timeout=1, attempts=3) as queue:
+        assert queue.claim() == task_1
+        queue.done(task_1)
+# -----------------------------------------------